@@ -0,0 +1,224 @@
+"""
+解析API（Whisper / SED / OpenSMILE）のバッチサイズとタイムアウトの自動調整
+
+- 呼び出しごとに(ファイル数, 所要時間)を記録し、直近の観測から「所要時間 = 固定時間 + ファイル数 × 1ファイルあたりの時間」を
+  重み付き最小二乗法で当てはめる（新しい観測ほど重みが大きい）
+- バッチサイズ: 予測所要時間が目標（ADAPTIVE_TARGET_LATENCY_SECONDS）に収まる最大のファイル数
+- タイムアウト: 予測所要時間 × 実測/予測の比の95パーセンタイル × 余裕係数（最小・最大で制限）
+- 観測が揃うまでは従来の値（バッチは全件、タイムアウト300秒）を使う
+- 観測はファイルに保存し、再起動後も学習結果を引き継ぐ。学習結果はメトリクスとしても公開する
+
+環境変数:
+    ADAPTIVE_TARGET_LATENCY_SECONDS  1回の呼び出しの目標所要時間（既定 60秒）
+    ADAPTIVE_MIN_BATCH / ADAPTIVE_MAX_BATCH  バッチサイズの範囲（既定 1 / 200）
+    ADAPTIVE_MIN_TIMEOUT_SECONDS / ADAPTIVE_MAX_TIMEOUT_SECONDS  タイムアウトの範囲（既定 30 / 600秒）
+    ADAPTIVE_TIMEOUT_FACTOR          タイムアウトの余裕係数（既定 2.0）
+    ADAPTIVE_STATE_PATH              保存先（既定 $SCHEDULER_STATE_DIR/adaptive_batching.json）
+"""
+
+import os
+import json
+import math
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from api.metrics import (
+    ADAPTIVE_BATCH_SIZE, ADAPTIVE_TIMEOUT_SECONDS, ADAPTIVE_SECONDS_PER_FILE,
+    ADAPTIVE_BASE_SECONDS, ADAPTIVE_FILES_PER_SECOND,
+)
+from api.structured_logging import get_logger
+
+
+logger = get_logger("adaptive_batching")
+
+# 学習対象の解析API（API_ENDPOINTSのキー）
+ENDPOINTS = ("whisper", "sed", "opensmile")
+WINDOW = 200          # 当てはめに使う直近の観測数
+MIN_OBSERVATIONS = 5  # これより少ない間は従来の値を使う
+DECAY = 0.98          # 1つ古い観測ごとの重み
+SAVE_EVERY = 10       # この回数の観測ごとに保存する
+DEFAULT_TIMEOUT = 300.0
+
+
+class EndpointModel:
+    """1つの解析APIの所要時間モデル"""
+
+    def __init__(self, observations: Iterable[Tuple[int, float]] = ()):
+        self.observations: Deque[Tuple[int, float]] = deque(observations, maxlen=WINDOW)
+        self.base = 0.0
+        self.per_file = 0.0
+        self.ratio_p95 = 1.0
+        self.fit()
+
+    @property
+    def ready(self) -> bool:
+        return len(self.observations) >= MIN_OBSERVATIONS and self.per_file > 0
+
+    def fit(self):
+        """重み付き最小二乗法で固定時間と1ファイルあたりの時間を求める"""
+        count = len(self.observations)
+        if not count:
+            return
+        sw = sx = sy = sxx = sxy = 0.0
+        for age, (files, seconds) in enumerate(reversed(self.observations)):
+            weight = DECAY ** age
+            sw += weight
+            sx += weight * files
+            sy += weight * seconds
+            sxx += weight * files * files
+            sxy += weight * files * seconds
+        variance = sw * sxx - sx * sx
+        if variance > 1e-9 * sw * sw:
+            per_file = (sw * sxy - sx * sy) / variance
+            base = (sy - per_file * sx) / sw
+        else:
+            # ファイル数がすべて同じ場合は固定時間を0とみなす
+            per_file, base = sy / sx if sx else 0.0, 0.0
+        if base < 0:
+            base, per_file = 0.0, sy / sx if sx else per_file
+        self.base, self.per_file = base, max(per_file, 1e-6)
+
+        ratios = sorted(seconds / self.predict(files) for files, seconds in self.observations)
+        self.ratio_p95 = max(1.0, ratios[min(len(ratios) - 1, math.ceil(len(ratios) * 0.95) - 1)])
+
+    def predict(self, files: int) -> float:
+        return self.base + self.per_file * max(files, 1)
+
+    def files_per_second(self) -> Optional[float]:
+        recent = list(self.observations)[-20:]
+        seconds = sum(s for _, s in recent)
+        return round(sum(f for f, _ in recent) / seconds, 3) if seconds > 0 else None
+
+
+class AdaptiveBatchSizer:
+    """解析APIごとのバッチサイズ・タイムアウトを観測から決める"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("ADAPTIVE_STATE_PATH") or os.path.join(
+            os.getenv("SCHEDULER_STATE_DIR", "/tmp/watchme_admin"), "adaptive_batching.json")
+        self.target_latency = float(os.getenv("ADAPTIVE_TARGET_LATENCY_SECONDS", "60"))
+        self.min_batch = int(os.getenv("ADAPTIVE_MIN_BATCH", "1"))
+        self.max_batch = int(os.getenv("ADAPTIVE_MAX_BATCH", "200"))
+        self.min_timeout = float(os.getenv("ADAPTIVE_MIN_TIMEOUT_SECONDS", "30"))
+        self.max_timeout = float(os.getenv("ADAPTIVE_MAX_TIMEOUT_SECONDS", "600"))
+        self.timeout_factor = float(os.getenv("ADAPTIVE_TIMEOUT_FACTOR", "2.0"))
+        self._models: Optional[Dict[str, EndpointModel]] = None
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # 保存・読み込み
+    # -------------------------------------------------------------------------
+
+    def _ensure_loaded(self) -> Dict[str, EndpointModel]:
+        # 初回利用時に保存済みの観測を読み込む（import時にはファイルを読まない）
+        if self._models is None:
+            saved: Dict[str, Any] = {}
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    saved = json.load(f).get("endpoints", {})
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning("adaptive batching state ignored", extra={"path": self.path, "error": str(e)})
+            self._models = {name: EndpointModel((int(f), float(s)) for f, s in saved.get(name, []))
+                            for name in ENDPOINTS}
+            for name in ENDPOINTS:
+                self._publish(name)
+        return self._models
+
+    def save(self):
+        """観測を一時ファイルに書いてから置き換える（一度も使っていなければ何もしない）"""
+        models = self._models
+        if models is None:
+            return
+        with self._lock:
+            state = {
+                "saved_at": datetime.now().isoformat(),
+                "endpoints": {name: [list(item) for item in model.observations] for name, model in models.items()},
+            }
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+
+    # -------------------------------------------------------------------------
+    # 観測と決定
+    # -------------------------------------------------------------------------
+
+    def observe(self, endpoint: str, files: int, seconds: float):
+        """1回の呼び出しの(ファイル数, 所要時間)を記録（タイムアウトした呼び出しは経過時間を記録する）"""
+        models = self._ensure_loaded()
+        model = models.get(endpoint)
+        if model is None or files <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            model.observations.append((files, round(seconds, 4)))
+            model.fit()
+            self._unsaved += 1
+            should_save = self._unsaved >= SAVE_EVERY
+        self._publish(endpoint)
+        if should_save:
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning("adaptive batching state not saved", extra={"path": self.path, "error": str(e)})
+
+    def batch_size(self, endpoint: str) -> Optional[int]:
+        """目標所要時間に収まる最大のファイル数（学習前はNone = 全件を1回で送る）"""
+        model = self._ensure_loaded().get(endpoint)
+        if model is None or not model.ready:
+            return None
+        files = int((self.target_latency - model.base) / model.per_file)
+        return max(self.min_batch, min(self.max_batch, files))
+
+    def timeout(self, endpoint: str, files: int) -> float:
+        """ファイル数に応じたタイムアウト（学習前は従来の300秒）"""
+        model = self._ensure_loaded().get(endpoint)
+        if model is None or not model.ready:
+            return DEFAULT_TIMEOUT
+        timeout = model.predict(files) * model.ratio_p95 * self.timeout_factor
+        return round(max(self.min_timeout, min(self.max_timeout, timeout)), 1)
+
+    def split(self, endpoint: str, file_paths: List[str]) -> List[List[str]]:
+        """ファイルを学習したバッチサイズごとに分ける"""
+        size = self.batch_size(endpoint) or len(file_paths) or 1
+        return [file_paths[start:start + size] for start in range(0, len(file_paths), size)]
+
+    def _publish(self, endpoint: str):
+        model = self._ensure_loaded()[endpoint]
+        if not model.ready:
+            return
+        size = self.batch_size(endpoint)
+        ADAPTIVE_BATCH_SIZE.labels(endpoint).set(size)
+        ADAPTIVE_TIMEOUT_SECONDS.labels(endpoint).set(self.timeout(endpoint, size))
+        ADAPTIVE_SECONDS_PER_FILE.labels(endpoint).set(model.per_file)
+        ADAPTIVE_BASE_SECONDS.labels(endpoint).set(model.base)
+        ADAPTIVE_FILES_PER_SECOND.labels(endpoint).set(model.files_per_second() or 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        models = self._ensure_loaded()
+        endpoints = {}
+        for name, model in models.items():
+            size = self.batch_size(name)
+            endpoints[name] = {
+                "ready": model.ready,
+                "observations": len(model.observations),
+                "base_seconds": round(model.base, 3),
+                "seconds_per_file": round(model.per_file, 4),
+                "latency_ratio_p95": round(model.ratio_p95, 3),
+                "files_per_second": model.files_per_second(),
+                "batch_size": size,
+                "timeout_seconds": self.timeout(name, size or 1),
+            }
+        return {
+            "target_latency_seconds": self.target_latency,
+            "batch_range": [self.min_batch, self.max_batch],
+            "timeout_range": [self.min_timeout, self.max_timeout],
+            "state_path": self.path,
+            "endpoints": endpoints,
+        }
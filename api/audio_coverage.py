@@ -0,0 +1,250 @@
+"""
+デバイス × 30分スロットの音声ファイル処理状況（カバレッジ）
+
+- デバイス1台・1日ごとに、録音の有無と3つの処理状態（文字起こし・行動特徴・感情特徴）の
+  completed / pendingを48ビットのビット列（ビットiは i*30分のスロット）で保持する
+- 未キャッシュの(デバイス, 日)だけを、デバイス100台ごとに日付範囲全体を1つのクエリ（device_id=in.(...)、recorded_atの範囲）で取得する
+  （1000行を超える分は(device_id, file_path)のキーセットでページを進めるため、日数が増えてもページ数が増えるだけ）
+- 結果は(デバイス, 日)ごとにキャッシュする。処理が進む直近の日は短く、それより前の日は長く保持する
+
+環境変数:
+    AUDIO_COVERAGE_RECENT_TTL_SECONDS  直近（今日・昨日）のキャッシュ有効期間（既定 60秒）
+    AUDIO_COVERAGE_PAST_TTL_SECONDS    それより前の日のキャッシュ有効期間（既定 3600秒）
+    AUDIO_COVERAGE_CACHE_SIZE          キャッシュする(デバイス, 日)の最大数（既定 200000）
+    AUDIO_COVERAGE_CONCURRENCY         同時に実行するクエリ数（既定 8）
+"""
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from api.metrics import CACHE_REQUESTS_TOTAL
+from api.structured_logging import get_logger
+
+
+logger = get_logger("audio_coverage")
+
+TABLE = "audio_files"
+STATUS_FIELDS = ("transcriptions_status", "behavior_features_status", "emotion_features_status")
+SLOTS_PER_DAY = 48
+SLOT_MINUTES = 30
+PAGE_SIZE = 1000
+# バックフィルの1単位に含めるデバイス数（1日分で1ページ = 1000行に収まる数）
+DEVICE_CHUNK = PAGE_SIZE // SLOTS_PER_DAY
+# カバレッジの1クエリに含めるデバイス数（in.(...) がURL長の上限に収まる数）
+COVERAGE_DEVICE_CHUNK = 100
+
+# (デバイス, 日)ごとのビット列: [録音あり, 処理状態ごとに completed, pending]
+Cell = Tuple[int, ...]
+EMPTY_CELL: Cell = (0,) * (1 + 2 * len(STATUS_FIELDS))
+COVERAGE_COLUMNS = ",".join(("device_id", "file_path", "recorded_at") + STATUS_FIELDS)
+
+
+def _slot_of(row: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """file_path（files/{device_id}/{YYYY-MM-DD}/{HH-MM}/audio.wav）から日付とスロット番号を得る"""
+    parts = (row.get("file_path") or "").split("/")
+    try:
+        day, block = parts[2], parts[3]
+        hour, minute = block.split("-")
+        return day, int(hour) * 2 + int(minute) // SLOT_MINUTES
+    except (IndexError, ValueError):
+        pass
+    recorded_at = row.get("recorded_at")
+    if not recorded_at:
+        return None
+    try:
+        recorded = datetime.fromisoformat(str(recorded_at).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if recorded.tzinfo is not None:
+        recorded = recorded.astimezone().replace(tzinfo=None)
+    return recorded.date().isoformat(), recorded.hour * 2 + recorded.minute // SLOT_MINUTES
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', '\\"') + '"'
+
+
+async def fetch_files(client, start_day: date, end_day: date, device_ids: List[str], columns: str,
+                      conditions: Optional[Dict[str, str]] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    start_day〜end_day・デバイス数十台分のaudio_filesを取得し、(行, クエリ回数)を返す
+    1000行を超える場合は(device_id, file_path)のキーセットでページを進める（columnsにはこの2列を含めること）
+    """
+    start = datetime.combine(start_day, dt_time()).astimezone()
+    end = datetime.combine(end_day + timedelta(days=1), dt_time()).astimezone()
+    where: Dict[str, Any] = {
+        "device_id": f"in.({','.join(device_ids)})",
+        "recorded_at": [f"gte.{start.isoformat()}", f"lt.{end.isoformat()}"],
+        **(conditions or {}),
+    }
+    rows: List[Dict[str, Any]] = []
+    pages = 0
+    while True:
+        page = await client.select(TABLE, columns=columns, where=where, order="device_id.asc,file_path.asc", limit=PAGE_SIZE)
+        pages += 1
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows, pages
+        last = page[-1]
+        device_id, file_path = _quote(last["device_id"]), _quote(last["file_path"])
+        where["or"] = f"(device_id.gt.{device_id},and(device_id.eq.{device_id},file_path.gt.{file_path}))"
+
+
+async def fetch_day_files(client, day: date, device_ids: List[str], columns: str,
+                          conditions: Optional[Dict[str, str]] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """1日分・デバイス数十台分のaudio_filesを取得し、(行, クエリ回数)を返す"""
+    return await fetch_files(client, day, day, device_ids, columns, conditions)
+
+
+def _hex(bits: int) -> str:
+    return format(bits, "012x")
+
+
+class AudioCoverage:
+    """デバイス × 日 × スロットの処理状況をビット列で集計する"""
+
+    def __init__(self, get_client: Callable[[], Any]):
+        self.get_client = get_client
+        self.recent_ttl = float(os.getenv("AUDIO_COVERAGE_RECENT_TTL_SECONDS", "60"))
+        self.past_ttl = float(os.getenv("AUDIO_COVERAGE_PAST_TTL_SECONDS", "3600"))
+        self.max_entries = int(os.getenv("AUDIO_COVERAGE_CACHE_SIZE", "200000"))
+        self.concurrency = int(os.getenv("AUDIO_COVERAGE_CONCURRENCY", "8"))
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[Cell, float]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "queries": 0, "rows": 0}
+
+    # -------------------------------------------------------------------------
+    # 取得
+    # -------------------------------------------------------------------------
+
+    async def _load(self, missing: Dict[str, List[str]]) -> Dict[Tuple[str, str], Cell]:
+        """未キャッシュの(デバイス, 日)を、デバイスのチャンクごとに日付範囲全体をまとめて取得し、ビット列にする"""
+        client = self.get_client()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        cells: Dict[Tuple[str, str], List[int]] = {}
+        wanted_days: Dict[str, set] = {}
+        for day, device_ids in missing.items():
+            for device_id in device_ids:
+                wanted_days.setdefault(device_id, set()).add(day)
+
+        async def load(device_ids: List[str]):
+            days = set().union(*(wanted_days[device_id] for device_id in device_ids))
+            async with semaphore:
+                rows, pages = await fetch_files(client, date.fromisoformat(min(days)), date.fromisoformat(max(days)),
+                                                device_ids, COVERAGE_COLUMNS)
+            self._stats["queries"] += pages
+            self._stats["rows"] += len(rows)
+            for row in rows:
+                device_id = row.get("device_id")
+                slot = _slot_of(row)
+                # recorded_atとfile_pathの日付がずれる行は、file_pathの日付で集計する
+                if slot is None or slot[0] not in wanted_days.get(device_id, ()) or not 0 <= slot[1] < SLOTS_PER_DAY:
+                    continue
+                cell = cells.setdefault((device_id, slot[0]), list(EMPTY_CELL))
+                bit = 1 << slot[1]
+                cell[0] |= bit
+                for index, field in enumerate(STATUS_FIELDS):
+                    status = row.get(field)
+                    if status == "completed":
+                        cell[1 + index * 2] |= bit
+                    elif status == "pending":
+                        cell[2 + index * 2] |= bit
+
+        device_ids = list(wanted_days)
+        await asyncio.gather(*[
+            load(device_ids[start:start + COVERAGE_DEVICE_CHUNK])
+            for start in range(0, len(device_ids), COVERAGE_DEVICE_CHUNK)
+        ])
+        return {(device_id, day): tuple(cells.get((device_id, day), EMPTY_CELL))
+                for day, device_ids in missing.items() for device_id in device_ids}
+
+    def _ttl(self, day: date) -> float:
+        return self.recent_ttl if day >= date.today() - timedelta(days=1) else self.past_ttl
+
+    def _store(self, key: Tuple[str, str], cell: Cell, expires_at: float):
+        self._cache[key] = (cell, expires_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    # -------------------------------------------------------------------------
+    # 集計
+    # -------------------------------------------------------------------------
+
+    async def matrix(self, device_ids: List[str], start_date: date, end_date: date, refresh: bool = False) -> Dict[str, Any]:
+        """デバイス × 日ごとのビット列と、処理状態ごとのスロット数を返す"""
+        started = time.perf_counter()
+        device_ids = list(dict.fromkeys(device_ids))
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        day_keys = [day.isoformat() for day in days]
+        now = time.monotonic()
+
+        cells: Dict[Tuple[str, str], Cell] = {}
+        missing: Dict[str, List[str]] = {}
+        for day_key in day_keys:
+            for device_id in device_ids:
+                key = (device_id, day_key)
+                cached = None if refresh else self._cache.get(key)
+                if cached is not None and cached[1] > now:
+                    self._cache.move_to_end(key)
+                    cells[key] = cached[0]
+                else:
+                    missing.setdefault(day_key, []).append(device_id)
+        missed = sum(len(ids) for ids in missing.values())
+        self._stats["hits"] += len(cells)
+        self._stats["misses"] += missed
+        CACHE_REQUESTS_TOTAL.labels("audio_coverage", "hit").inc(len(cells))
+        CACHE_REQUESTS_TOTAL.labels("audio_coverage", "miss").inc(missed)
+
+        if missing:
+            loaded = await self._load(missing)
+            expires = {day_key: now + self._ttl(day) for day, day_key in zip(days, day_keys)}
+            for key, cell in loaded.items():
+                self._store(key, cell, expires[key[1]])
+            cells.update(loaded)
+
+        matrix: Dict[str, Dict[str, Any]] = {}
+        totals = {"slots": len(device_ids) * len(days) * SLOTS_PER_DAY, "present": 0}
+        field_totals = {field: {"completed": 0, "pending": 0, "other": 0} for field in STATUS_FIELDS}
+        for device_id in device_ids:
+            row_cells = [cells[(device_id, day_key)] for day_key in day_keys]
+            entry: Dict[str, Any] = {"present": [_hex(cell[0]) for cell in row_cells]}
+            for index, field in enumerate(STATUS_FIELDS):
+                completed = [cell[1 + index * 2] for cell in row_cells]
+                pending = [cell[2 + index * 2] for cell in row_cells]
+                entry[field] = {"completed": [_hex(bits) for bits in completed], "pending": [_hex(bits) for bits in pending]}
+                done = sum(bits.bit_count() for bits in completed)
+                waiting = sum(bits.bit_count() for bits in pending)
+                field_totals[field]["completed"] += done
+                field_totals[field]["pending"] += waiting
+                field_totals[field]["other"] += sum(cell[0].bit_count() for cell in row_cells) - done - waiting
+            totals["present"] += sum(cell[0].bit_count() for cell in row_cells)
+            matrix[device_id] = entry
+
+        return {
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "days": day_keys,
+            "devices": device_ids,
+            "slot_minutes": SLOT_MINUTES,
+            "slots_per_day": SLOTS_PER_DAY,
+            "encoding": "daysと同じ順の48ビット（12桁の16進数）。ビットiは i*30分から始まるスロット",
+            "matrix": matrix,
+            "totals": {**totals, **field_totals},
+            "cache": {"hits": len(cells) - missed, "misses": missed},
+            "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def invalidate(self, device_id: Optional[str] = None):
+        """キャッシュを破棄（device_id指定時はそのデバイスの分だけ）"""
+        if device_id is None:
+            self._cache.clear()
+            return
+        for key in [key for key in self._cache if key[0] == device_id]:
+            del self._cache[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "entries": len(self._cache), "max_entries": self.max_entries}
@@ -0,0 +1,408 @@
+"""
+過去データの一括再処理（バックフィル）
+
+- 対象（デバイス × 日付範囲 × 処理）を「処理 × 日 × デバイス20台」の単位に分け、
+  単位ごとにaudio_filesから未処理（pending）のファイルを一括クエリで列挙して解析APIに送る
+- 解析APIの呼び出しはbackfillレーンで行い、さらに同時に処理する単位の数を上流の同時実行数の一部に抑える。
+  手動操作・スケジューラーの呼び出しが待っている間は次のバッチを送らずに待つ
+- 完了した単位はジョブごとのチェックポイント（JSON）に記録するため、停止・再起動後は残りの単位から再開できる
+  （失敗した単位は完了扱いにせず、再開時にもう一度処理する）。チェックポイントの読み書き・fsync・ロックの確認は別スレッドで行う
+- 解析APIへのHTTPセッションはジョブの実行ごとに1つ開き、すべてのバッチで使い回す
+- 進捗・1秒あたりのファイル数・残り時間の見込みを返す
+
+環境変数:
+    BACKFILL_STATE_DIR        チェックポイントの保存先（既定 $SCHEDULER_STATE_DIR/backfill）
+    BACKFILL_CONCURRENCY      同時に処理する単位の数（既定 2）
+    BACKFILL_MAX_SHARE        上流の同時実行数のうちバックフィルが使える割合（既定 0.25）
+    BACKFILL_BATCH_SIZE       1回の解析API呼び出しで送るファイル数（既定 100、学習したバッチサイズがあればそちらを使う）
+    BACKFILL_YIELD_SECONDS    他のレーンが待っているときに待つ間隔（既定 0.5秒）
+"""
+
+import os
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from api.audio_coverage import DEVICE_CHUNK, fetch_day_files
+from api.dispatch_queue import PriorityDispatcher, dispatch_lane
+from api.metrics import BACKFILL_FILES_TOTAL, BACKFILL_UNITS_TOTAL
+from api.structured_logging import get_logger
+
+
+logger = get_logger("backfill")
+
+# 処理名 -> audio_filesの処理状態の列
+STEP_STATUS_FIELDS = {
+    "whisper": "transcriptions_status",
+    "sed": "behavior_features_status",
+    "opensmile": "emotion_features_status",
+}
+# バックフィルと同時実行数を分け合う、優先するレーン
+LIVE_LANES = ("interactive", "scheduled")
+
+# dispatch(session, step, file_paths) -> (処理件数, 失敗件数)。呼び出し自体が失敗した場合は例外を送出する
+# sessionはopen_session()で開いた、ジョブの実行中に使い回すHTTPセッション
+Dispatch = Callable[[Any, str, List[str]], Awaitable[Tuple[int, int]]]
+
+
+class BackfillConflict(Exception):
+    """ジョブが実行中、または他のワーカーが実行している"""
+
+
+def _unit_key(step: str, day: str, chunk: int) -> str:
+    return f"{step}|{day}|{chunk}"
+
+
+class BackfillEngine:
+    """バックフィルのジョブ管理（チェックポイント・同時実行数・進捗）"""
+
+    def __init__(self, get_client: Callable[[], Any], dispatch: Dispatch, dispatcher: PriorityDispatcher,
+                 open_session: Callable[[], AsyncContextManager[Any]],
+                 state_dir: Optional[str] = None, batch_sizer: Optional[Callable[[str], Optional[int]]] = None):
+        # batch_sizer(step) は処理ごとに学習したバッチサイズ（未学習ならNone）
+        self.get_client = get_client
+        self.dispatch = dispatch
+        self.open_session = open_session
+        self.dispatcher = dispatcher
+        self.batch_sizer = batch_sizer
+        self.state_dir = state_dir or os.getenv("BACKFILL_STATE_DIR") or os.path.join(
+            os.getenv("SCHEDULER_STATE_DIR", "/tmp/watchme_admin"), "backfill")
+        self.default_concurrency = int(os.getenv("BACKFILL_CONCURRENCY", "2"))
+        self.max_share = float(os.getenv("BACKFILL_MAX_SHARE", "0.25"))
+        self.default_batch_size = int(os.getenv("BACKFILL_BATCH_SIZE", "100"))
+        self.yield_seconds = float(os.getenv("BACKFILL_YIELD_SECONDS", "0.5"))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._runs: Dict[str, Dict[str, Any]] = {}  # job_id -> このプロセスでの実行の計測値
+
+    # -------------------------------------------------------------------------
+    # チェックポイント
+    # -------------------------------------------------------------------------
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _load_job(self, job_id: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(job_id) from None
+
+    def _write_checkpoint(self, job_id: str, payload: str):
+        """一時ファイルに書いてから置き換える（途中で停止しても壊れたチェックポイントを残さない）"""
+        path = self._path(job_id)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def _save_job(self, job: Dict[str, Any]):
+        job["updated_at"] = datetime.now().isoformat()
+        self._write_checkpoint(job["job_id"], json.dumps(job, ensure_ascii=False))
+
+    async def _checkpoint(self, job: Dict[str, Any], run: Dict[str, Any]):
+        """実行中のチェックポイントを別スレッドで書き込む
+
+        内容はイベントループ上で確定させ、書き込みは前の書き込みの後に順に行う。
+        呼び出し元がキャンセルされても書き込み自体は最後まで行う（一時ファイルを取り合わない）
+        """
+        job["updated_at"] = datetime.now().isoformat()
+        payload = json.dumps(job, ensure_ascii=False)
+        previous = run.get("checkpoint")
+
+        async def write():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await asyncio.to_thread(self._write_checkpoint, job["job_id"], payload)
+
+        run["checkpoint"] = asyncio.create_task(write())
+        await asyncio.shield(run["checkpoint"])
+
+    def _try_lock(self, job_id: str) -> Optional[int]:
+        """ジョブのロックを取得（他のワーカーが実行中ならNone）"""
+        fd = os.open(f"{self._path(job_id)}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    # -------------------------------------------------------------------------
+    # ジョブの操作
+    # -------------------------------------------------------------------------
+
+    def concurrency_budget(self, requested: Optional[int] = None) -> int:
+        """同時に処理する単位の数（上流の同時実行数のmax_shareを超えない）"""
+        ceiling = max(1, int(self.dispatcher.capacity * self.max_share))
+        return max(1, min(requested or self.default_concurrency, ceiling))
+
+    async def create(self, device_ids: List[str], start_date: date, end_date: date, steps: List[str],
+                     concurrency: Optional[int] = None, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """ジョブを作成して開始する"""
+        unknown = [step for step in steps if step not in STEP_STATUS_FIELDS]
+        if unknown:
+            raise ValueError(f"不明な処理です: {', '.join(unknown)}")
+        job = {
+            "job_id": f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}",
+            "device_ids": list(dict.fromkeys(device_ids)),
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "steps": list(dict.fromkeys(steps)),
+            "concurrency": self.concurrency_budget(concurrency),
+            "batch_size": batch_size,  # Noneは自動（学習したバッチサイズ）
+            "status": "pending",
+            "completed_units": [],
+            "failed_units": {},
+            "counters": {"files_found": 0, "files_processed": 0, "files_failed": 0, "batches": 0},
+            "elapsed_seconds": 0.0,
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "last_error": None,
+        }
+        await asyncio.to_thread(self._create_job, job)
+        return await self.start(job["job_id"])
+
+    def _create_job(self, job: Dict[str, Any]):
+        os.makedirs(self.state_dir, exist_ok=True)
+        self._save_job(job)
+
+    def _claim(self, job_id: str) -> Tuple[Dict[str, Any], int]:
+        """チェックポイントを読み、ロックを取って実行中として保存する（別スレッドで呼ぶ）"""
+        job = self._load_job(job_id)
+        if job["status"] == "completed":
+            raise BackfillConflict("このジョブは完了しています")
+        fd = self._try_lock(job_id)
+        if fd is None:
+            raise BackfillConflict("このジョブは他のワーカーで実行中です")
+        try:
+            job["status"] = "running"
+            job["finished_at"] = None
+            self._save_job(job)
+        except BaseException:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            raise
+        return job, fd
+
+    async def start(self, job_id: str) -> Dict[str, Any]:
+        """チェックポイントから（再）開始する"""
+        if self._running_here(job_id):
+            raise BackfillConflict("このジョブは実行中です")
+        # 同じワーカーでの同時の開始はジョブのロックで1つに絞られる
+        job, fd = await asyncio.to_thread(self._claim, job_id)
+        self._tasks[job_id] = asyncio.create_task(self._run(job, fd))
+        return self._progress(job, running_here=True, interrupted=False)
+
+    async def pause(self, job_id: str) -> Dict[str, Any]:
+        """処理中の単位を終えたところで止める（再開は同じジョブIDで）"""
+        if not self._running_here(job_id):
+            await asyncio.to_thread(self._load_job, job_id)  # 存在しないジョブはKeyError
+            raise BackfillConflict("このジョブはこのワーカーで実行されていません")
+        self._runs[job_id]["pause_requested"] = True
+        return await self.progress(job_id)
+
+    async def close(self):
+        """実行中のジョブを止める（チェックポイントは残るため、再起動後に再開できる）"""
+        for run in self._runs.values():
+            run["pause_requested"] = True
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # -------------------------------------------------------------------------
+    # 実行
+    # -------------------------------------------------------------------------
+
+    def _units(self, job: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+        start = date.fromisoformat(job["start_date"])
+        days = [(start + timedelta(days=i)).isoformat()
+                for i in range((date.fromisoformat(job["end_date"]) - start).days + 1)]
+        chunks = range((len(job["device_ids"]) + DEVICE_CHUNK - 1) // DEVICE_CHUNK)
+        # 古い日から順に、同じ日の処理はまとめて進める
+        return [(step, day, chunk) for day in days for chunk in chunks for step in job["steps"]]
+
+    async def _wait_for_live_traffic(self):
+        """手動操作・スケジューラーの呼び出しが待っている間は送らない"""
+        while any(self.dispatcher.snapshot()["queued"][lane] for lane in LIVE_LANES):
+            await asyncio.sleep(self.yield_seconds)
+
+    async def _process_unit(self, session: Any, job: Dict[str, Any], run: Dict[str, Any], step: str, day: str, chunk: int):
+        device_ids = job["device_ids"][chunk * DEVICE_CHUNK:(chunk + 1) * DEVICE_CHUNK]
+        field = STEP_STATUS_FIELDS[step]
+        rows, _ = await fetch_day_files(self.get_client(), date.fromisoformat(day), device_ids,
+                                        "device_id,file_path,recorded_at", {field: "eq.pending"})
+        file_paths = [row["file_path"] for row in rows if row.get("file_path")]
+        job["counters"]["files_found"] += len(file_paths)
+        start = 0
+        while start < len(file_paths):
+            # 自動の場合はバッチごとに最新の学習結果を使う
+            batch_size = job["batch_size"] or (self.batch_sizer(step) if self.batch_sizer else None) or self.default_batch_size
+            batch = file_paths[start:start + batch_size]
+            start += len(batch)
+            await self._wait_for_live_traffic()
+            try:
+                processed, failed = await self.dispatch(session, step, batch)
+            except Exception:
+                job["counters"]["files_failed"] += len(batch)
+                BACKFILL_FILES_TOTAL.labels(step, "failed").inc(len(batch))
+                raise
+            job["counters"]["batches"] += 1
+            job["counters"]["files_processed"] += processed
+            job["counters"]["files_failed"] += failed
+            run["files"] += len(batch)
+            BACKFILL_FILES_TOTAL.labels(step, "processed").inc(processed)
+            BACKFILL_FILES_TOTAL.labels(step, "failed").inc(failed)
+
+    async def _run(self, job: Dict[str, Any], lock_fd: int):
+        job_id = job["job_id"]
+        # 解析APIの呼び出しはbackfillレーンに載せる（このタスクから作られるタスクにも引き継がれる）
+        dispatch_lane.set("backfill")
+        completed = set(job["completed_units"])
+        remaining = [unit for unit in self._units(job) if _unit_key(*unit) not in completed]
+        run = {"started": time.monotonic(), "units": 0, "files": 0, "pause_requested": False, "checkpoint": None}
+        self._runs[job_id] = run
+        queue: asyncio.Queue = asyncio.Queue()
+        for unit in remaining:
+            queue.put_nowait(unit)
+        logger.info("backfill started", extra={"job_id": job_id, "units": len(remaining), "concurrency": job["concurrency"]})
+
+        async def worker(session):
+            while not run["pause_requested"]:
+                try:
+                    step, day, chunk = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                key = _unit_key(step, day, chunk)
+                try:
+                    await self._process_unit(session, job, run, step, day, chunk)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    job["failed_units"][key] = str(e)[:500]
+                    job["last_error"] = str(e)[:500]
+                    BACKFILL_UNITS_TOTAL.labels(step, "failed").inc()
+                    logger.error("backfill unit failed", extra={"job_id": job_id, "unit": key, "error": str(e)})
+                else:
+                    job["failed_units"].pop(key, None)
+                    job["completed_units"].append(key)
+                    BACKFILL_UNITS_TOTAL.labels(step, "completed").inc()
+                run["units"] += 1
+                await self._checkpoint(job, run)
+
+        try:
+            async with self.open_session() as session:
+                await asyncio.gather(*(worker(session) for _ in range(job["concurrency"])))
+            if run["pause_requested"]:
+                job["status"] = "paused"
+            else:
+                job["status"] = "failed" if job["failed_units"] else "completed"
+                job["finished_at"] = datetime.now().isoformat()
+        except asyncio.CancelledError:
+            job["status"] = "paused"
+        except Exception as e:
+            job["status"] = "failed"
+            job["last_error"] = str(e)[:500]
+            logger.error("backfill failed", extra={"job_id": job_id, "error": str(e)})
+        finally:
+            job["elapsed_seconds"] = round(job["elapsed_seconds"] + time.monotonic() - run["started"], 3)
+            try:
+                await self._checkpoint(job, run)
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+            logger.info("backfill stopped", extra={"job_id": job_id, "status": job["status"], **job["counters"]})
+
+    # -------------------------------------------------------------------------
+    # 進捗
+    # -------------------------------------------------------------------------
+
+    def _running_here(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    def _read(self, job_id: str, running_here: bool) -> Tuple[Dict[str, Any], bool]:
+        """チェックポイントと、実行中のまま記録されているがどのワーカーも実行していないか（別スレッドで呼ぶ）"""
+        job = self._load_job(job_id)
+        interrupted = job["status"] == "running" and not running_here and self._try_lock_free(job_id)
+        return job, interrupted
+
+    async def progress(self, job_id: str) -> Dict[str, Any]:
+        """進捗・処理速度・残り時間の見込み"""
+        running_here = self._running_here(job_id)
+        job, interrupted = await asyncio.to_thread(self._read, job_id, running_here)
+        return self._progress(job, running_here, interrupted)
+
+    def _progress(self, job: Dict[str, Any], running_here: bool, interrupted: bool) -> Dict[str, Any]:
+        job_id = job["job_id"]
+        total_units = len(self._units(job))
+        done_units = len(job["completed_units"])
+        run = self._runs.get(job_id)
+
+        status = job["status"]
+        if running_here and run is not None and run["pause_requested"]:
+            status = "pausing"
+        elif interrupted:
+            # 実行中のまま記録されているが、どのワーカーも実行していない（再起動など）
+            status = "interrupted"
+
+        elapsed = job["elapsed_seconds"]
+        rate: Dict[str, Optional[float]] = {"units_per_second": None, "files_per_second": None}
+        eta = None
+        if running_here and run is not None:
+            run_elapsed = time.monotonic() - run["started"]
+            elapsed = round(elapsed + run_elapsed, 3)
+            if run["units"] and run_elapsed > 0:
+                rate = {"units_per_second": round(run["units"] / run_elapsed, 3),
+                        "files_per_second": round(run["files"] / run_elapsed, 2)}
+                eta = round((total_units - done_units - len(job["failed_units"])) / rate["units_per_second"], 1)
+
+        return {
+            "job_id": job_id,
+            "status": status,
+            "device_count": len(job["device_ids"]),
+            "start_date": job["start_date"],
+            "end_date": job["end_date"],
+            "steps": job["steps"],
+            "concurrency": job["concurrency"],
+            "batch_size": job["batch_size"],
+            "units": {"total": total_units, "completed": done_units, "failed": len(job["failed_units"]),
+                      "remaining": total_units - done_units},
+            "percent": round(done_units / total_units * 100, 1) if total_units else 100.0,
+            "files": job["counters"],
+            "elapsed_seconds": elapsed,
+            **rate,
+            "eta_seconds": max(0.0, eta) if eta is not None else None,
+            "failed_units": dict(list(job["failed_units"].items())[:20]),
+            "last_error": job["last_error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "finished_at": job["finished_at"],
+        }
+
+    def _try_lock_free(self, job_id: str) -> bool:
+        fd = self._try_lock(job_id)
+        if fd is None:
+            return False
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        return True
+
+    def _read_all(self, running: Set[str]) -> List[Tuple[Dict[str, Any], bool]]:
+        if not os.path.isdir(self.state_dir):
+            return []
+        job_ids = sorted((name[:-5] for name in os.listdir(self.state_dir) if name.endswith(".json")), reverse=True)
+        return [self._read(job_id, job_id in running) for job_id in job_ids]
+
+    async def list_jobs(self) -> List[Dict[str, Any]]:
+        """チェックポイントのあるジョブを新しい順に返す"""
+        running = {job_id for job_id in self._tasks if self._running_here(job_id)}
+        jobs = await asyncio.to_thread(self._read_all, running)
+        return [self._progress(job, job["job_id"] in running, interrupted) for job, interrupted in jobs]
@@ -0,0 +1,143 @@
+"""
+一括通知の送信対象解決とバルク挿入
+
+セグメント条件（ステータス・プラン・アクティブデバイスの有無・登録日時）をPostgRESTの条件に変換し、
+usersをuser_id順のキーセットページングで読みながら、ページ単位でnotificationsへまとめて挿入する。
+対象ユーザー全体をメモリに載せることはなく、保持するのは「挿入中のページ」と「読み込み中のページ」の2ページ分だけ。
+ページの読み込みや挿入が失敗した時点で止め、送信済みの件数と「どのユーザーまで送ったか」（resume_after）を返す。
+resume_afterを指定して再実行すると、その続きから送信する（送信済みのユーザーに重複して送らない）。
+
+環境変数:
+    BROADCAST_PAGE_SIZE   1ページ（= 1回のバルク挿入）のユーザー数（既定 1000）
+"""
+
+import os
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from api.structured_logging import get_logger
+from models.schemas import BroadcastSegment
+
+
+logger = get_logger("broadcast")
+
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "1000"))
+# in.(...) 条件に並べるIDの数（URL長の上限に収まるように分割する）
+DEVICE_LOOKUP_CHUNK = 100
+
+
+def segment_conditions(segment: BroadcastSegment) -> Dict[str, Any]:
+    """セグメント条件をusersテーブルへのPostgREST条件に変換"""
+    where: Dict[str, Any] = {}
+    if segment.status:
+        where["status"] = f"in.({','.join(status.value for status in segment.status)})"
+    if segment.subscription_plan:
+        where["subscription_plan"] = f"in.({','.join(plan.value for plan in segment.subscription_plan)})"
+    created_at = []
+    if segment.created_from:
+        created_at.append(f"gte.{segment.created_from.isoformat()}")
+    if segment.created_to:
+        created_at.append(f"lt.{segment.created_to.isoformat()}")
+    if created_at:
+        where["created_at"] = created_at
+    return where
+
+
+async def _active_device_owners(client, user_ids: List[str]) -> Set[str]:
+    """指定ユーザーのうちアクティブなデバイスを所有するユーザー"""
+    owners: Set[str] = set()
+    for start in range(0, len(user_ids), DEVICE_LOOKUP_CHUNK):
+        chunk = user_ids[start:start + DEVICE_LOOKUP_CHUNK]
+        rows = await client.select("devices", columns="owner_user_id", filters={"status": "active"},
+                                   where={"owner_user_id": f"in.({','.join(chunk)})"})
+        owners.update(row["owner_user_id"] for row in rows)
+    return owners
+
+
+async def iter_segment_user_ids(client, segment: BroadcastSegment, page_size: int = BROADCAST_PAGE_SIZE,
+                                resume_after: Optional[str] = None) -> AsyncIterator[List[str]]:
+    """セグメントに該当するuser_idをページ単位で返す（user_idのキーセットページング、resume_afterより後から）"""
+    base = segment_conditions(segment)
+    last_user_id: Optional[str] = resume_after
+    while True:
+        where = dict(base)
+        if last_user_id is not None:
+            where["user_id"] = f"gt.{last_user_id}"
+        rows = await client.select("users", columns="user_id", where=where, order="user_id.asc", limit=page_size)
+        if not rows:
+            return
+        user_ids = [row["user_id"] for row in rows]
+        last_user_id = user_ids[-1]
+
+        if segment.has_active_device is not None:
+            owners = await _active_device_owners(client, user_ids)
+            user_ids = [user_id for user_id in user_ids if (user_id in owners) == segment.has_active_device]
+
+        if user_ids:
+            yield user_ids
+        if len(rows) < page_size:
+            return
+
+
+async def iter_user_id_pages(user_ids: List[str], page_size: int = BROADCAST_PAGE_SIZE,
+                             resume_after: Optional[str] = None) -> AsyncIterator[List[str]]:
+    """明示的に指定されたuser_idをページに分割（resume_afterを指定した場合はその次のIDから）"""
+    if resume_after is not None:
+        user_ids = user_ids[user_ids.index(resume_after) + 1:]
+    for start in range(0, len(user_ids), page_size):
+        yield user_ids[start:start + page_size]
+
+
+async def send_broadcast(client, pages: AsyncIterator[List[str]], template: Dict[str, Any],
+                         on_sent: Optional[Callable[[List[str]], None]] = None) -> Dict[str, Any]:
+    """
+    ページごとに通知をバルク挿入し、{sent, failed, resume_after, error}を返す
+    次のページの読み込みと前のページの挿入を並行して行う。読み込みか挿入が失敗したらそこで止める
+    （failedは挿入に失敗したページの件数、resume_afterは送信済みの最後のuser_id）
+    on_sent(user_ids) は挿入できたページごとに呼ばれる
+    """
+    result: Dict[str, Any] = {"sent": 0, "failed": 0, "resume_after": None, "error": None}
+
+    async def insert_page(user_ids: List[str]):
+        rows = [{"user_id": user_id, **template} for user_id in user_ids]
+        await client.insert_many("notifications", rows)
+        return user_ids
+
+    async def finish(task: asyncio.Task, user_ids: List[str]) -> bool:
+        try:
+            await task
+        except Exception as e:
+            logger.error("broadcast page insert failed", extra={"rows": len(user_ids), "error": str(e)})
+            result["failed"] += len(user_ids)
+            result["error"] = f"通知の挿入に失敗しました: {str(e)}"
+            return False
+        result["sent"] += len(user_ids)
+        result["resume_after"] = user_ids[-1]
+        if on_sent is not None:
+            on_sent(user_ids)
+        return True
+
+    pending: Optional[Tuple[asyncio.Task, List[str]]] = None
+    try:
+        try:
+            async for user_ids in pages:
+                if pending is not None and not await finish(*pending):
+                    pending = None
+                    return result
+                pending = (asyncio.create_task(insert_page(user_ids)), user_ids)
+        except Exception as e:
+            # 送信対象の読み込みに失敗した場合も、挿入中のページは完了させてから止める
+            logger.error("broadcast recipient lookup failed", extra={"sent": result["sent"], "error": str(e)})
+            if pending is not None:
+                task_pending, pending = pending, None
+                await finish(*task_pending)
+            if result["error"] is None:
+                result["error"] = f"送信対象の取得に失敗しました: {str(e)}"
+            return result
+        if pending is not None:
+            task_pending, pending = pending, None
+            await finish(*task_pending)
+        return result
+    finally:
+        if pending is not None and not pending[0].done():
+            pending[0].cancel()
@@ -0,0 +1,107 @@
+"""
+レスポンスのgzip圧縮（ストリーミング対応）
+
+- 一定サイズ未満のレスポンスは圧縮しない（圧縮コストの方が大きいため）
+- StreamingResponseはチャンクごとに圧縮してZ_SYNC_FLUSHで送り出し、受信側で逐次展開できるようにする
+- 画像・フォント・アーカイブなど圧縮済みのContent-Typeや、Content-Encodingが設定済みのレスポンスは対象外
+
+環境変数:
+    GZIP_MINIMUM_SIZE   圧縮する最小サイズ（バイト、既定 1024）
+    GZIP_LEVEL          圧縮レベル 1〜9（既定 6）
+"""
+
+import os
+import zlib
+from typing import Iterable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+
+# 既に圧縮されている、または逐次表示が必要なContent-Type
+EXCLUDED_CONTENT_TYPES = (
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/x-icon", "image/vnd.microsoft.icon",
+    "video/", "audio/", "font/woff", "font/woff2",
+    "application/zip", "application/gzip", "application/x-gzip", "application/octet-stream",
+    "text/event-stream",
+)
+
+
+class CompressionMiddleware:
+    """Accept-Encodingにgzipを含むリクエストのレスポンスを圧縮するASGIミドルウェア"""
+
+    def __init__(self, app, minimum_size: Optional[int] = None, level: Optional[int] = None,
+                 excluded_content_types: Iterable[str] = EXCLUDED_CONTENT_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+        self.level = level if level is not None else int(os.getenv("GZIP_LEVEL", "6"))
+        self.excluded_content_types = tuple(excluded_content_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                # ヘッダーは最初のbodyを見てから決める
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or content_type.startswith(self.excluded_content_types)
+                )
+                return
+            if message_type != "http.response.body":
+                await send(message)
+                return
+
+            if passthrough:
+                if start_message is not None:
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers["Content-Encoding"] = "gzip"
+                headers.add_vary_header("Accept-Encoding")
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body = compressor.compress(body) + compressor.flush()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    start_message = None
+                    await send({"type": "http.response.body", "body": body, "more_body": False})
+                    return
+                await send(start_message)
+                start_message = None
+
+            # ストリーミング: チャンクごとに圧縮して即座に送る
+            if more_body:
+                chunk = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                chunk = compressor.compress(body) + compressor.flush()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
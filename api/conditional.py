@@ -0,0 +1,69 @@
+"""
+ETagによる条件付きGET
+
+Supabaseから取得した生データ（Pydanticモデルに変換する前）のハッシュをETagとし、
+If-None-Matchが一致すれば304を返してモデル構築とJSONシリアライズを省略する。
+ポーリングしている管理画面が何も変わっていないデータを毎回受け取らないようにするためのもの。
+"""
+
+import json
+import hashlib
+from typing import Any, Callable, Iterable, Optional
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+
+from api.metrics import CACHE_REQUESTS_TOTAL
+
+
+# ブラウザには毎回再検証させる（変更がなければ304で本文は送らない）
+CACHE_CONTROL = "no-cache"
+
+_etag_hits = CACHE_REQUESTS_TOTAL.labels("etag", "hit")
+_etag_misses = CACHE_REQUESTS_TOTAL.labels("etag", "miss")
+
+
+def compute_etag(data: Any, exclude: Iterable[str] = ()) -> str:
+    """データ内容から弱いETagを作る（excludeはハッシュ対象から外すトップレベルのキー）"""
+    if exclude and isinstance(data, dict):
+        data = {key: value for key, value in data.items() if key not in exclude}
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f'W/"{hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Matchヘッダーに一致するETagが含まれるか"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def conditional_json(request: Request, raw: Any, render: Callable[[], Any],
+                     exclude: Iterable[str] = (), etag: Optional[str] = None) -> Response:
+    """
+    ETag付きのJSONレスポンスを返す
+    一致すれば304、一致しなければrender()でレスポンスを組み立てる（Pydanticの処理はこのときだけ行われる）
+    """
+    etag = etag or compute_etag(raw, exclude)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        _etag_hits.inc()
+        return Response(status_code=304, headers=headers)
+
+    _etag_misses.inc()
+    content = render()
+    if isinstance(content, BaseModel):
+        return Response(content=content.model_dump_json(), media_type="application/json", headers=headers)
+    return ORJSONResponse(content=jsonable_encoder(content), headers=headers)
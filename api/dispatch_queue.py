@@ -0,0 +1,132 @@
+"""
+解析API呼び出しの優先度付きディスパッチキュー
+
+上流APIの同時実行数を共有する3つのレーンを重み付きで公平に割り当てる:
+    interactive  管理画面からの手動操作（既定）
+    scheduled    スケジューラーのcron実行
+    backfill     過去データの一括再処理
+
+空きがあれば即座に実行し、空きがないときは待っているレーンの中から
+smooth weighted round-robinで次に実行するレーンを選ぶ。
+重みが大きいレーンほど先に枠を得るが、重みの小さいレーンも飢餓状態にはならない。
+
+環境変数:
+    UPSTREAM_MAX_CONCURRENCY   上流APIへの同時実行数（既定 16）
+    UPSTREAM_LANE_WEIGHTS      レーンの重み（既定 "interactive=8,scheduled=3,backfill=1"）
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from api.metrics import DISPATCH_QUEUE_DEPTH, DISPATCH_WAIT_SECONDS
+
+
+LANES = ("interactive", "scheduled", "backfill")
+DEFAULT_LANE_WEIGHTS = "interactive=8,scheduled=3,backfill=1"
+
+# 現在の処理が属するレーン（スケジューラーやバックフィルのジョブ開始時に設定する）
+dispatch_lane: ContextVar[str] = ContextVar("dispatch_lane", default="interactive")
+
+
+def _parse_weights(value: str) -> Dict[str, int]:
+    weights = {lane: 1 for lane in LANES}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        lane, weight = item.split("=", 1)
+        lane = lane.strip()
+        if lane not in weights:
+            raise ValueError(f"不明なレーンです: {lane}")
+        weights[lane] = max(1, int(weight))
+    return weights
+
+
+class PriorityDispatcher:
+    """同時実行枠をレーンごとの重みに従って割り当てる"""
+
+    def __init__(self, capacity: Optional[int] = None, weights: Optional[Dict[str, int]] = None):
+        self.capacity = capacity or int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+        self.weights = weights or _parse_weights(os.getenv("UPSTREAM_LANE_WEIGHTS", DEFAULT_LANE_WEIGHTS))
+        self._active = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._current_weight: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._depth_gauges = {lane: DISPATCH_QUEUE_DEPTH.labels(lane) for lane in LANES}
+        self._wait_histograms = {lane: DISPATCH_WAIT_SECONDS.labels(lane) for lane in LANES}
+        self._granted: Dict[str, int] = {lane: 0 for lane in LANES}
+
+    def _next_lane(self) -> Optional[str]:
+        """待ちのあるレーンからsmooth weighted round-robinで1つ選ぶ"""
+        candidates = [lane for lane in LANES if self._waiters[lane]]
+        if not candidates:
+            return None
+        total = 0
+        for lane in candidates:
+            self._current_weight[lane] += self.weights[lane]
+            total += self.weights[lane]
+        selected = max(candidates, key=lambda lane: self._current_weight[lane])
+        self._current_weight[selected] -= total
+        return selected
+
+    def _wake_next(self):
+        while self._active < self.capacity:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            waiter = self._waiters[lane].popleft()
+            self._depth_gauges[lane].dec()
+            if waiter.done():  # キャンセル済み（通常はacquire側で取り除かれている）
+                continue
+            self._active += 1
+            waiter.set_result(None)
+
+    async def acquire(self, lane: str):
+        started = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        self._depth_gauges[lane].inc()
+        # 空きがあればここで即座に枠が割り当てられる
+        self._wake_next()
+        if not waiter.done():
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 枠を得た直後にキャンセルされた場合は次の待ちへ譲る
+                    self.release()
+                elif waiter in self._waiters[lane]:
+                    # 待ち行列から外し、待ち数にすぐ反映する（次の割り当てまで残さない）
+                    self._waiters[lane].remove(waiter)
+                    self._depth_gauges[lane].dec()
+                raise
+        self._granted[lane] += 1
+        self._wait_histograms[lane].observe(time.perf_counter() - started)
+
+    def release(self):
+        self._active -= 1
+        self._wake_next()
+
+    @asynccontextmanager
+    async def slot(self, lane: Optional[str] = None):
+        """実行枠を確保するコンテキスト（laneを省略すると現在のレーン）"""
+        lane = lane or dispatch_lane.get()
+        if lane not in self._waiters:
+            raise ValueError(f"不明なレーンです: {lane}")
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "capacity": self.capacity,
+            "active": self._active,
+            "weights": dict(self.weights),
+            "queued": {lane: len(self._waiters[lane]) for lane in LANES},
+            "granted": dict(self._granted),
+        }
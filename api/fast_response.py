@@ -0,0 +1,57 @@
+"""
+一覧APIの高速レスポンス
+
+従来は各行を`Model(**row)`で構築したうえで、FastAPIがresponse_modelで再度検証・変換していた。
+ここでは行リストをTypeAdapterで1回だけ検証し、pydantic-coreのJSONシリアライザで直接bytesにする。
+FAST_RESPONSE_MODE=trust の場合はSupabaseの行を検証済みとみなし、モデルのフィールドだけを
+orjsonでシリアライズする（日時はSupabaseの文字列表現のまま返る）。
+
+環境変数:
+    FAST_RESPONSE_MODE   validate（既定）/ trust
+"""
+
+import os
+from typing import Any, Dict, List, Sequence, Type
+
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+FAST_RESPONSE_MODE = os.getenv("FAST_RESPONSE_MODE", "validate").lower()
+
+_adapters: Dict[Type[BaseModel], TypeAdapter] = {}
+_projections: Dict[Type[BaseModel], Dict[str, Any]] = {}
+
+
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    adapter = _adapters.get(model)
+    if adapter is None:
+        adapter = _adapters[model] = TypeAdapter(List[model])
+    return adapter
+
+
+def _projection(model: Type[BaseModel]) -> Dict[str, Any]:
+    """モデルのフィールド名と、行に値がない場合の既定値"""
+    projection = _projections.get(model)
+    if projection is None:
+        projection = {}
+        for name, field in model.model_fields.items():
+            default = None if field.is_required() else field.get_default(call_default_factory=True)
+            projection[name] = getattr(default, "value", default)
+        _projections[model] = projection
+    return projection
+
+
+def serialize_rows(model: Type[BaseModel], rows: Sequence[Dict[str, Any]], mode: str = None) -> bytes:
+    """行リストをモデルの形のJSON bytesにする"""
+    if (mode or FAST_RESPONSE_MODE) == "trust":
+        projection = _projection(model)
+        return orjson.dumps([{name: row.get(name, default) for name, default in projection.items()} for row in rows])
+    adapter = _list_adapter(model)
+    return adapter.dump_json(adapter.validate_python(rows))
+
+
+def model_list_response(model: Type[BaseModel], rows: Sequence[Dict[str, Any]]) -> Response:
+    """response_modelによる再検証を通さずに一覧を返す"""
+    return Response(content=serialize_rows(model, rows), media_type="application/json")
@@ -0,0 +1,221 @@
+"""
+解析APIで失敗したファイルの再試行管理とデッドレター
+
+- スケジューラーが解析APIに送って失敗したファイルを(バックエンド, file_path)ごとに記録し、
+  失敗回数に応じた指数バックオフ（ジッターつき）が明けるまで次の実行の対象から外す
+- 一度でも失敗したファイルは次回から1件ずつ送る（壊れたWAVが他のファイルのバッチを巻き込まないようにする）
+- 失敗がFILE_RETRY_MAX_ATTEMPTS回に達したファイルはデッドレターに移し、再投入されるまで送らない
+- 成功したファイルの記録は消す。上流に接続できなかった失敗（502/503/504を含む）はファイルの問題ではないため回数に数えない
+- 記録はSQLiteに置き、どのワーカーからでも確認・再投入できる（ロック待ちがあるため、非同期の処理からはasyncio.to_threadで呼ぶ）
+
+環境変数:
+    FILE_RETRY_MAX_ATTEMPTS       デッドレターに移すまでの失敗回数（既定 5）
+    FILE_RETRY_BASE_SECONDS       1回目の失敗後の待ち時間（既定 3600秒。以降は2倍ずつ）
+    FILE_RETRY_MAX_SECONDS        待ち時間の上限（既定 86400秒）
+    SCHEDULER_STATE_DIR           SQLiteの配置先（既定 /tmp/watchme_admin）
+"""
+
+import os
+import time
+import random
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from api.metrics import FILE_RETRY_FAILURES_TOTAL, FILE_RETRY_DEAD_LETTERS
+from api.structured_logging import get_logger
+
+
+logger = get_logger("file_retry")
+
+# SQLiteのIN句1回あたりのパラメータ数
+QUERY_CHUNK = 500
+COLUMNS = ("backend", "file_path", "attempts", "dead", "last_error", "first_failed_at", "last_failed_at", "next_attempt_at")
+
+
+def _chunks(items: List[str]) -> Iterable[List[str]]:
+    for start in range(0, len(items), QUERY_CHUNK):
+        yield items[start:start + QUERY_CHUNK]
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class FileRetryTracker:
+    """ファイルごとの失敗回数・次回の再試行時刻・デッドレターの管理"""
+
+    def __init__(self, state_dir: Optional[str] = None):
+        self.state_dir = state_dir or os.getenv("SCHEDULER_STATE_DIR", "/tmp/watchme_admin")
+        self.db_path = os.path.join(self.state_dir, "file_retries.sqlite3")
+        self.max_attempts = int(os.getenv("FILE_RETRY_MAX_ATTEMPTS", "5"))
+        self.base_seconds = float(os.getenv("FILE_RETRY_BASE_SECONDS", "3600"))
+        self.max_seconds = float(os.getenv("FILE_RETRY_MAX_SECONDS", "86400"))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.state_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_retries (backend TEXT NOT NULL, file_path TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, dead INTEGER NOT NULL, last_error TEXT, first_failed_at REAL NOT NULL, "
+                "last_failed_at REAL NOT NULL, next_attempt_at REAL NOT NULL, PRIMARY KEY (backend, file_path))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS file_retries_dead ON file_retries (dead, backend, last_failed_at)")
+            self._conn = conn
+        return self._conn
+
+    def backoff(self, attempts: int) -> float:
+        """attempts回目の失敗後の待ち時間（指数バックオフの半分を固定、残り半分をランダムにする）"""
+        delay = min(self.max_seconds, self.base_seconds * 2 ** max(attempts - 1, 0))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # -------------------------------------------------------------------------
+    # スケジューラーからの利用
+    # -------------------------------------------------------------------------
+
+    def partition(self, backend: str, file_paths: List[str]) -> Dict[str, List[str]]:
+        """未処理ファイルを fresh（記録なし）/ retry（再試行時刻を過ぎた）/ waiting（待機中）/ dead（デッドレター）に分ける"""
+        records: Dict[str, tuple] = {}
+        with self._db_lock:
+            conn = self._connection()
+            for chunk in _chunks(list(dict.fromkeys(file_paths))):
+                rows = conn.execute(
+                    f"SELECT file_path, dead, next_attempt_at FROM file_retries "
+                    f"WHERE backend = ? AND file_path IN ({','.join('?' * len(chunk))})",
+                    (backend, *chunk),
+                ).fetchall()
+                records.update((path, (dead, next_attempt_at)) for path, dead, next_attempt_at in rows)
+
+        now = time.time()
+        groups: Dict[str, List[str]] = {"fresh": [], "retry": [], "waiting": [], "dead": []}
+        for path in file_paths:
+            record = records.get(path)
+            if record is None:
+                groups["fresh"].append(path)
+            elif record[0]:
+                groups["dead"].append(path)
+            elif record[1] > now:
+                groups["waiting"].append(path)
+            else:
+                groups["retry"].append(path)
+        return groups
+
+    def record_success(self, backend: str, file_paths: List[str]):
+        """処理できたファイルの記録を消す"""
+        with self._db_lock:
+            conn = self._connection()
+            for chunk in _chunks(file_paths):
+                conn.execute(
+                    f"DELETE FROM file_retries WHERE backend = ? AND file_path IN ({','.join('?' * len(chunk))})",
+                    (backend, *chunk),
+                )
+
+    def record_failure(self, backend: str, file_paths: List[str], error: str) -> List[str]:
+        """失敗回数を増やして次回の再試行時刻を決め、デッドレターに移したファイルを返す"""
+        now = time.time()
+        error = (error or "")[:1000]
+        dead_lettered: List[str] = []
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for path in file_paths:
+                    row = conn.execute("SELECT attempts, first_failed_at FROM file_retries WHERE backend = ? AND file_path = ?",
+                                       (backend, path)).fetchone()
+                    attempts = (row[0] if row else 0) + 1
+                    dead = attempts >= self.max_attempts
+                    conn.execute(
+                        "INSERT OR REPLACE INTO file_retries (backend, file_path, attempts, dead, last_error, "
+                        "first_failed_at, last_failed_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (backend, path, attempts, int(dead), error, row[1] if row else now, now,
+                         now if dead else now + self.backoff(attempts)),
+                    )
+                    if dead:
+                        dead_lettered.append(path)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        FILE_RETRY_FAILURES_TOTAL.labels(backend, "retry").inc(len(file_paths) - len(dead_lettered))
+        if dead_lettered:
+            FILE_RETRY_FAILURES_TOTAL.labels(backend, "dead_letter").inc(len(dead_lettered))
+            logger.warning("files moved to dead letter", extra={
+                "backend": backend, "files": len(dead_lettered), "error": error[:200]
+            })
+            self._publish(backend)
+        return dead_lettered
+
+    # -------------------------------------------------------------------------
+    # 確認・再投入
+    # -------------------------------------------------------------------------
+
+    def list_files(self, dead: bool = True, backend: Optional[str] = None, page: int = 1, per_page: int = 50) -> Dict[str, Any]:
+        """デッドレター（dead=Falseなら再試行待ち）のファイルを新しい失敗順に返す"""
+        where = "dead = ?" + (" AND backend = ?" if backend else "")
+        params = (int(dead), backend) if backend else (int(dead),)
+        with self._db_lock:
+            conn = self._connection()
+            total = conn.execute(f"SELECT COUNT(*) FROM file_retries WHERE {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM file_retries WHERE {where} "
+                "ORDER BY last_failed_at DESC, file_path LIMIT ? OFFSET ?",
+                (*params, per_page, (page - 1) * per_page),
+            ).fetchall()
+        items = []
+        for row in rows:
+            item = dict(zip(COLUMNS, row))
+            item["dead"] = bool(item["dead"])
+            for key in ("first_failed_at", "last_failed_at"):
+                item[key] = _iso(item[key])
+            item["next_attempt_at"] = None if item["dead"] else _iso(item["next_attempt_at"])
+            items.append(item)
+        return {"items": items, "total": total, "page": page, "per_page": per_page, "has_next": page * per_page < total}
+
+    def requeue(self, backend: Optional[str] = None, file_paths: Optional[List[str]] = None) -> int:
+        """デッドレターのファイルを次回の実行で再試行させる（1件ずつ送る扱いは残す）。再投入した件数を返す"""
+        where = "dead = 1" + (" AND backend = ?" if backend else "")
+        params: tuple = (backend,) if backend else ()
+        requeued = 0
+        with self._db_lock:
+            conn = self._connection()
+            if file_paths is None:
+                requeued = conn.execute(f"UPDATE file_retries SET dead = 0, attempts = 0, next_attempt_at = 0 WHERE {where}",
+                                        params).rowcount
+            else:
+                for chunk in _chunks(list(dict.fromkeys(file_paths))):
+                    requeued += conn.execute(
+                        f"UPDATE file_retries SET dead = 0, attempts = 0, next_attempt_at = 0 "
+                        f"WHERE {where} AND file_path IN ({','.join('?' * len(chunk))})",
+                        (*params, *chunk),
+                    ).rowcount
+        for name in set(self.counts()) | ({backend} if backend else set()):
+            self._publish(name)
+        if requeued:
+            logger.info("dead letter files requeued", extra={"backend": backend, "files": requeued})
+        return requeued
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """バックエンドごとの再試行待ち・デッドレターの件数"""
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT backend, dead, COUNT(*) FROM file_retries GROUP BY backend, dead"
+            ).fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for backend, dead, count in rows:
+            counts.setdefault(backend, {"retrying": 0, "dead_letter": 0})["dead_letter" if dead else "retrying"] = count
+        return counts
+
+    def _publish(self, backend: str):
+        FILE_RETRY_DEAD_LETTERS.labels(backend).set(self.counts().get(backend, {}).get("dead_letter", 0))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
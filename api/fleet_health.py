@@ -0,0 +1,283 @@
+"""
+デバイスの稼働状況（最終同期からの経過時間）のインメモリインデックス
+
+- status別に(last_sync, device_id)のソート済みリストを保持し、
+  「6時間以上同期していない」などの問い合わせは二分探索で件数と該当範囲を求める
+  （経過時間は問い合わせ時刻から計算するため、時間が経っても索引を作り直す必要はない）
+- 初回問い合わせ時に全件を読み込み、以降はlast_sync / registered_atが前回より新しい行だけを取り込む
+  （削除や他のワーカーでのstatusだけの変更は差分では検知できないため、一定間隔で全件を読み直す）
+- このプロセスでの同期・更新・登録・ハートビートはapply()で即座に反映する
+- last_sync / registered_atは取り込む時点でUTCのタイムゾーンつき日時にそろえる
+  （タイムゾーンなしの値はこのプロセスのローカル時刻として扱う。差分取り込みの基準も日時として比較する）
+
+環境変数:
+    FLEET_HEALTH_REFRESH_SECONDS       差分取り込みの間隔（既定 30秒）
+    FLEET_HEALTH_FULL_REBUILD_SECONDS  全件読み直しの間隔（既定 900秒）
+    FLEET_HEALTH_BUCKETS_HOURS         経過時間の区切り（時間、既定 1,6,24,168）
+"""
+
+import os
+import time
+import asyncio
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from api.structured_logging import get_logger
+
+
+logger = get_logger("fleet_health")
+
+# 稼働状況として返すdevicesテーブルの列
+DEVICE_COLUMNS = ("device_id", "owner_user_id", "device_type", "platform_type", "status", "last_sync", "registered_at")
+LOAD_PAGE_SIZE = 1000
+# 一度も同期していないデバイスのlast_sync（ソート済みリストの先頭に並ぶ）
+NEVER = float("-inf")
+_MAX_ID = "\U0010ffff"
+
+
+# 日時として扱う列
+TIMESTAMP_COLUMNS = ("last_sync", "registered_at")
+
+
+def _utc(value: Any) -> Optional[datetime]:
+    """ISO 8601文字列・datetimeをUTCのタイムゾーンつき日時にする（タイムゾーンなしはローカル時刻として扱う）"""
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    # astimezoneはタイムゾーンなしの値をローカル時刻とみなす
+    return value.astimezone(timezone.utc)
+
+
+def _timestamp(value: Optional[datetime]) -> float:
+    return value.timestamp() if value is not None else NEVER
+
+
+def _bucket_hours() -> List[float]:
+    raw = os.getenv("FLEET_HEALTH_BUCKETS_HOURS", "1,6,24,168")
+    return sorted({float(value) for value in raw.split(",") if value.strip()})
+
+
+class FleetHealthIndex:
+    """last_syncの経過時間とstatusによるデバイスの索引"""
+
+    def __init__(self, loader: Callable[..., Awaitable[List[Dict[str, Any]]]],
+                 refresh_seconds: Optional[float] = None, full_rebuild_seconds: Optional[float] = None):
+        # loader(where, limit, offset) でdevicesの行を取得する
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(os.getenv("FLEET_HEALTH_REFRESH_SECONDS", "30"))
+        self.full_rebuild_seconds = full_rebuild_seconds if full_rebuild_seconds is not None else float(os.getenv("FLEET_HEALTH_FULL_REBUILD_SECONDS", "900"))
+        self.bucket_hours = _bucket_hours()
+        self._reset()
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _reset(self):
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, Tuple[str, float]] = {}  # device_id -> (status, last_sync)
+        self._by_status: Dict[str, List[Tuple[float, str]]] = {}
+        self._watermarks: Dict[str, Optional[datetime]] = {column: None for column in TIMESTAMP_COLUMNS}
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+
+    # -------------------------------------------------------------------------
+    # 索引の構築
+    # -------------------------------------------------------------------------
+
+    def _add(self, row: Dict[str, Any], bulk: bool = False):
+        device_id = row.get("device_id")
+        if not device_id:
+            return
+        row = {column: row.get(column) for column in DEVICE_COLUMNS}
+        times = {column: _utc(row[column]) for column in TIMESTAMP_COLUMNS}
+        for column, value in times.items():
+            row[column] = value.isoformat() if value is not None else None
+        old = self._keys.get(device_id)
+        if old is not None:
+            entries = self._by_status[old[0]]
+            index = bisect_left(entries, (old[1], device_id))
+            if index < len(entries) and entries[index] == (old[1], device_id):
+                del entries[index]
+
+        status = row.get("status") or "unknown"
+        synced = _timestamp(times["last_sync"])
+        self._rows[device_id] = row
+        self._keys[device_id] = (status, synced)
+        entries = self._by_status.setdefault(status, [])
+        if bulk:
+            entries.append((synced, device_id))
+        else:
+            insort(entries, (synced, device_id))
+
+        for column, value in times.items():
+            watermark = self._watermarks[column]
+            if value is not None and (watermark is None or value > watermark):
+                self._watermarks[column] = value
+
+    async def _load(self, where: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = await self.loader(where=where, limit=LOAD_PAGE_SIZE, offset=offset)
+            rows.extend(page)
+            if len(page) < LOAD_PAGE_SIZE:
+                return rows
+            offset += LOAD_PAGE_SIZE
+
+    async def rebuild(self):
+        """全件を読み込んで索引を作り直す"""
+        started = time.perf_counter()
+        rows = await self._load(None)
+        self._reset()
+        for row in rows:
+            self._add(row, bulk=True)
+        for entries in self._by_status.values():
+            entries.sort()
+        self._loaded_at = self._refreshed_at = time.monotonic()
+        logger.info("fleet health index rebuilt", extra={
+            "devices": len(self._rows), "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    async def refresh(self):
+        """前回以降に同期・登録された行だけを取り込む"""
+        if not self._loaded_at:
+            await self.rebuild()
+            return
+        changed: Dict[str, Dict[str, Any]] = {}
+        for column, watermark in list(self._watermarks.items()):
+            if watermark is None:
+                continue
+            for row in await self._load({column: f"gt.{watermark.isoformat()}"}):
+                changed[row["device_id"]] = row
+        for row in changed.values():
+            self._add(row)
+        self._refreshed_at = time.monotonic()
+        if changed:
+            logger.info("fleet health index refreshed", extra={"changed": len(changed)})
+
+    def apply(self, rows: Iterable[Dict[str, Any]]):
+        """このプロセスで作成・更新したデバイスを即座に反映（部分的な行は既存の値に重ねる）"""
+        if not self._loaded_at:
+            return
+        for row in rows:
+            device_id = row.get("device_id") if row else None
+            if device_id:
+                self._add({**self._rows.get(device_id, {}), **row})
+
+    async def ensure_fresh(self):
+        """未構築なら構築し、古ければバックグラウンドで差分・全件の読み直しを始める"""
+        if not self._loaded_at:
+            async with self._lock:
+                if not self._loaded_at:
+                    await self.rebuild()
+            return
+        now = time.monotonic()
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if now - self._loaded_at >= self.full_rebuild_seconds:
+            self._refresh_task = asyncio.create_task(self._guarded(self.rebuild))
+        elif now - self._refreshed_at >= self.refresh_seconds:
+            self._refresh_task = asyncio.create_task(self._guarded(self.refresh))
+
+    async def _guarded(self, func):
+        async with self._lock:
+            try:
+                await func()
+            except Exception as e:
+                logger.error("fleet health index refresh failed", extra={"error": str(e)})
+
+    # -------------------------------------------------------------------------
+    # 問い合わせ
+    # -------------------------------------------------------------------------
+
+    def _statuses(self, status: Optional[str]) -> List[str]:
+        return [status] if status is not None else sorted(self._by_status)
+
+    def _position(self, status: str, synced: float) -> int:
+        """last_syncがsynced未満の件数（一度も同期していないデバイスを含む）"""
+        return bisect_left(self._by_status.get(status, []), (synced, ""))
+
+    def _count_never(self, status: str) -> int:
+        return bisect_left(self._by_status.get(status, []), (NEVER, _MAX_ID))
+
+    def summary(self, status: Optional[str] = None) -> Dict[str, Any]:
+        """経過時間の区切りごとの件数（status別の内訳つき）"""
+        started = time.perf_counter()
+        now = time.time()
+        statuses = self._statuses(status)
+        never = {name: self._count_never(name) for name in statuses}
+        edges = [0.0] + self.bucket_hours + [None]
+        buckets = []
+        for min_hours, max_hours in zip(edges, edges[1:]):
+            # 経過時間が[min_hours, max_hours)のデバイス = last_syncが(now - max_hours, now - min_hours]の範囲
+            by_status = {}
+            for name in statuses:
+                end = self._position(name, now - min_hours * 3600) if min_hours else len(self._by_status.get(name, []))
+                start = self._position(name, now - max_hours * 3600) if max_hours is not None else never[name]
+                by_status[name] = end - start
+            buckets.append({
+                "label": f"{min_hours:g}-{max_hours:g}h" if max_hours is not None else f"{min_hours:g}h+",
+                "min_hours": min_hours,
+                "max_hours": max_hours,
+                "count": sum(by_status.values()),
+                "by_status": by_status,
+            })
+        return {
+            "total": sum(len(self._by_status.get(name, [])) for name in statuses),
+            "by_status": {name: len(self._by_status.get(name, [])) for name in statuses},
+            "buckets": buckets,
+            "never_synced": {"count": sum(never.values()), "by_status": never},
+            "generated_at": datetime.now().isoformat(),
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def silent(self, min_hours: float, max_hours: Optional[float] = None, status: Optional[str] = None,
+               include_never: bool = True, page: int = 1, per_page: int = 50) -> Dict[str, Any]:
+        """min_hours以上（max_hours未満）同期していないデバイスを最終同期の古い順に返す"""
+        started = time.perf_counter()
+        now = time.time()
+        ranges = []
+        for name in self._statuses(status):
+            entries = self._by_status.get(name, [])
+            end = self._position(name, now - min_hours * 3600) if min_hours else len(entries)
+            if max_hours is not None:
+                start = self._position(name, now - max_hours * 3600)
+            else:
+                start = 0 if include_never else self._count_never(name)
+            if end > start:
+                ranges.append((entries, start, end))
+        total = sum(end - start for _, start, end in ranges)
+
+        # 各statusの範囲はすでに古い順なので、ページに必要な件数だけ併合する
+        offset = (page - 1) * per_page
+        needed = offset + per_page
+        merged: List[Tuple[float, str]] = []
+        for entries, start, end in ranges:
+            merged.extend(entries[start:min(end, start + needed)])
+        merged.sort()
+        items = []
+        for synced, device_id in merged[offset:needed]:
+            row = dict(self._rows[device_id])
+            row["silent_hours"] = round((now - synced) / 3600, 2) if synced != NEVER else None
+            items.append(row)
+        return {
+            "items": items,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "has_next": needed < total,
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "devices": len(self._rows),
+            "statuses": len(self._by_status),
+            "bucket_hours": self.bucket_hours,
+            "watermark": self._watermarks["last_sync"].isoformat() if self._watermarks["last_sync"] else None,
+            "age_seconds": round(time.monotonic() - self._refreshed_at, 1) if self._refreshed_at else None,
+        }
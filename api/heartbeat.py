@@ -0,0 +1,238 @@
+"""
+デバイスのハートビート（同期通知）のまとめ書き込み
+
+- 受け付けたハートビートはデバイスごとにメモリに溜め、同じデバイスの連続した通知は1件にまとめる（最新の状態と最終同期時刻を残す）
+- フラッシュ間隔ごと、または溜まった件数がバッチ上限に達した時点で、(status, last_sync)が同じデバイスをまとめて
+  devicesへ device_id=in.(...) のPATCHで書き込む（書き込むのはlast_sync・statusの列だけで、行の作成はしない）
+- 同期時刻を指定しないハートビートのlast_syncはフラッシュ時刻（UTC）にするため、通常はstatusごとに1回のPATCHになる
+- PATCHが返さなかったデバイスは存在しないものとして捨てる（事前の存在確認は不要）
+- 書き込みに失敗したPATCHの分（フラッシュの途中で止められた分を含む）だけを次のフラッシュで再試行する
+
+環境変数:
+    HEARTBEAT_FLUSH_INTERVAL_SECONDS  フラッシュ間隔（既定 1秒）
+    HEARTBEAT_MAX_BATCH               間隔を待たずにフラッシュする溜まったデバイス数（既定 500）
+    HEARTBEAT_MAX_PENDING             溜めておけるデバイス数の上限（既定 100000、超えると受け付けない）
+"""
+
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from api.metrics import HEARTBEAT_FLUSH_SECONDS, HEARTBEAT_BATCH_SIZE, HEARTBEAT_TOTAL
+from api.structured_logging import get_logger
+
+
+logger = get_logger("heartbeat")
+
+TABLE = "devices"
+# 1回のPATCHの in.(...) 条件に並べるIDの数（URL長の上限に収まるように分割する）
+PATCH_CHUNK = 200
+# PATCHで返させる列（稼働状況の索引に反映する）
+WRITTEN_COLUMNS = "device_id,last_sync,status"
+
+
+def _utc(value: Optional[datetime]) -> Optional[str]:
+    """UTCのISO 8601文字列（タイムゾーンなしはローカル時刻として扱う）"""
+    return value.astimezone(timezone.utc).isoformat() if value is not None else None
+
+
+class HeartbeatBufferFull(Exception):
+    """未書き込みのハートビートが上限に達している"""
+
+
+class HeartbeatBuffer:
+    """デバイスのハートビートをまとめてdevicesに書き込む"""
+
+    def __init__(self, get_client: Callable[[], Any], flush_interval: Optional[float] = None,
+                 max_batch: Optional[int] = None,
+                 on_written: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        # on_written(rows) はPATCHが返した行（device_id・last_sync・status）を稼働状況の索引などに反映するためのコールバック
+        self.get_client = get_client
+        self.on_written = on_written
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv("HEARTBEAT_FLUSH_INTERVAL_SECONDS", "1"))
+        self.max_batch = max_batch if max_batch is not None else int(os.getenv("HEARTBEAT_MAX_BATCH", "500"))
+        self.max_pending = int(os.getenv("HEARTBEAT_MAX_PENDING", "100000"))
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+        self._closing = False
+        self._stats = {"accepted": 0, "coalesced": 0, "written": 0, "unknown": 0, "flushes": 0, "errors": 0}
+        self._last_flush: Optional[Dict[str, Any]] = None
+
+    # -------------------------------------------------------------------------
+    # 受け付け
+    # -------------------------------------------------------------------------
+
+    def _ensure_running(self):
+        # フラッシュ用のタスクは最初のハートビートで起動する（イベントループが変わった場合は作り直す）
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, device_id: str, status: str, last_sync: Optional[datetime] = None,
+               wait: bool = False) -> Optional[asyncio.Future]:
+        """
+        ハートビートを受け付ける
+        wait=Trueの場合は、書き込まれたらTrue・存在しないデバイスならFalseになるFutureを返す
+        """
+        self._ensure_running()
+        row = self._pending.get(device_id)
+        if row is None and len(self._pending) >= self.max_pending:
+            HEARTBEAT_TOTAL.labels("rejected").inc()
+            raise HeartbeatBufferFull("未書き込みのハートビートが上限に達しています")
+
+        # 同期時刻の指定がなければNone（フラッシュ時刻を書き込む）
+        sync_time = _utc(last_sync)
+        if row is None:
+            self._pending[device_id] = {"device_id": device_id, "last_sync": sync_time, "status": status}
+            HEARTBEAT_TOTAL.labels("accepted").inc()
+        else:
+            # 同じデバイスの未書き込みの通知は最新の1件にまとめる（フラッシュ時刻はどの指定時刻よりも新しいとみなす）
+            row["last_sync"] = None if row["last_sync"] is None or sync_time is None else max(row["last_sync"], sync_time)
+            row["status"] = status
+            self._stats["coalesced"] += 1
+            HEARTBEAT_TOTAL.labels("coalesced").inc()
+        self._stats["accepted"] += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        if not wait:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(device_id, []).append(future)
+        return future
+
+    # -------------------------------------------------------------------------
+    # 書き込み
+    # -------------------------------------------------------------------------
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("heartbeat flush failed", extra={"error": str(e)})
+
+    async def _patch(self, client, status: str, last_sync: str, device_ids: List[str]) -> List[Dict[str, Any]]:
+        quoted = ",".join(f'"{device_id}"' for device_id in device_ids)
+        return await client.update_many(TABLE, {"status": status, "last_sync": last_sync},
+                                        where={"device_id": f"in.({quoted})"}, columns=WRITTEN_COLUMNS)
+
+    async def flush(self) -> Optional[Dict[str, Any]]:
+        """溜まっているハートビートを書き込む"""
+        async with self._flush_lock:
+            if not self._pending:
+                return None
+            pending, waiters = self._pending, self._waiters
+            self._pending, self._waiters = {}, {}
+            started = time.perf_counter()
+            flushed_at = datetime.now(timezone.utc).isoformat()
+            groups: Dict[Tuple[str, str], List[str]] = {}
+            for device_id, row in pending.items():
+                groups.setdefault((row["status"], row["last_sync"] or flushed_at), []).append(device_id)
+
+            written: Set[str] = set()
+            unknown: Set[str] = set()
+            failed: Dict[str, Exception] = {}
+            try:
+                client = self.get_client()
+                for (status, last_sync), device_ids in groups.items():
+                    for start in range(0, len(device_ids), PATCH_CHUNK):
+                        chunk = device_ids[start:start + PATCH_CHUNK]
+                        try:
+                            rows = await self._patch(client, status, last_sync, chunk)
+                        except Exception as e:
+                            # 失敗したPATCHの分だけを再試行に回し、他のグループの書き込みは続ける
+                            failed.update(dict.fromkeys(chunk, e))
+                            continue
+                        returned = {row["device_id"] for row in rows}
+                        written.update(returned)
+                        unknown.update(device_id for device_id in chunk if device_id not in returned)
+                        HEARTBEAT_BATCH_SIZE.observe(len(chunk))
+                        if self.on_written is not None and rows:
+                            self.on_written(rows)
+            except BaseException:
+                # 止められた場合は書き込めていない分を次のフラッシュに引き継ぐ（待っている呼び出し元も含む）
+                self._requeue(pending, written | unknown)
+                self._resolve(waiters, written, unknown, {})
+                raise
+            finally:
+                HEARTBEAT_FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+            if failed:
+                self._requeue(pending, written | unknown)
+                self._stats["errors"] += 1
+                logger.error("heartbeat flush failed", extra={
+                    "devices": len(failed), "error": str(next(iter(failed.values())))
+                })
+            self._resolve(waiters, written, unknown, failed)
+            if unknown:
+                HEARTBEAT_TOTAL.labels("unknown_device").inc(len(unknown))
+            self._stats["flushes"] += 1
+            self._stats["written"] += len(written)
+            self._stats["unknown"] += len(unknown)
+            self._last_flush = {
+                "at": datetime.now().isoformat(),
+                "devices": len(written),
+                "unknown_devices": len(unknown),
+                "failed_devices": len(failed),
+                "statements": sum((len(ids) + PATCH_CHUNK - 1) // PATCH_CHUNK for ids in groups.values()),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            return self._last_flush
+
+    def _requeue(self, pending: Dict[str, Dict[str, Any]], done: Set[str]):
+        """書き込めなかった行を戻す（その間に届いた新しい通知を優先）"""
+        for device_id, row in pending.items():
+            if device_id not in done and device_id not in self._pending:
+                self._pending[device_id] = row
+
+    def _resolve(self, waiters: Dict[str, List[asyncio.Future]], written: Set[str], unknown: Set[str],
+                 failed: Dict[str, Exception]):
+        """書き込まれたらTrue・存在しなければFalse・失敗なら例外。どれでもなければ次のフラッシュに引き継ぐ"""
+        for device_id, futures in waiters.items():
+            for future in futures:
+                if future.done():
+                    continue
+                if device_id in written:
+                    future.set_result(True)
+                elif device_id in unknown:
+                    future.set_result(False)
+                elif device_id in failed:
+                    future.set_exception(failed[device_id])
+                else:
+                    self._waiters.setdefault(device_id, []).append(future)
+
+    async def close(self):
+        """フラッシュ用のタスクに終了を伝えて待ち、残っているハートビートを書き込む"""
+        self._closing = True
+        if self._task is not None:
+            # 実行中のフラッシュは中断せずに終わらせる
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._pending:
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "flush_interval_seconds": self.flush_interval,
+            "max_batch": self.max_batch,
+            "last_flush": self._last_flush,
+        }
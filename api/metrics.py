@@ -0,0 +1,326 @@
+"""
+Prometheus形式のメトリクス収集
+外部ライブラリに依存しない軽量実装（ラベル値のタプルで子メトリクスをキャッシュし、
+ホットパスではdictを生成しない）
+"""
+
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """メトリクス共通部分（子メトリクスのキャッシュと出力）"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values: str):
+        """ラベル値に対応する子メトリクスを取得（2回目以降はキャッシュから返す）"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ラベル数が一致しません {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        """ラベルなしメトリクスの子"""
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {child.count}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """メトリクスのレジストリ"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"メトリクス名が重複しています: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Prometheusテキスト形式で出力"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4"
+
+
+# =============================================================================
+# アプリケーション共通メトリクス
+# =============================================================================
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "watchme_http_request_duration_seconds", "FastAPIルートの処理時間", ("method", "route")
+)
+HTTP_REQUESTS_TOTAL = Counter(
+    "watchme_http_requests_total", "FastAPIルートのリクエスト数", ("method", "route", "status")
+)
+SUPABASE_REQUEST_SECONDS = Histogram(
+    "watchme_supabase_request_duration_seconds", "Supabase REST呼び出しの処理時間", ("table", "operation")
+)
+SUPABASE_ERRORS_TOTAL = Counter(
+    "watchme_supabase_errors_total", "Supabase REST呼び出しのエラー数", ("table", "operation")
+)
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "watchme_upstream_request_duration_seconds",
+    "解析APIの呼び出し時間（ヘルスチェック・実行枠の待ちを含む）。outcome: success / http_error / connection_error / error",
+    ("endpoint", "outcome")
+)
+SCHEDULER_RUNS_TOTAL = Counter(
+    "watchme_scheduler_runs_total", "スケジューラー実行回数", ("scheduler", "outcome")
+)
+SCHEDULER_FILES_TOTAL = Counter(
+    "watchme_scheduler_files_total", "スケジューラーが扱ったファイル数", ("scheduler", "result")
+)
+CACHE_REQUESTS_TOTAL = Counter(
+    "watchme_cache_requests_total", "キャッシュの参照回数", ("cache", "result")
+)
+POOL_IN_FLIGHT = Gauge(
+    "watchme_http_pool_in_flight", "接続プールごとの実行中リクエスト数", ("pool",)
+)
+POOL_SATURATION_TOTAL = Counter(
+    "watchme_http_pool_saturation_total", "接続プール上限に達した状態でのリクエスト数", ("pool",)
+)
+SCHEDULER_JOBS_RUNNING = Gauge(
+    "watchme_scheduler_jobs_running", "バックエンドごとの実行中スケジューラージョブ数", ("backend",)
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "watchme_scheduler_wait_seconds", "同時実行上限によるジョブの待ち時間", ("backend",)
+)
+DISPATCH_QUEUE_DEPTH = Gauge(
+    "watchme_dispatch_queue_depth", "解析API呼び出しの待ち行列の長さ", ("lane",)
+)
+DISPATCH_WAIT_SECONDS = Histogram(
+    "watchme_dispatch_wait_seconds", "解析API呼び出しが実行枠を得るまでの待ち時間", ("lane",)
+)
+NOTIFICATION_RETENTION_ROWS_TOTAL = Counter(
+    "watchme_notification_retention_rows_total", "保持期間を過ぎてアーカイブ・削除した通知の件数", ("action",)
+)
+HEARTBEAT_FLUSH_SECONDS = Histogram(
+    "watchme_heartbeat_flush_seconds", "デバイスハートビートの書き込み（1回のフラッシュ）の所要時間"
+)
+HEARTBEAT_BATCH_SIZE = Histogram(
+    "watchme_heartbeat_batch_size", "1回のフラッシュで書き込んだデバイス数",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+HEARTBEAT_TOTAL = Counter(
+    "watchme_heartbeats_total", "受け付けたデバイスハートビート数", ("result",)
+)
+BACKFILL_FILES_TOTAL = Counter(
+    "watchme_backfill_files_total", "バックフィルで解析APIに送った音声ファイル数", ("step", "result")
+)
+BACKFILL_UNITS_TOTAL = Counter(
+    "watchme_backfill_units_total", "バックフィルで処理した単位（処理 × 日 × デバイスのまとまり）の数", ("step", "result")
+)
+ADAPTIVE_BATCH_SIZE = Gauge(
+    "watchme_adaptive_batch_size", "解析APIごとに学習した1回の呼び出しのファイル数", ("endpoint",)
+)
+ADAPTIVE_TIMEOUT_SECONDS = Gauge(
+    "watchme_adaptive_timeout_seconds", "解析APIごとに学習したタイムアウト（学習したバッチサイズで呼び出す場合）", ("endpoint",)
+)
+ADAPTIVE_SECONDS_PER_FILE = Gauge(
+    "watchme_adaptive_seconds_per_file", "解析APIごとに学習した1ファイルあたりの処理時間", ("endpoint",)
+)
+ADAPTIVE_BASE_SECONDS = Gauge(
+    "watchme_adaptive_base_seconds", "解析APIごとに学習した1回の呼び出しの固定時間", ("endpoint",)
+)
+ADAPTIVE_FILES_PER_SECOND = Gauge(
+    "watchme_adaptive_files_per_second", "解析APIごとの直近の処理速度（ファイル/秒）", ("endpoint",)
+)
+FILE_RETRY_FAILURES_TOTAL = Counter(
+    "watchme_file_retry_failures_total", "解析APIで失敗したファイル数（retry: 再試行待ち / dead_letter: デッドレターへ移動）", ("backend", "outcome")
+)
+FILE_RETRY_DEAD_LETTERS = Gauge(
+    "watchme_file_retry_dead_letters", "デッドレターにあるファイル数", ("backend",)
+)
+
+
+class InFlight:
+    """接続プールの同時実行数を計測するコンテキストマネージャ"""
+
+    __slots__ = ("gauge", "saturated", "limit")
+
+    def __init__(self, pool: str, limit: int):
+        self.gauge = POOL_IN_FLIGHT.labels(pool)
+        self.saturated = POOL_SATURATION_TOTAL.labels(pool)
+        self.limit = limit
+
+    def __enter__(self):
+        if self.gauge.value >= self.limit:
+            self.saturated.inc()
+        self.gauge.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self.gauge.dec()
+        return False
+
+
+class MetricsMiddleware:
+    """FastAPIルート単位で処理時間とステータスを記録するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # パスそのものではなくルートのテンプレートをラベルにする（カーディナリティ対策）
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.labels(method, route_path).observe(time.perf_counter() - started)
+            HTTP_REQUESTS_TOTAL.labels(method, route_path, str(status_code)).inc()
@@ -0,0 +1,134 @@
+"""
+通知の一括既読・一括削除
+
+- ids指定: IDをNOTIFICATION_BULK_CHUNK_SIZE件ずつ id=in.(...) にまとめ、チャンクごとに1回のPATCH/DELETEを発行する
+  （URL長の上限に収めるため。同時に発行するのはBULK_CONCURRENCY件まで）
+- filter指定: 条件に一致するidをid順のキーセットページング（select id ... order=id limit=N）で読み、
+  ページごとに ids指定と同じ id=in.(...) のPATCH/DELETEを発行する（該当件数が多くても1文で全件を書き換えない）
+どちらも影響を受けた行のuser_id・type・is_readだけを返させ、件数と通知統計・未読件数の更新に使う
+
+環境変数:
+    NOTIFICATION_BULK_CHUNK_SIZE  1回のPATCH/DELETEにまとめるID数（既定 200）
+"""
+
+import os
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from api.structured_logging import get_logger
+from models.schemas import NotificationBulkFilter, NotificationBulkTarget
+
+
+logger = get_logger("notification_bulk")
+
+TABLE = "notifications"
+BULK_CHUNK_SIZE = int(os.getenv("NOTIFICATION_BULK_CHUNK_SIZE", "200"))
+BULK_CONCURRENCY = 4
+# 影響を受けた行から返させる列（統計カウンターと未読件数キャッシュの更新に必要な分だけ）
+RETURN_COLUMNS = "user_id,type,is_read"
+
+
+def _quote(value: str) -> str:
+    # in.(...) の中ではカンマ・括弧を含む値も1つの値として扱われるよう二重引用符で囲む
+    return '"' + value.replace('"', '\\"') + '"'
+
+
+def _in(ids: List[str]) -> str:
+    return f"in.({','.join(_quote(str(value)) for value in ids)})"
+
+
+def filter_conditions(bulk_filter: NotificationBulkFilter) -> Dict[str, Any]:
+    """一括操作の条件をPostgRESTの条件に変換"""
+    where: Dict[str, Any] = {}
+    if bulk_filter.user_id:
+        where["user_id"] = f"eq.{bulk_filter.user_id}"
+    if bulk_filter.type:
+        where["type"] = f"eq.{bulk_filter.type.value}"
+    if bulk_filter.created_before:
+        where["created_at"] = f"lt.{bulk_filter.created_before.isoformat()}"
+    return where
+
+
+async def statement_conditions(client, target: NotificationBulkTarget,
+                               extra: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """1回のPATCH/DELETEごとの条件（filter指定はextraも満たす行のidをキーセットページングで読みながら返す）"""
+    if target.filter is None:
+        ids = list(dict.fromkeys(target.ids))
+        for start in range(0, len(ids), BULK_CHUNK_SIZE):
+            yield {"id": _in(ids[start:start + BULK_CHUNK_SIZE])}
+        return
+
+    conditions = {**filter_conditions(target.filter), **(extra or {})}
+    last_id: Optional[str] = None
+    while True:
+        where = dict(conditions)
+        if last_id is not None:
+            where["id"] = f"gt.{last_id}"
+        rows = await client.select(TABLE, columns="id", where=where, order="id.asc", limit=BULK_CHUNK_SIZE)
+        if not rows:
+            return
+        ids = [row["id"] for row in rows]
+        last_id = ids[-1]
+        # 読んでから更新するまでに条件から外れた行は対象にしない
+        yield {**filter_conditions(target.filter), "id": _in(ids)}
+        if len(rows) < BULK_CHUNK_SIZE:
+            return
+
+
+async def _run_statements(operation: str, conditions: AsyncIterator[Dict[str, Any]],
+                          statement: Callable[[Dict[str, Any]], Any]) -> Tuple[List[Dict[str, Any]], int]:
+    """条件ごとの文を同時実行数を制限して実行し、(影響を受けた行, 失敗した文の数)を返す"""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    tasks: List[asyncio.Task] = []
+
+    async def run(where):
+        try:
+            return await statement(where)
+        finally:
+            semaphore.release()
+
+    lookup_error: Optional[Exception] = None
+    try:
+        async for where in conditions:
+            # 実行中の文がBULK_CONCURRENCY件に達したら、次のページを読む前に空きを待つ
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(run(where)))
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    except Exception as e:
+        # 対象のidを読めなくなった場合は、発行済みの文の結果を返して止める（失敗した文として数える）
+        lookup_error = e
+    results: List[Any] = await asyncio.gather(*tasks, return_exceptions=True)
+    if lookup_error is not None:
+        results.append(lookup_error)
+
+    rows: List[Dict[str, Any]] = []
+    failed = 0
+    for result in results:
+        if isinstance(result, BaseException):
+            failed += 1
+            logger.error("notification bulk statement failed", extra={"operation": operation, "error": str(result)})
+        else:
+            rows.extend(result)
+    if results and failed == len(results):
+        raise results[0]
+    return rows, failed
+
+
+async def bulk_mark_read(client, target: NotificationBulkTarget, is_read: bool) -> Tuple[List[Dict[str, Any]], int]:
+    """既読フラグを一括更新（既読状態が変わる行だけを更新対象にする）"""
+    current = {"is_read": f"eq.{str(not is_read).lower()}"}
+    return await _run_statements(
+        "mark_read", statement_conditions(client, target, current),
+        lambda where: client.update_many(TABLE, {"is_read": is_read}, where={**where, **current}, columns=RETURN_COLUMNS),
+    )
+
+
+async def bulk_delete(client, target: NotificationBulkTarget) -> Tuple[List[Dict[str, Any]], int]:
+    """通知を一括削除"""
+    return await _run_statements(
+        "delete", statement_conditions(client, target),
+        lambda where: client.delete_many(TABLE, where=where, columns=RETURN_COLUMNS),
+    )
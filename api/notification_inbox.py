@@ -0,0 +1,111 @@
+"""
+ユーザーごとの通知受信箱（カーソルページング）と未読件数キャッシュ
+
+- 受信箱: created_at・idの降順で並べ、最後の行の(created_at, id)をカーソルにして次のページを取得する
+  （OFFSETを使わないため、履歴の件数に関係なく1ページの取得時間は一定）
+- 未読件数: ユーザーごとの件数をメモリに保持し、通知の書き込みのたびに増減する。
+  キャッシュにないユーザーだけ件数取得（Prefer: count=exact）を行う。
+  他のワーカーの書き込みはTTL（NOTIFICATION_UNREAD_TTL_SECONDS）が切れるまで反映されない
+
+環境変数:
+    NOTIFICATION_UNREAD_TTL_SECONDS  未読件数キャッシュの有効期間（既定 300秒）
+    NOTIFICATION_UNREAD_CACHE_SIZE   キャッシュするユーザー数の上限（既定 100000）
+"""
+
+import os
+import time
+import base64
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+from api.metrics import CACHE_REQUESTS_TOTAL
+
+
+TABLE = "notifications"
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([row["created_at"], row["id"]])).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """カーソルを(created_at, id)に戻す（不正な値はValueError）"""
+    try:
+        created_at, notification_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(notification_id)
+    except Exception:
+        raise ValueError("cursorが不正です")
+
+
+def _quote(value: str) -> str:
+    # or=(...) の中ではカンマ・ピリオド・コロン・括弧を含む値を二重引用符で囲む
+    return '"' + value.replace('"', '\\"') + '"'
+
+
+async def fetch_inbox(client, user_id: str, limit: int, cursor: Optional[str] = None,
+                      unread_only: bool = False) -> Dict[str, Any]:
+    """ユーザーの通知を新しい順に1ページ取得"""
+    where: Dict[str, Any] = {}
+    if cursor:
+        created_at, notification_id = decode_cursor(cursor)
+        where["or"] = (f"(created_at.lt.{_quote(created_at)},"
+                       f"and(created_at.eq.{_quote(created_at)},id.lt.{_quote(notification_id)}))")
+    if unread_only:
+        where["is_read"] = "eq.false"
+
+    # 1件多く取得して次のページの有無を判定する
+    rows = await client.select(TABLE, filters={"user_id": user_id}, where=where,
+                               order="created_at.desc,id.desc", limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": rows,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+        "has_more": has_more,
+    }
+
+
+class UnreadCountCache:
+    """ユーザーごとの未読件数（LRU + TTL）"""
+
+    def __init__(self, get_client: Callable[[], Any], ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.get_client = get_client
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("NOTIFICATION_UNREAD_TTL_SECONDS", "300"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("NOTIFICATION_UNREAD_CACHE_SIZE", "100000"))
+        self._entries: "OrderedDict[str, List[Any]]" = OrderedDict()  # user_id -> [未読件数, 取得時刻]
+
+    async def get(self, user_id: str) -> Tuple[int, bool]:
+        """(未読件数, キャッシュから返したか)"""
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+            self._entries.move_to_end(user_id)
+            CACHE_REQUESTS_TOTAL.labels("notification_unread", "hit").inc()
+            return entry[0], True
+
+        CACHE_REQUESTS_TOTAL.labels("notification_unread", "miss").inc()
+        count = await self.get_client().count(TABLE, filters={"user_id": user_id, "is_read": "false"})
+        self._entries[user_id] = [count, time.monotonic()]
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return count, False
+
+    def adjust(self, user_id: Optional[str], delta: int):
+        """キャッシュ済みのユーザーの未読件数を増減（未キャッシュなら次の取得時に数える）"""
+        entry = self._entries.get(user_id) if user_id else None
+        if entry is not None and delta:
+            entry[0] = max(0, entry[0] + delta)
+
+    def adjust_many(self, user_ids: Iterable[str], delta: int):
+        for user_id in user_ids:
+            self.adjust(user_id, delta)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """指定ユーザー（省略時は全ユーザー）のキャッシュを破棄"""
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
@@ -0,0 +1,260 @@
+"""
+通知の保持期間ポリシー（アーカイブと一括削除）
+
+- 保持期間を過ぎた通知（既定では既読のもののみ）を作成日時の古い順にバッチ単位で取得し、
+  gzip圧縮したNDJSONファイルに追記してから、同じバッチをIDのチャンクごとに削除する
+  （古い順に消すため、created_atで分割・インデックスしたテーブルでも削除範囲が連続する）
+- アーカイブはバッチごとにフラッシュ・fsyncしてから削除するため、途中で失敗しても削除済みの行は必ずファイルに残る
+- 同時に実行できるのは全ワーカーで1つだけ（アーカイブ先のロックファイルをflockで保持する）
+- 手動実行はバックグラウンドのタスクとして始め、run_idを返す。進捗と結果（件数・所要時間・1秒あたりの処理行数）は
+  アーカイブ先の状態ファイルに書き、どのワーカーからでも確認できる
+
+環境変数:
+    NOTIFICATION_RETENTION_DAYS       保持日数（未設定または0なら無効）
+    NOTIFICATION_RETENTION_READ_ONLY  既読の通知だけを対象にする（既定 true）
+    NOTIFICATION_RETENTION_BATCH_SIZE 1バッチの件数（既定 1000）
+    NOTIFICATION_RETENTION_MAX_ROWS   1回の実行で処理する最大件数（既定 0 = 無制限）
+    NOTIFICATION_RETENTION_HOUR       定期実行の時刻（時、既定 4）
+    NOTIFICATION_ARCHIVE_DIR          アーカイブの出力先（既定 $SCHEDULER_STATE_DIR/archive）
+"""
+
+import os
+import gzip
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+
+from api.metrics import NOTIFICATION_RETENTION_ROWS_TOTAL
+from api.notification_bulk import bulk_delete
+from api.structured_logging import get_logger
+from models.schemas import NotificationBulkTarget
+
+
+logger = get_logger("notification_retention")
+
+TABLE = "notifications"
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+class NotificationRetention:
+    """保持期間を過ぎた通知のアーカイブと削除"""
+
+    def __init__(self, get_client: Callable[[], Any],
+                 on_deleted: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        # on_deleted(rows) は削除した通知（user_id・type・is_read）を通知統計などに反映するためのコールバック
+        self.get_client = get_client
+        self.on_deleted = on_deleted
+        self.retention_days = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "0"))
+        self.read_only = _env_bool("NOTIFICATION_RETENTION_READ_ONLY", True)
+        self.batch_size = int(os.getenv("NOTIFICATION_RETENTION_BATCH_SIZE", "1000"))
+        self.max_rows = int(os.getenv("NOTIFICATION_RETENTION_MAX_ROWS", "0"))
+        self.hour = int(os.getenv("NOTIFICATION_RETENTION_HOUR", "4"))
+        self.archive_dir = os.getenv("NOTIFICATION_ARCHIVE_DIR") or os.path.join(
+            os.getenv("SCHEDULER_STATE_DIR", "/tmp/watchme_admin"), "archive")
+        self.lock_path = os.path.join(self.archive_dir, "retention.lock")
+        self.status_path = os.path.join(self.archive_dir, "retention_status.json")
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.retention_days > 0
+
+    @property
+    def running(self) -> bool:
+        """いずれかのワーカーで実行中か（ロックファイルのロックが取れるかで判定）"""
+        fd = self._try_lock(shared=True)
+        if fd is None:
+            return True
+        self._unlock(fd)
+        return False
+
+    # -------------------------------------------------------------------------
+    # ワーカー間のロックと状態ファイル
+    # -------------------------------------------------------------------------
+
+    def _try_lock(self, shared: bool = False) -> Optional[int]:
+        os.makedirs(self.archive_dir, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _save_status(self, report: Dict[str, Any]):
+        temporary = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False)
+        os.replace(temporary, self.status_path)
+
+    @property
+    def last_report(self) -> Optional[Dict[str, Any]]:
+        """最後（または実行中）の実行の状態。実行中のまま止まったものはinterruptedとして返す"""
+        try:
+            with open(self.status_path, encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if report.get("status") == "running" and not self.running:
+            report["status"] = "interrupted"
+        return report
+
+    def policy(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "retention_days": self.retention_days,
+            "read_only": self.read_only,
+            "batch_size": self.batch_size,
+            "max_rows": self.max_rows or None,
+            "hour": self.hour,
+            "archive_dir": self.archive_dir,
+        }
+
+    def _conditions(self, cutoff: datetime) -> Dict[str, Any]:
+        where: Dict[str, Any] = {"created_at": f"lt.{cutoff.isoformat()}"}
+        if self.read_only:
+            where["is_read"] = "eq.true"
+        return where
+
+    @staticmethod
+    def _write(archive, rows: List[Dict[str, Any]]) -> None:
+        archive.write(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+        archive.flush()
+        os.fsync(archive.fileobj.fileno())
+
+    async def dry_run(self) -> Dict[str, Any]:
+        """保持期間を過ぎた通知の件数だけを数える"""
+        if not self.enabled:
+            raise ValueError("NOTIFICATION_RETENTION_DAYSが設定されていません")
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        expired = await self.get_client().count(TABLE, where=self._conditions(cutoff))
+        return {"dry_run": True, "cutoff": cutoff.isoformat(), "expired": expired}
+
+    def _acquire(self) -> int:
+        if not self.enabled:
+            raise ValueError("NOTIFICATION_RETENTION_DAYSが設定されていません")
+        fd = self._try_lock()
+        if fd is None:
+            raise RuntimeError("保持期間ポリシーは実行中です")
+        return fd
+
+    def start(self) -> Dict[str, Any]:
+        """バックグラウンドで実行を始め、状態の確認に使うrun_idを返す"""
+        fd = self._acquire()
+        run_id = uuid.uuid4().hex[:12]
+        self._task = asyncio.create_task(self._guarded(fd, run_id, "manual"))
+        return {"run_id": run_id, "status": "running", "started_at": datetime.now().isoformat()}
+
+    async def _guarded(self, fd: int, run_id: str, trigger: str):
+        try:
+            await self._execute(fd, run_id, trigger)
+        except Exception as e:
+            logger.error("notification retention failed", extra={"run_id": run_id, "error": str(e)})
+
+    async def run_scheduled(self):
+        """定期実行用（失敗や他のワーカーでの実行中はログに残して例外を外に出さない）"""
+        try:
+            fd = self._acquire()
+        except (ValueError, RuntimeError) as e:
+            logger.warning("notification retention skipped", extra={"reason": str(e)})
+            return
+        await self._guarded(fd, uuid.uuid4().hex[:12], "scheduled")
+
+    async def _execute(self, fd: int, run_id: str, trigger: str) -> Dict[str, Any]:
+        """保持期間を過ぎた通知をアーカイブして削除（fdはこの実行が保持するロック。終了時に解放する）"""
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+            where = self._conditions(cutoff)
+            client = self.get_client()
+
+            started_at = datetime.now()
+            started = time.perf_counter()
+            path = os.path.join(self.archive_dir, f"notifications-{started_at:%Y%m%d-%H%M%S}.ndjson.gz")
+            report: Dict[str, Any] = {
+                "run_id": run_id,
+                "trigger": trigger,
+                "status": "running",
+                "pid": os.getpid(),
+                "dry_run": False,
+                "started_at": started_at.isoformat(),
+                "cutoff": cutoff.isoformat(),
+                "archived": 0,
+                "deleted": 0,
+                "batches": 0,
+            }
+            await asyncio.to_thread(self._save_status, report)
+            error = None
+
+            archive = await asyncio.to_thread(gzip.open, path, "wb")
+            try:
+                while not self.max_rows or report["archived"] < self.max_rows:
+                    limit = self.batch_size if not self.max_rows else min(self.batch_size, self.max_rows - report["archived"])
+                    rows = await client.select(TABLE, where=where, order="created_at.asc,id.asc", limit=limit)
+                    if not rows:
+                        break
+                    await asyncio.to_thread(self._write, archive, rows)
+                    report["archived"] += len(rows)
+                    NOTIFICATION_RETENTION_ROWS_TOTAL.labels("archived").inc(len(rows))
+
+                    removed, failed_chunks = await bulk_delete(client, NotificationBulkTarget(ids=[row["id"] for row in rows]))
+                    report["deleted"] += len(removed)
+                    report["batches"] += 1
+                    NOTIFICATION_RETENTION_ROWS_TOTAL.labels("deleted").inc(len(removed))
+                    if self.on_deleted is not None:
+                        self.on_deleted(removed)
+                    # 進捗を状態ファイルに反映（他のワーカーからも確認できる）
+                    await asyncio.to_thread(self._save_status, report)
+                    if failed_chunks:
+                        # 削除できなかった行は次のバッチで再び取得されるため、ここで打ち切る
+                        error = f"{failed_chunks}チャンクの削除に失敗しました"
+                        break
+                    if len(rows) < limit:
+                        break
+            except Exception as e:
+                error = str(e)
+            finally:
+                await asyncio.to_thread(archive.close)
+
+            archived = report["archived"]
+            if archived == 0:
+                os.remove(path)
+            duration = time.perf_counter() - started
+            report.update({
+                "status": "failed" if error else "completed",
+                "finished_at": datetime.now().isoformat(),
+                "duration_seconds": round(duration, 3),
+                "rows_per_second": round(report["deleted"] / duration, 1) if duration > 0 else None,
+                "archive_file": path if archived else None,
+                "archive_bytes": os.path.getsize(path) if archived else 0,
+                "error": error,
+            })
+            await asyncio.to_thread(self._save_status, report)
+            (logger.error if error else logger.info)("notification retention finished", extra=report)
+            return report
+        finally:
+            self._unlock(fd)
+
+    async def close(self):
+        """終了時に実行中のタスクを止める（削除済みの行はアーカイブ済みなので途中で止めても失われない）"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
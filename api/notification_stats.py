@@ -0,0 +1,161 @@
+"""
+通知統計（総数・未読数・タイプ別件数）のカウンター
+
+- 初回の統計取得時に、PostgRESTの件数取得（Prefer: count=exact、行は転送しない）で初期値を作る
+- 以降は通知の作成・一括送信・既読切り替え・削除のたびにこのプロセスのカウンターを増減するため、
+  統計APIは通知の件数に関係なくO(1)で返る
+- 他のワーカーや管理画面以外からの書き込みによるずれは、一定間隔の突き合わせ（バックグラウンド）で補正する
+
+環境変数:
+    NOTIFICATION_STATS_RECONCILE_SECONDS  データベースとの突き合わせ間隔（既定 300秒）
+"""
+
+import os
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from api.metrics import CACHE_REQUESTS_TOTAL
+from api.structured_logging import get_logger
+
+
+logger = get_logger("notification_stats")
+
+TABLE = "notifications"
+# typeが未設定の通知の集計キー（従来の統計APIと同じ）
+UNKNOWN_TYPE = "unknown"
+
+
+class NotificationCounters:
+    """通知の総数・未読数・タイプ別件数をインクリメンタルに保持する"""
+
+    def __init__(self, get_client: Callable[[], Any], known_types: Iterable[str] = (),
+                 reconcile_seconds: Optional[float] = None):
+        # get_client() でSupabaseClientを取得する（初回の統計取得まで作成しない）
+        self.get_client = get_client
+        self.known_types = tuple(known_types)
+        self.reconcile_seconds = reconcile_seconds if reconcile_seconds is not None else float(os.getenv("NOTIFICATION_STATS_RECONCILE_SECONDS", "300"))
+        self._total = 0
+        self._unread = 0
+        self._by_type: Dict[str, int] = {}
+        self._seeded = False
+        self._reconciled_at = 0.0
+        self._reconciled_at_wall: Optional[datetime] = None
+        # 突き合わせ中の増減（件数取得の結果に足し戻す）
+        self._journal: Optional[List[Tuple[str, int, int]]] = None
+        self._lock = asyncio.Lock()
+        self._reconcile_task: Optional[asyncio.Task] = None
+
+    # -------------------------------------------------------------------------
+    # 書き込み時の増減
+    # -------------------------------------------------------------------------
+
+    def _apply(self, notification_type: Optional[str], total: int, unread: int):
+        notification_type = notification_type or UNKNOWN_TYPE
+        if self._journal is not None:
+            self._journal.append((notification_type, total, unread))
+        if not self._seeded:
+            # 初期化前の書き込みは初期化時の件数取得に含まれる
+            return
+        self._total += total
+        self._unread += unread
+        self._by_type[notification_type] = self._by_type.get(notification_type, 0) + total
+
+    def created(self, notification_type: Optional[str], count: int = 1, is_read: bool = False):
+        """通知の作成（一括送信はcountにまとめて渡す）"""
+        if count:
+            self._apply(notification_type, count, 0 if is_read else count)
+
+    def deleted(self, notification_type: Optional[str], is_read: bool, count: int = 1):
+        if count:
+            self._apply(notification_type, -count, 0 if is_read else -count)
+
+    def read_changed(self, notification_type: Optional[str], was_read: bool, is_read: bool):
+        """既読状態の切り替え（変化がなければ何もしない）"""
+        if bool(was_read) != bool(is_read):
+            self._apply(notification_type, 0, 1 if was_read else -1)
+
+    # -------------------------------------------------------------------------
+    # データベースとの突き合わせ
+    # -------------------------------------------------------------------------
+
+    async def _count_types(self, client, types: List[str]) -> Dict[str, int]:
+        counts = await asyncio.gather(*(client.count(TABLE, filters={"type": t}) for t in types))
+        return dict(zip(types, counts))
+
+    async def _fetch(self) -> Tuple[int, int, Dict[str, int]]:
+        """件数取得だけで総数・未読数・タイプ別件数を求める"""
+        client = self.get_client()
+        types = sorted((set(self.known_types) | set(self._by_type)) - {UNKNOWN_TYPE})
+        total, unread, unknown, by_type = await asyncio.gather(
+            client.count(TABLE),
+            client.count(TABLE, filters={"is_read": "false"}),
+            client.count(TABLE, where={"type": "is.null"}),
+            self._count_types(client, types),
+        )
+        by_type[UNKNOWN_TYPE] = unknown
+
+        # 想定外のtypeがある場合は1種類ずつ見つけて数える（行の転送は種類数×1行だけ）
+        while sum(by_type.values()) < total:
+            quoted = ",".join('"' + t.replace('"', '\\"') + '"' for t in by_type if t != UNKNOWN_TYPE)
+            rows = await client.select(TABLE, columns="type", where={"type": f"not.in.({quoted})"}, limit=1)
+            if not rows:
+                break
+            by_type.update(await self._count_types(client, [rows[0]["type"]]))
+        return total, unread, by_type
+
+    async def reconcile(self):
+        """データベースの件数で置き換える（取得中に行われた書き込みは足し戻す）"""
+        started = time.perf_counter()
+        self._journal = []
+        try:
+            total, unread, by_type = await self._fetch()
+            for notification_type, total_delta, unread_delta in self._journal:
+                total += total_delta
+                unread += unread_delta
+                by_type[notification_type] = by_type.get(notification_type, 0) + total_delta
+        finally:
+            self._journal = None
+
+        drift = total - self._total if self._seeded else 0
+        self._total, self._unread = total, unread
+        self._by_type = {t: count for t, count in by_type.items() if count}
+        self._seeded = True
+        self._reconciled_at = time.monotonic()
+        self._reconciled_at_wall = datetime.now()
+        logger.info("notification stats reconciled", extra={
+            "total": total, "drift": drift, "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    async def _guarded_reconcile(self):
+        async with self._lock:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error("notification stats reconcile failed", extra={"error": str(e)})
+
+    # -------------------------------------------------------------------------
+    # 参照
+    # -------------------------------------------------------------------------
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """現在の統計（未初期化なら初期化し、突き合わせ間隔を過ぎていればバックグラウンドで突き合わせる）"""
+        if not self._seeded:
+            CACHE_REQUESTS_TOTAL.labels("notification_stats", "miss").inc()
+            async with self._lock:
+                if not self._seeded:
+                    await self.reconcile()
+        else:
+            CACHE_REQUESTS_TOTAL.labels("notification_stats", "hit").inc()
+            running = self._reconcile_task is not None and not self._reconcile_task.done()
+            if not running and time.monotonic() - self._reconciled_at >= self.reconcile_seconds:
+                self._reconcile_task = asyncio.create_task(self._guarded_reconcile())
+
+        return {
+            "total_notifications": self._total,
+            "unread_notifications": self._unread,
+            "read_notifications": self._total - self._unread,
+            "type_breakdown": dict(self._by_type),
+            "reconciled_at": self._reconciled_at_wall.isoformat() if self._reconciled_at_wall else None,
+        }
@@ -0,0 +1,220 @@
+"""
+複数ワーカー・複数レプリカ構成でのスケジューラー調停
+
+- ファイルロック（fcntl.flock）によるリーダー選出: ロックを取得した1プロセスだけがcronジョブを実行する
+  （プロセスが終了するとロックは自動で解放され、他のワーカーが次回の確認時に引き継ぐ）
+- SQLiteによる共有状態: スケジューラーの有効/無効とログをワーカー間で共有し、
+  どのワーカーがリクエストを受けても同じ状態を返す
+- イベントループ上ではSQLiteを触らない: 有効/無効はメモリ上のキャッシュから返し、ログはメモリにためる。
+  キャッシュの読み直しとログの書き込みは調停ループからsync()をスレッドで呼んでまとめて行う
+
+環境変数:
+    SCHEDULER_MODE       auto（既定、ロックで選出）/ always（常に実行）/ never（実行しない）
+    SCHEDULER_STATE_DIR  ロックファイルとSQLiteの配置先（既定 /tmp/watchme_admin）
+                         複数コンテナで共有する場合は同じボリュームをマウントする
+"""
+
+import os
+import json
+import fcntl
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from api.structured_logging import get_logger
+
+
+logger = get_logger("scheduler.coordinator")
+
+MAX_LOGS_PER_SCHEDULER = 100
+
+
+class SchedulerCoordinator:
+    """スケジューラーのリーダー選出と共有状態の管理"""
+
+    def __init__(self, state_dir: Optional[str] = None, mode: Optional[str] = None):
+        self.state_dir = state_dir or os.getenv("SCHEDULER_STATE_DIR", "/tmp/watchme_admin")
+        self.mode = (mode or os.getenv("SCHEDULER_MODE", "auto")).lower()
+        if self.mode not in ("auto", "always", "never"):
+            raise ValueError(f"SCHEDULER_MODEが不正です: {self.mode}")
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.lock_path = os.path.join(self.state_dir, "scheduler.lock")
+        self.db_path = os.path.join(self.state_dir, "scheduler_state.sqlite3")
+        self._lock_fd: Optional[int] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._enabled: Optional[Dict[str, bool]] = None
+        self._enabled_version = 0
+        self._pending_logs: List[tuple] = []
+        self._pending_lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # リーダー選出
+    # -------------------------------------------------------------------------
+
+    @property
+    def is_leader(self) -> bool:
+        if self.mode == "always":
+            return True
+        if self.mode == "never":
+            return False
+        return self._lock_fd is not None
+
+    def try_acquire_leadership(self) -> bool:
+        """ロックの取得を試みる（取得済みなら何もしない）"""
+        if self.mode != "auto" or self._lock_fd is not None:
+            return self.is_leader
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._lock_fd = fd
+        logger.info("scheduler leadership acquired", extra={"pid": os.getpid()})
+        return True
+
+    def release_leadership(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+            logger.info("scheduler leadership released", extra={"pid": os.getpid()})
+
+    def leader_pid(self) -> Optional[int]:
+        """ロックファイルに記録されたリーダーのPID（ロックを持つプロセスがいなければNone）"""
+        if self._lock_fd is not None:
+            return os.getpid()
+        try:
+            fd = os.open(self.lock_path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            # 共有ロックが取れる = 排他ロックを持つリーダーがいない（記録は終了したリーダーのもの）
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                with os.fdopen(os.dup(fd)) as f:
+                    return int(f.read().strip() or 0) or None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return None
+        except ValueError:
+            return None
+        finally:
+            os.close(fd)
+
+    # -------------------------------------------------------------------------
+    # 共有状態（SQLite）
+    # -------------------------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS scheduler_state (name TEXT PRIMARY KEY, enabled INTEGER NOT NULL, updated_at TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS scheduler_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, entry TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS scheduler_logs_name ON scheduler_logs (name, id)")
+            self._conn = conn
+        return self._conn
+
+    def set_enabled(self, name: str, enabled: bool):
+        """有効/無効を書き込む（利用者の操作時のみ。キャッシュにもすぐ反映する）"""
+        with self._db_lock:
+            self._connection().execute(
+                "INSERT INTO scheduler_state (name, enabled, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET enabled = excluded.enabled, updated_at = excluded.updated_at",
+                (name, int(enabled), datetime.now().isoformat()),
+            )
+        self.enabled_states()[name] = enabled
+        self._enabled_version += 1
+
+    def is_enabled(self, name: str) -> bool:
+        """キャッシュから返す（他のワーカーでの変更はsync()で反映される）"""
+        return self.enabled_states().get(name, False)
+
+    def enabled_states(self) -> Dict[str, bool]:
+        if self._enabled is None:
+            self._enabled = self._load_enabled()
+        return self._enabled
+
+    def _load_enabled(self) -> Dict[str, bool]:
+        with self._db_lock:
+            rows = self._connection().execute("SELECT name, enabled FROM scheduler_state").fetchall()
+        return {name: bool(enabled) for name, enabled in rows}
+
+    def append_log(self, name: str, entry: Dict[str, Any]):
+        """ログをメモリにためる（SQLiteへの書き込みはsync()でまとめて行う）"""
+        with self._pending_lock:
+            self._pending_logs.append((name, json.dumps(entry, ensure_ascii=False, default=str)))
+            # 書き込めない状態が続いても、メモリにためるログは一定件数までにする
+            if len(self._pending_logs) > MAX_LOGS_PER_SCHEDULER * 20:
+                del self._pending_logs[:len(self._pending_logs) - MAX_LOGS_PER_SCHEDULER * 20]
+
+    def _pending_for(self, name: str) -> List[str]:
+        with self._pending_lock:
+            return [entry for pending_name, entry in self._pending_logs if pending_name == name]
+
+    def flush_logs(self):
+        """ためたログを1つのトランザクションで書き込み、スケジューラーごとに最新100件だけ残す"""
+        with self._pending_lock:
+            pending, self._pending_logs = self._pending_logs, []
+        if not pending:
+            return
+        with self._db_lock:
+            conn = self._connection()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT INTO scheduler_logs (name, entry) VALUES (?, ?)", pending)
+                for name in {name for name, _ in pending}:
+                    conn.execute(
+                        "DELETE FROM scheduler_logs WHERE name = ? AND id <= "
+                        "(SELECT id FROM scheduler_logs WHERE name = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (name, name, MAX_LOGS_PER_SCHEDULER),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                # 書き込めなかったログは次回に回す
+                with self._pending_lock:
+                    self._pending_logs[:0] = pending
+                raise
+
+    def sync(self):
+        """ログを書き込み、有効/無効のキャッシュを読み直す（ブロックするためスレッドで呼ぶ）"""
+        self.flush_logs()
+        version = self._enabled_version
+        enabled = self._load_enabled()
+        # 読み込み中にこのプロセスで変更された場合は、古い値で上書きしない
+        if version == self._enabled_version:
+            self._enabled = enabled
+
+    def recent_logs(self, name: str, limit: int) -> List[Dict[str, Any]]:
+        """新しい順にlimit件取得し、古い順に並べて返す（未書き込みのログを含む。ブロックするためスレッドで呼ぶ）"""
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT entry FROM scheduler_logs WHERE name = ? ORDER BY id DESC LIMIT ?", (name, limit)
+            ).fetchall()
+        entries = [row[0] for row in reversed(rows)] + self._pending_for(name)
+        return [json.loads(entry) for entry in entries[-limit:]]
+
+    def count_logs(self, name: str) -> int:
+        with self._db_lock:
+            row = self._connection().execute("SELECT COUNT(*) FROM scheduler_logs WHERE name = ?", (name,)).fetchone()
+        return min(MAX_LOGS_PER_SCHEDULER, row[0] + len(self._pending_for(name)))
+
+    def close(self):
+        self.release_leadership()
+        try:
+            self.flush_logs()
+        except Exception as e:
+            logger.error("scheduler logs not flushed on shutdown", extra={"error": str(e)})
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
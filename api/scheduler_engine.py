@@ -0,0 +1,154 @@
+"""
+全スケジューラー共通のジョブ実行エンジン
+
+- 1つのAsyncIOSchedulerで試験スケジューラーとAPIスケジューラーのすべてのジョブを管理する
+- 全体とバックエンド（whisper / sed / opensmile / prompt など）ごとに同時実行数の上限を設ける
+- 3時間おきのジョブはバックエンドごとに開始分をずらし、0時ちょうどに一斉に動かないようにする
+- 登録済みジョブを1つの一覧として返す
+
+環境変数:
+    SCHEDULER_MAX_CONCURRENT_JOBS      全体の同時実行数上限（既定 4）
+    SCHEDULER_BACKEND_CONCURRENCY      バックエンドごとの同時実行数上限（既定 1）
+    SCHEDULER_STAGGER_MINUTES          バックエンドごとの開始時刻のずらし幅（既定 15分）
+"""
+
+import os
+import time
+import asyncio
+import functools
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+from api.metrics import SCHEDULER_JOBS_RUNNING, SCHEDULER_WAIT_SECONDS
+from api.structured_logging import get_logger
+
+
+logger = get_logger("scheduler.engine")
+
+# 3時間おき (0, 3, 6, 9, 12, 15, 18, 21時)
+TRIAL_CRON_HOURS = "0,3,6,9,12,15,18,21"
+
+
+class SchedulerEngine:
+    """ジョブの登録・同時実行数の制御・一覧表示をまとめて行う"""
+
+    def __init__(self, max_concurrent: Optional[int] = None, backend_concurrency: Optional[int] = None,
+                 stagger_minutes: Optional[int] = None):
+        self.max_concurrent = max_concurrent or int(os.getenv("SCHEDULER_MAX_CONCURRENT_JOBS", "4"))
+        self.backend_concurrency = backend_concurrency or int(os.getenv("SCHEDULER_BACKEND_CONCURRENCY", "1"))
+        self.stagger_minutes = stagger_minutes if stagger_minutes is not None else int(os.getenv("SCHEDULER_STAGGER_MINUTES", "15"))
+        self.scheduler = AsyncIOScheduler()
+        self._global_slots: Optional[asyncio.Semaphore] = None
+        self._backend_slots: Dict[str, asyncio.Semaphore] = {}
+        self._backend_offsets: Dict[str, int] = {}
+        self._job_info: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, int] = {}
+
+    # -------------------------------------------------------------------------
+    # 同時実行数の制御
+    # -------------------------------------------------------------------------
+
+    def _slots(self, backend: str):
+        if self._global_slots is None:
+            self._global_slots = asyncio.Semaphore(self.max_concurrent)
+        if backend not in self._backend_slots:
+            self._backend_slots[backend] = asyncio.Semaphore(self.backend_concurrency)
+        return self._global_slots, self._backend_slots[backend]
+
+    async def run(self, backend: str, func: Callable[..., Awaitable[Any]], *args, **kwargs):
+        """上限の範囲内でジョブを実行（バックエンドの枠を先に確保し、全体の枠を無駄に占有しない）"""
+        global_slots, backend_slots = self._slots(backend)
+        started = time.perf_counter()
+        async with backend_slots, global_slots:
+            SCHEDULER_WAIT_SECONDS.labels(backend).observe(time.perf_counter() - started)
+            gauge = SCHEDULER_JOBS_RUNNING.labels(backend)
+            gauge.inc()
+            self._running[backend] = self._running.get(backend, 0) + 1
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                gauge.dec()
+                self._running[backend] -= 1
+
+    def _limited(self, backend: str, func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.run(backend, func, *args, **kwargs)
+        return wrapper
+
+    # -------------------------------------------------------------------------
+    # ジョブ管理
+    # -------------------------------------------------------------------------
+
+    def stagger_minute(self, backend: str) -> int:
+        """バックエンドごとの開始分（登録順に stagger_minutes ずつずらす）"""
+        if backend not in self._backend_offsets:
+            self._backend_offsets[backend] = (len(self._backend_offsets) * self.stagger_minutes) % 60
+        return self._backend_offsets[backend]
+
+    def _ensure_started(self):
+        # APSchedulerはジョブを登録するときに初めて起動する
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def add_staggered_cron_job(self, job_id: str, func: Callable[..., Awaitable[Any]], backend: str,
+                               hour: str = TRIAL_CRON_HOURS, name: Optional[str] = None):
+        """バックエンドごとに開始分をずらしたcronジョブを登録"""
+        trigger = CronTrigger(hour=hour, minute=self.stagger_minute(backend))
+        self._add_job(job_id, func, backend, trigger, name=name)
+
+    def add_job(self, job_id: str, func: Callable[..., Awaitable[Any]], backend: str, trigger,
+                name: Optional[str] = None, **kwargs):
+        """任意のトリガーでジョブを登録"""
+        self._add_job(job_id, func, backend, trigger, name=name, **kwargs)
+
+    def _add_job(self, job_id: str, func, backend: str, trigger, name: Optional[str] = None, **kwargs):
+        self._ensure_started()
+        self.scheduler.add_job(self._limited(backend, func), trigger=trigger, id=job_id, name=name or job_id,
+                               replace_existing=True, coalesce=True, max_instances=1, **kwargs)
+        self._job_info[job_id] = {"backend": backend, "registered_at": datetime.now()}
+        logger.info("scheduler job registered", extra={"job_id": job_id, "backend": backend, "trigger": str(trigger)})
+
+    def remove_job(self, job_id: str) -> bool:
+        self._job_info.pop(job_id, None)
+        if self.scheduler.get_job(job_id) is None:
+            return False
+        self.scheduler.remove_job(job_id)
+        logger.info("scheduler job removed", extra={"job_id": job_id})
+        return True
+
+    def has_job(self, job_id: str) -> bool:
+        return job_id in self._job_info and self.scheduler.get_job(job_id) is not None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """登録済みジョブの一覧（次回実行時刻順）"""
+        jobs = []
+        for job in self.scheduler.get_jobs() if self.scheduler.running else []:
+            info = self._job_info.get(job.id, {})
+            backend = info.get("backend")
+            jobs.append({
+                "job_id": job.id,
+                "name": job.name,
+                "backend": backend,
+                "trigger": str(job.trigger),
+                "next_run": job.next_run_time,
+                "registered_at": info.get("registered_at"),
+                "running": self._running.get(backend, 0),
+            })
+        jobs.sort(key=lambda job: (job["next_run"] is None, job["next_run"] or datetime.max))
+        return jobs
+
+    def limits(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "backend_concurrency": self.backend_concurrency,
+            "stagger_minutes": self.stagger_minutes,
+            "running": dict(self._running),
+        }
+
+    def shutdown(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
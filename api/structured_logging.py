@@ -0,0 +1,160 @@
+"""
+構造化ログ（JSON Lines）の非同期出力
+ログレコードはキューに積むだけにし、標準出力への書き込みはバックグラウンドスレッドで行う
+リクエストID・ジョブIDなどの相関IDをcontextvarsで引き回す
+"""
+
+import os
+import sys
+import json
+import uuid
+import queue
+import atexit
+import random
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+
+LOGGER_NAME = "watchme"
+CORRELATION_HEADER = "X-Request-ID"
+
+# 現在処理中のリクエスト/ジョブの相関ID
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+# LogRecordの標準属性（これ以外の属性はextraとしてJSONに含める）
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[QueueListener] = None
+
+
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """watchme配下のロガーを取得"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+def new_correlation_id(prefix: Optional[str] = None) -> str:
+    """新しい相関IDを発行して現在のコンテキストに設定"""
+    value = uuid.uuid4().hex[:16]
+    if prefix:
+        value = f"{prefix}-{value}"
+    correlation_id.set(value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコード1行のJSONに整形"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            payload["correlation_id"] = record.correlation_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key != "correlation_id":
+                payload[key] = value
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """呼び出し元スレッドで相関IDを付与し、DEBUGレコードをサンプリングする"""
+
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0:
+            if random.random() >= self.debug_sample_rate:
+                return False
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """整形はリスナースレッドに任せ、呼び出し側ではメッセージの確定だけを行う"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging():
+    """構造化ログを初期化（複数回呼ばれても1度だけ設定する）"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    debug_sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter(debug_sample_rate))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """キューに残ったログを書き出してリスナーを停止"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class CorrelationIdMiddleware:
+    """リクエストごとに相関IDを設定し、レスポンスヘッダーに付与するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header_name = CORRELATION_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == self.header_name:
+                request_id = value.decode("latin-1")
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex[:16]
+        token = correlation_id.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((self.header_name, request_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            correlation_id.reset(token)
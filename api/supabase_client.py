@@ -1,10 +1,50 @@
 import os
+import time
+import asyncio
+import functools
 import httpx
 from typing import Dict, List, Optional, Any
 from dotenv import load_dotenv
 
+from api.metrics import SUPABASE_REQUEST_SECONDS, SUPABASE_ERRORS_TOTAL, InFlight
+from api.tracing import start_span, tracing_enabled, NOOP_SPAN
+
 load_dotenv()
 
+# httpxのデフォルト接続上限に合わせる
+SUPABASE_POOL_LIMIT = 100
+_supabase_in_flight = InFlight("supabase", SUPABASE_POOL_LIMIT)
+
+
+def error_code(error: httpx.HTTPStatusError) -> Optional[str]:
+    """PostgRESTのエラー応答に含まれるPostgreSQLのエラーコード（例: 42P10）"""
+    try:
+        body = error.response.json()
+    except ValueError:
+        return None
+    return body.get("code") if isinstance(body, dict) else None
+
+
+def _instrumented(operation: str):
+    """テーブル・操作ごとの処理時間・エラー数とトレースspanを記録するデコレーター"""
+    span_name = f"supabase.{operation}"
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, table: str, *args, **kwargs):
+            started = time.perf_counter()
+            span = start_span(span_name, {"db.table": table}) if tracing_enabled() else NOOP_SPAN
+            with _supabase_in_flight, span:
+                try:
+                    return await func(self, table, *args, **kwargs)
+                except Exception:
+                    SUPABASE_ERRORS_TOTAL.labels(table, operation).inc()
+                    raise
+                finally:
+                    SUPABASE_REQUEST_SECONDS.labels(table, operation).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
 
 class SupabaseClient:
     def __init__(self):
@@ -20,9 +60,54 @@ class SupabaseClient:
             "Authorization": f"Bearer {self.key}",
             "Content-Type": "application/json",
         }
+        # 接続プールを共有するHTTPクライアント（初回リクエスト時に作成）
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        # イベントループが変わったときに閉じきれなかったクライアント（aclose()で閉じる）
+        self._retired: List[httpx.AsyncClient] = []
 
-    async def select(self, table: str, columns: str = "*", filters: Optional[Dict[str, Any]] = None, order: Optional[str] = None) -> List[Dict[str, Any]]:
-        """データを取得"""
+    def _http(self) -> httpx.AsyncClient:
+        """共有HTTPクライアントを取得（イベントループが変わった場合は作り直す）"""
+        if self._client is None or self._client.is_closed or self._client_loop is not asyncio.get_running_loop():
+            self._retire()
+            self._client = httpx.AsyncClient(limits=httpx.Limits(max_connections=SUPABASE_POOL_LIMIT))
+            self._client_loop = asyncio.get_running_loop()
+        return self._client
+
+    def _retire(self):
+        """以前のイベントループのクライアントを、そのループ上で閉じる（ループが終了済みなら後で閉じるために残す）"""
+        client, loop = self._client, self._client_loop
+        self._client = self._client_loop = None
+        if client is None or client.is_closed:
+            return
+        if loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            self._retired.append(client)
+
+    async def aclose(self):
+        """共有HTTPクライアントを閉じる"""
+        if self._client_loop is not asyncio.get_running_loop():
+            # 別のイベントループで作ったクライアントはこのループでは閉じられない
+            self._retire()
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = self._client_loop = None
+        retired, self._retired = self._retired, []
+        for client in retired:
+            try:
+                await client.aclose()
+            except Exception:
+                # 終了したループの接続は閉じられないことがある（参照を手放して破棄に任せる）
+                pass
+
+    @_instrumented("select")
+    async def select(self, table: str, columns: str = "*", filters: Optional[Dict[str, Any]] = None, order: Optional[str] = None,
+                     where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        データを取得
+        filtersは等価条件、whereはPostgRESTの演算子付き条件（例: {"created_at": ["gte.2025-01-01", "lt.2025-02-01"]}）
+        """
         url = f"{self.rest_url}/{table}"
         params = {"select": columns}
         
@@ -30,45 +115,142 @@ class SupabaseClient:
             for key, value in filters.items():
                 params[key] = f"eq.{value}"
         
+        if where:
+            params.update(where)
+        
         if order:
             params["order"] = order
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            return response.json()
+        if limit is not None:
+            params["limit"] = limit
+        if offset:
+            params["offset"] = offset
+        
+        client = self._http()
+        response = await client.get(url, headers=self.headers, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    @_instrumented("count")
+    async def count(self, table: str, filters: Optional[Dict[str, Any]] = None,
+                    where: Optional[Dict[str, Any]] = None) -> int:
+        """条件に一致する行数を取得（Prefer: count=exact、行そのものは転送しない）"""
+        url = f"{self.rest_url}/{table}"
+        params: Dict[str, Any] = {"select": "*", "limit": 0}
+        
+        if filters:
+            for key, value in filters.items():
+                params[key] = f"eq.{value}"
+        
+        if where:
+            params.update(where)
+        
+        headers = {**self.headers, "Prefer": "count=exact"}
+        client = self._http()
+        response = await client.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        
+        # Format: "*/100" -> 100
+        total = response.headers.get("content-range", "").rpartition("/")[2]
+        if not total.isdigit():
+            raise ValueError(f"Unexpected Content-Range: {response.headers.get('content-range')}")
+        return int(total)
 
+    @_instrumented("insert")
     async def insert(self, table: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """データを挿入"""
         url = f"{self.rest_url}/{table}"
         headers = {**self.headers, "Prefer": "return=representation"}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            
-            if isinstance(result, list) and len(result) > 0:
-                return result[0]
-            elif isinstance(result, dict):
-                return result
-            else:
-                raise ValueError(f"Unexpected result format: {result}")
-
-    async def update(self, table: str, data: Dict[str, Any], filters: Dict[str, Any]) -> Dict[str, Any]:
-        """データを更新"""
+        client = self._http()
+        response = await client.post(url, headers=headers, json=data)
+        response.raise_for_status()
+        result = response.json()
+        
+        if isinstance(result, list) and len(result) > 0:
+            return result[0]
+        elif isinstance(result, dict):
+            return result
+        else:
+            raise ValueError(f"Unexpected result format: {result}")
+
+    @_instrumented("insert_many")
+    async def insert_many(self, table: str, rows: List[Dict[str, Any]], returning: bool = False) -> List[Dict[str, Any]]:
+        """複数行を1リクエストで挿入（returning=Falseの場合は挿入結果を返さない）"""
+        if not rows:
+            return []
+        url = f"{self.rest_url}/{table}"
+        headers = {**self.headers, "Prefer": "return=representation" if returning else "return=minimal"}
+        
+        client = self._http()
+        response = await client.post(url, headers=headers, json=rows)
+        response.raise_for_status()
+        return response.json() if returning else []
+
+    @_instrumented("upsert")
+    async def upsert(self, table: str, rows: Any, on_conflict: str, returning: bool = True,
+                     ignore_duplicates: bool = False) -> List[Dict[str, Any]]:
+        """
+        on_conflictの列が一致する行があれば更新、なければ挿入（1リクエスト）
+        on_conflictの列には一意制約が必要（ない場合はPostgreSQLのエラー42P10になる）。更新されるのは渡した列だけ
+        ignore_duplicates=Trueでは一致する行を変更せず、挿入した行だけを返す
+        """
+        url = f"{self.rest_url}/{table}"
+        params = {"on_conflict": on_conflict}
+        resolution = "resolution=ignore-duplicates" if ignore_duplicates else "resolution=merge-duplicates"
+        prefer = f"{resolution}," + ("return=representation" if returning else "return=minimal")
+        headers = {**self.headers, "Prefer": prefer}
+        
+        client = self._http()
+        response = await client.post(url, headers=headers, params=params, json=rows)
+        response.raise_for_status()
+        return response.json() if returning else []
+
+    @_instrumented("update")
+    async def update(self, table: str, data: Dict[str, Any], filters: Dict[str, Any],
+                     where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        条件付きでデータを更新し、更新後の行を返す（条件に一致する行がなければ空のdict）
+        存在確認や状態の確認はfilters・whereに含めることで、更新と同じ1回のPATCHで行える
+        """
         url = f"{self.rest_url}/{table}"
         params = {}
         
         for key, value in filters.items():
             params[key] = f"eq.{value}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(url, headers=self.headers, json=data, params=params)
-            response.raise_for_status()
-            result = response.json()
-            return result[0] if result else {}
+        if where:
+            params.update(where)
+        
+        # 更新後の行を返させる（既定のreturn=minimalでは本文がない）
+        headers = {**self.headers, "Prefer": "return=representation"}
+        client = self._http()
+        response = await client.patch(url, headers=headers, json=data, params=params)
+        response.raise_for_status()
+        result = response.json()
+        return result[0] if result else {}
+
+    @_instrumented("update_many")
+    async def update_many(self, table: str, data: Dict[str, Any], filters: Optional[Dict[str, Any]] = None,
+                          where: Optional[Dict[str, Any]] = None, columns: str = "*") -> List[Dict[str, Any]]:
+        """条件に一致する行を1回のPATCHで更新し、更新した行（columnsの列のみ）を返す"""
+        url = f"{self.rest_url}/{table}"
+        params: Dict[str, Any] = {"select": columns}
+        
+        if filters:
+            for key, value in filters.items():
+                params[key] = f"eq.{value}"
+        
+        if where:
+            params.update(where)
+        
+        headers = {**self.headers, "Prefer": "return=representation"}
+        client = self._http()
+        response = await client.patch(url, headers=headers, json=data, params=params)
+        response.raise_for_status()
+        return response.json()
 
+    @_instrumented("select_paginated")
     async def select_paginated(self, table: str, page: int = 1, per_page: int = 20, 
                               filters: Optional[Dict[str, Any]] = None, 
                               order: Optional[str] = None) -> Dict[str, Any]:
@@ -95,36 +277,37 @@ class SupabaseClient:
         # 総件数を取得するヘッダーを追加
         headers = {**self.headers, "Prefer": "count=exact"}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Content-Rangeヘッダーから総件数を取得
-            content_range = response.headers.get("content-range", "")
-            total = 0
-            if content_range:
-                # Format: "0-19/100" -> total = 100
-                parts = content_range.split("/")
-                if len(parts) == 2 and parts[1].isdigit():
-                    total = int(parts[1])
-            
-            # ページネーション情報を計算
-            total_pages = (total + per_page - 1) // per_page if total > 0 else 1
-            has_next = page < total_pages
-            has_prev = page > 1
-            
-            return {
-                "items": data,
-                "total": total,
-                "page": page,
-                "per_page": per_page,
-                "total_pages": total_pages,
-                "has_next": has_next,
-                "has_prev": has_prev
-            }
+        client = self._http()
+        response = await client.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        # Content-Rangeヘッダーから総件数を取得
+        content_range = response.headers.get("content-range", "")
+        total = 0
+        if content_range:
+            # Format: "0-19/100" -> total = 100
+            parts = content_range.split("/")
+            if len(parts) == 2 and parts[1].isdigit():
+                total = int(parts[1])
+        
+        # ページネーション情報を計算
+        total_pages = (total + per_page - 1) // per_page if total > 0 else 1
+        has_next = page < total_pages
+        has_prev = page > 1
+        
+        return {
+            "items": data,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": total_pages,
+            "has_next": has_next,
+            "has_prev": has_prev
+        }
 
+    @_instrumented("delete")
     async def delete(self, table: str, filters: Dict[str, Any]) -> bool:
         """データを削除"""
         url = f"{self.rest_url}/{table}"
@@ -133,10 +316,30 @@ class SupabaseClient:
         for key, value in filters.items():
             params[key] = f"eq.{value}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            return response.status_code == 204
+        client = self._http()
+        response = await client.delete(url, headers=self.headers, params=params)
+        response.raise_for_status()
+        return response.status_code == 204
+
+    @_instrumented("delete_many")
+    async def delete_many(self, table: str, filters: Optional[Dict[str, Any]] = None,
+                          where: Optional[Dict[str, Any]] = None, columns: str = "*") -> List[Dict[str, Any]]:
+        """条件に一致する行を1回のDELETEで削除し、削除した行（columnsの列のみ）を返す"""
+        url = f"{self.rest_url}/{table}"
+        params: Dict[str, Any] = {"select": columns}
+        
+        if filters:
+            for key, value in filters.items():
+                params[key] = f"eq.{value}"
+        
+        if where:
+            params.update(where)
+        
+        headers = {**self.headers, "Prefer": "return=representation"}
+        client = self._http()
+        response = await client.delete(url, headers=headers, params=params)
+        response.raise_for_status()
+        return response.json()
 
     # 基本的なCRUD操作のみ提供
     # すべての操作はmain.pyから直接select/insert/update/deleteメソッドを使用
\ No newline at end of file
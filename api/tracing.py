@@ -0,0 +1,233 @@
+"""
+軽量な分散トレーシング（OpenTelemetry互換のspan形式）
+W3C traceparentヘッダーで上流APIへトレースを伝搬し、spanはファイルまたはコンソールへ非同期で出力する
+TRACE_EXPORTERが未設定の場合はno-opとなり、ホットパスのオーバーヘッドはほぼゼロ
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import secrets
+import logging
+import functools
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Optional
+
+
+TRACEPARENT_HEADER = "traceparent"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+_export_logger = logging.getLogger("watchme.tracing.export")
+_export_logger.propagate = False
+_listener: Optional[QueueListener] = None
+_enabled = False
+
+
+class Span:
+    """1つの処理区間"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "status",
+                 "start_ns", "end_ns", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start_ns = 0
+        self.end_ns = 0
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_status(self, status: str, description: Optional[str] = None):
+        self.status = status
+        if description:
+            self.attributes["status_description"] = description
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.set_status("error", f"{exc_type.__name__}: {exc}")
+        _current_span.reset(self._token)
+        _export(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1_000_000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """トレーシング無効時に返すspan"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_status(self, status: str, description: Optional[str] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _export(span: Span):
+    _export_logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+
+
+def _parse_traceparent(value: Optional[str]):
+    """traceparentヘッダーから(trace_id, parent_span_id)を取り出す"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def start_span(name: str, attributes: Optional[Dict[str, Any]] = None, traceparent: Optional[str] = None):
+    """現在のspanの子spanを作成（with文で使用）"""
+    if not _enabled:
+        return NOOP_SPAN
+    remote = _parse_traceparent(traceparent)
+    if remote:
+        trace_id, parent_id = remote
+    else:
+        parent = _current_span.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+    return Span(name, trace_id, parent_id, attributes)
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+def current_span():
+    """現在のspan（なければno-op span）"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Optional[Dict[str, str]]:
+    """現在のspanのtraceparentをヘッダーに追加"""
+    span = _current_span.get()
+    if span is None:
+        return headers
+    headers = dict(headers) if headers else {}
+    headers[TRACEPARENT_HEADER] = span.traceparent()
+    return headers
+
+
+def traced(name: str, attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """非同期関数をspanで囲むデコレーター（attributesは引数から属性dictを作る関数）"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not _enabled:
+                return await func(*args, **kwargs)
+            with start_span(name, attributes(*args, **kwargs) if attributes else None):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def setup_tracing():
+    """TRACE_EXPORTER（console/file）に応じてトレーシングを有効化"""
+    global _listener, _enabled
+    if _listener is not None:
+        return
+
+    exporter = os.getenv("TRACE_EXPORTER", "none").lower()
+    if exporter == "console":
+        handler: logging.Handler = logging.StreamHandler(sys.stderr)
+    elif exporter == "file":
+        path = os.getenv("TRACE_FILE", "logs/traces.jsonl")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = logging.FileHandler(path, encoding="utf-8")
+    else:
+        return
+
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    span_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _export_logger.setLevel(logging.INFO)
+    _export_logger.handlers = [QueueHandler(span_queue)]
+    _listener = QueueListener(span_queue, handler)
+    _listener.start()
+    _enabled = True
+    atexit.register(shutdown_tracing)
+
+
+def shutdown_tracing():
+    """未出力のspanを書き出して停止"""
+    global _listener, _enabled
+    _enabled = False
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class TracingMiddleware:
+    """受信リクエストごとにサーバーspanを作成するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _enabled:
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                incoming = value.decode("latin-1")
+                break
+
+        with start_span(f"HTTP {scope['method']}", {"http.target": scope["path"]}, traceparent=incoming) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status("error")
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f"HTTP {scope['method']} {route.path}"
@@ -0,0 +1,236 @@
+"""
+ユーザー検索（タイプアヘッド）用のインメモリインデックス
+
+- 前方一致: name（全体と単語ごと）・email（全体とドメイン）・user_idのトークンをソート済みリストに保持し、二分探索で引く
+- 部分一致: name・emailのtrigramごとに文書番号の配列を持ち、最も短い配列の候補だけを文字列照合する
+- 初回検索時に全件を読み込み、以降はupdated_at / created_atが前回より新しい行だけを取り込む
+  （削除は差分では検知できないため、一定間隔で全件を読み直す）
+
+環境変数:
+    USER_SEARCH_REFRESH_SECONDS       差分取り込みの間隔（既定 30秒）
+    USER_SEARCH_FULL_REBUILD_SECONDS  全件読み直しの間隔（既定 1800秒）
+    USER_SEARCH_MAX_RESULTS           1回の検索で数える最大件数（既定 1000、超えた場合はtruncated=true）
+"""
+
+import os
+import time
+import asyncio
+from array import array
+from bisect import bisect_left, insort
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from api.metrics import CACHE_REQUESTS_TOTAL
+from api.structured_logging import get_logger
+
+
+logger = get_logger("user_search")
+
+# 検索結果として返すusersテーブルの列
+USER_COLUMNS = ("user_id", "name", "email", "status", "subscription_plan", "created_at", "updated_at")
+LOAD_PAGE_SIZE = 1000
+_MAX_TOKEN = "\U0010ffff"
+
+
+def _trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class UserSearchIndex:
+    """name・email・user_idによるユーザー検索"""
+
+    def __init__(self, loader: Callable[..., Awaitable[List[Dict[str, Any]]]],
+                 refresh_seconds: Optional[float] = None, full_rebuild_seconds: Optional[float] = None):
+        # loader(where, limit, offset) でusersの行を取得する
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(os.getenv("USER_SEARCH_REFRESH_SECONDS", "30"))
+        self.full_rebuild_seconds = full_rebuild_seconds if full_rebuild_seconds is not None else float(os.getenv("USER_SEARCH_FULL_REBUILD_SECONDS", "1800"))
+        self.max_results = int(os.getenv("USER_SEARCH_MAX_RESULTS", "1000"))
+        self._reset()
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _reset(self):
+        self._rows: List[Optional[Dict[str, Any]]] = []  # 文書番号 -> 行（Noneは削除済み）
+        self._haystacks: List[str] = []
+        self._doc_ids: Dict[str, int] = {}
+        self._tokens: List[Tuple[str, int]] = []
+        self._trigram_postings: Dict[str, array] = {}
+        self._watermark: str = ""
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+
+    # -------------------------------------------------------------------------
+    # インデックスの構築
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _row_tokens(row: Dict[str, Any]) -> List[str]:
+        name = (row.get("name") or "").lower()
+        email = (row.get("email") or "").lower()
+        tokens = {name, *name.split(), email, (row.get("user_id") or "").lower()}
+        if "@" in email:
+            tokens.add(email.split("@", 1)[1])
+        tokens.discard("")
+        return list(tokens)
+
+    def _add(self, row: Dict[str, Any], bulk: bool = False):
+        user_id = row.get("user_id")
+        if not user_id:
+            return
+        row = {column: row.get(column) for column in USER_COLUMNS}
+        old = self._doc_ids.get(user_id)
+        if old is not None:
+            # 更新は旧文書を削除扱いにして新しい文書番号で追加する（trigramの配列は全件読み直し時に詰める）
+            old_row = self._rows[old]
+            self._rows[old] = None
+            for token in self._row_tokens(old_row):
+                index = bisect_left(self._tokens, (token, old))
+                if index < len(self._tokens) and self._tokens[index] == (token, old):
+                    del self._tokens[index]
+
+        doc = len(self._rows)
+        self._rows.append(row)
+        self._doc_ids[user_id] = doc
+        haystack = f"{(row.get('name') or '').lower()}\x00{(row.get('email') or '').lower()}"
+        self._haystacks.append(haystack)
+        for gram in _trigrams(haystack):
+            postings = self._trigram_postings.get(gram)
+            if postings is None:
+                postings = self._trigram_postings[gram] = array("I")
+            postings.append(doc)
+        for token in self._row_tokens(row):
+            if bulk:
+                self._tokens.append((token, doc))
+            else:
+                insort(self._tokens, (token, doc))
+
+        stamp = max(str(row.get("updated_at") or ""), str(row.get("created_at") or ""))
+        if stamp > self._watermark:
+            self._watermark = stamp
+
+    async def _load(self, where: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = await self.loader(where=where, limit=LOAD_PAGE_SIZE, offset=offset)
+            rows.extend(page)
+            if len(page) < LOAD_PAGE_SIZE:
+                return rows
+            offset += LOAD_PAGE_SIZE
+
+    async def rebuild(self):
+        """全件を読み込んでインデックスを作り直す"""
+        started = time.perf_counter()
+        rows = await self._load(None)
+        self._reset()
+        for row in rows:
+            self._add(row, bulk=True)
+        self._tokens.sort()
+        self._loaded_at = self._refreshed_at = time.monotonic()
+        logger.info("user search index rebuilt", extra={
+            "users": len(self._doc_ids), "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    async def refresh(self):
+        """前回以降に作成・更新された行だけを取り込む"""
+        if not self._watermark:
+            await self.rebuild()
+            return
+        watermark = self._watermark
+        changed: Dict[str, Dict[str, Any]] = {}
+        for column in ("updated_at", "created_at"):
+            for row in await self._load({column: f"gt.{watermark}"}):
+                changed[row["user_id"]] = row
+        for row in changed.values():
+            self._add(row)
+        self._refreshed_at = time.monotonic()
+        if changed:
+            logger.info("user search index refreshed", extra={"changed": len(changed)})
+
+    def upsert(self, row: Dict[str, Any]):
+        """このプロセスで作成・更新したユーザーを即座に反映"""
+        if self._loaded_at and row.get("user_id"):
+            merged = {**(self.get(row["user_id"]) or {}), **row}
+            self._add(merged)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._doc_ids.get(user_id)
+        return self._rows[doc] if doc is not None else None
+
+    async def ensure_fresh(self):
+        """未構築なら構築し、古ければバックグラウンドで差分・全件の読み直しを始める"""
+        if not self._loaded_at:
+            async with self._lock:
+                if not self._loaded_at:
+                    await self.rebuild()
+            return
+        now = time.monotonic()
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if now - self._loaded_at >= self.full_rebuild_seconds:
+            self._refresh_task = asyncio.create_task(self._guarded(self.rebuild))
+        elif now - self._refreshed_at >= self.refresh_seconds:
+            self._refresh_task = asyncio.create_task(self._guarded(self.refresh))
+
+    async def _guarded(self, func):
+        async with self._lock:
+            try:
+                await func()
+            except Exception as e:
+                logger.error("user search index refresh failed", extra={"error": str(e)})
+
+    # -------------------------------------------------------------------------
+    # 検索
+    # -------------------------------------------------------------------------
+
+    def search(self, query: str, page: int = 1, per_page: int = 20) -> Dict[str, Any]:
+        """前方一致を先に、続けて部分一致を返す（件数はmax_results件で打ち切る）"""
+        started = time.perf_counter()
+        query = query.strip().lower()
+        limit = self.max_results
+        matched: Dict[int, None] = {}
+        if query:
+            # 前方一致（削除済み文書のトークンは更新時に取り除いている）
+            start = bisect_left(self._tokens, (query, -1))
+            end = bisect_left(self._tokens, (query + _MAX_TOKEN, -1), lo=start)
+            tokens = self._tokens
+            position = start
+            while position < end and len(matched) < limit:
+                batch_end = min(end, position + limit)
+                matched.update(dict.fromkeys(doc for _, doc in tokens[position:batch_end]))
+                position = batch_end
+
+            # 部分一致
+            if len(query) >= 3 and len(matched) < limit:
+                postings = [self._trigram_postings.get(gram) for gram in _trigrams(query)]
+                if all(p is not None for p in postings):
+                    rows, haystacks = self._rows, self._haystacks
+                    for doc in min(postings, key=len):
+                        if doc not in matched and rows[doc] is not None and query in haystacks[doc]:
+                            matched[doc] = None
+                            if len(matched) >= limit:
+                                break
+
+        truncated = len(matched) >= limit
+        docs = list(matched)[:limit]
+        offset = (page - 1) * per_page
+        page_docs = docs[offset:offset + per_page]
+        CACHE_REQUESTS_TOTAL.labels("user_search", "hit" if docs else "miss").inc()
+        return {
+            "items": [self._rows[doc] for doc in page_docs],
+            "total": len(docs),
+            "truncated": truncated,
+            "page": page,
+            "per_page": per_page,
+            "has_next": offset + per_page < len(docs),
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._doc_ids),
+            "tokens": len(self._tokens),
+            "trigrams": len(self._trigram_postings),
+            "watermark": self._watermark or None,
+            "age_seconds": round(time.monotonic() - self._refreshed_at, 1) if self._refreshed_at else None,
+        }
@@ -0,0 +1,114 @@
+"""
+ベンチマーク用の解析APIモック（Whisper / SED / OpenSMILE / 各Aggregator）
+
+API_ENDPOINTSと同じパスを1つのサーバーで提供する。
+処理時間は「固定遅延 + ファイル数 × ファイルあたり遅延」で模擬する:
+    FAKE_ANALYSIS_BASE_MS（既定 20）, FAKE_ANALYSIS_PER_FILE_MS（既定 5）, FAKE_ANALYSIS_ERROR_RATE（既定 0）
+FAKE_ANALYSIS_POISON_PATHS（カンマ区切り）のいずれかを含むfile_pathsを受け取ると500を返す（壊れたファイルの模擬）
+"""
+
+import os
+import time
+import uuid
+import random
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+BASE_DELAY = float(os.getenv("FAKE_ANALYSIS_BASE_MS", "20")) / 1000.0
+PER_FILE_DELAY = float(os.getenv("FAKE_ANALYSIS_PER_FILE_MS", "5")) / 1000.0
+ERROR_RATE = float(os.getenv("FAKE_ANALYSIS_ERROR_RATE", "0"))
+POISON_PATHS = [path for path in os.getenv("FAKE_ANALYSIS_POISON_PATHS", "").split(",") if path]
+
+app = FastAPI(title="Fake analysis APIs")
+
+_tasks = {}
+
+
+async def _work(file_count: int = 0) -> float:
+    started = time.perf_counter()
+    await asyncio.sleep(BASE_DELAY + PER_FILE_DELAY * file_count)
+    return time.perf_counter() - started
+
+
+def _maybe_fail(file_paths=()):
+    if POISON_PATHS and any(poison in path for path in file_paths for poison in POISON_PATHS):
+        return JSONResponse({"detail": "corrupted audio file"}, status_code=500)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return JSONResponse({"detail": "injected failure"}, status_code=500)
+    return None
+
+
+@app.get("/health")
+@app.get("/{service}/health")
+async def health(service: str = ""):
+    return {"status": "healthy", "service": service or "fake", "version": "bench"}
+
+
+@app.get("/{service}/")
+async def root(service: str):
+    return {"status": "ok", "service": service}
+
+
+@app.post("/vibe-transcriber/fetch-and-transcribe")
+async def whisper(request: Request):
+    body = await request.json()
+    file_paths = body.get("file_paths") or []
+    failure = _maybe_fail(file_paths)
+    if failure:
+        return failure
+    elapsed = await _work(len(file_paths))
+    return {"total_processed": len(file_paths), "total_skipped": 0, "execution_time_seconds": elapsed}
+
+
+@app.get("/vibe-aggregator/generate-mood-prompt-supabase")
+async def prompt(device_id: str, date: str):
+    elapsed = await _work()
+    return {"message": "処理完了", "prompt_data": {"summary": f"{device_id} {date}"}, "execution_time_seconds": elapsed}
+
+
+@app.post("/vibe-scorer/analyze-vibegraph-supabase")
+async def chatgpt(request: Request):
+    await request.json()
+    elapsed = await _work()
+    return {"status": "success", "execution_time_seconds": elapsed}
+
+
+@app.post("/behavior-features/fetch-and-process-paths")
+@app.post("/emotion-features/process/emotion-features")
+async def features(request: Request):
+    body = await request.json()
+    file_paths = body.get("file_paths") or []
+    failure = _maybe_fail(file_paths)
+    if failure:
+        return failure
+    elapsed = await _work(len(file_paths))
+    return {"summary": {"total_files": len(file_paths), "errors": 0}, "execution_time_seconds": elapsed}
+
+
+@app.post("/behavior-aggregator/analysis/sed")
+async def sed_aggregator(request: Request):
+    await request.json()
+    elapsed = await _work()
+    return {"status": "success", "execution_time_seconds": elapsed}
+
+
+@app.post("/emotion-aggregator/analyze/opensmile-aggregator")
+async def opensmile_aggregator(request: Request):
+    await request.json()
+    task_id = uuid.uuid4().hex
+    _tasks[task_id] = time.monotonic() + BASE_DELAY
+    return {"task_id": task_id, "status": "started"}
+
+
+@app.get("/emotion-aggregator/analyze/opensmile-aggregator/{task_id}")
+async def opensmile_aggregator_status(task_id: str):
+    ready_at = _tasks.get(task_id)
+    if ready_at is None:
+        return JSONResponse({"detail": "not found"}, status_code=404)
+    if time.monotonic() < ready_at:
+        return {"status": "running"}
+    return {"status": "completed", "message": "処理完了",
+            "result": {"emotion_graph_length": 48, "total_emotion_points": 48, "output_path": ""}}
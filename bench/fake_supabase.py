@@ -0,0 +1,403 @@
+"""
+ベンチマーク用のローカルPostgREST互換サーバー（Supabase REST APIの簡易版）
+
+管理画面が使う範囲（eq/neq/lt/gt/gte/lte/in/is/not フィルター、or/and、order、offset/limit、
+Prefer: count=exact / return=representation / resolution=merge-duplicates・ignore-duplicates）だけを実装する。
+行数と応答遅延は環境変数で指定する:
+    FAKE_SUPABASE_USERS, FAKE_SUPABASE_DEVICES, FAKE_SUPABASE_NOTIFICATIONS,
+    FAKE_SUPABASE_AUDIO_DEVICES, FAKE_SUPABASE_AUDIO_SLOTS, FAKE_SUPABASE_LATENCY_MS, FAKE_SUPABASE_SEED
+"""
+
+import os
+import csv
+import uuid
+import random
+import asyncio
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+
+PRIMARY_KEYS = {
+    "users": "user_id",
+    "devices": "device_id",
+    "notifications": "id",
+    "audio_files": "file_path",
+}
+
+STATUS_FIELDS = ("transcriptions_status", "behavior_features_status", "emotion_features_status")
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _key(value: Any) -> str:
+    """PostgRESTのクエリ文字列表現に合わせたインデックスキー"""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class FakeDatabase:
+    """テーブルごとの行リストと、等価検索用のハッシュインデックス"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {name: [] for name in PRIMARY_KEYS}
+        self._indexes: Dict[Tuple[str, str], Dict[str, List[Dict[str, Any]]]] = {}
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return self.tables.setdefault(table, [])
+
+    def index(self, table: str, column: str) -> Dict[str, List[Dict[str, Any]]]:
+        key = (table, column)
+        if key not in self._indexes:
+            index: Dict[str, List[Dict[str, Any]]] = {}
+            for row in self.rows(table):
+                index.setdefault(_key(row.get(column)), []).append(row)
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def add(self, table: str, row: Dict[str, Any]):
+        """行を追加し、構築済みのインデックスも更新"""
+        self.rows(table).append(row)
+        for (name, column), index in self._indexes.items():
+            if name == table:
+                index.setdefault(_key(row.get(column)), []).append(row)
+
+    def invalidate(self, table: str, columns: Optional[List[str]] = None):
+        for key in [key for key in self._indexes if key[0] == table]:
+            if columns is None or key[1] in columns:
+                del self._indexes[key]
+
+
+def _slot_times(count: int) -> List[datetime]:
+    """UnifiedTrialSchedulerと同じ基準で直近のスロット時刻を生成"""
+    now = datetime.now()
+    base_minute = 0 if now.minute < 30 else 30
+    base_time = now.replace(minute=base_minute, second=0, microsecond=0)
+    if base_minute == 0:
+        base_time = base_time - timedelta(minutes=30)
+    else:
+        base_time = base_time.replace(minute=0)
+    # 実行中に30分境界を跨いでも一致するよう、1スロット先から生成する
+    return [base_time + timedelta(minutes=30) - timedelta(minutes=30 * i) for i in range(count)]
+
+
+def seed_database(db: FakeDatabase):
+    rng = random.Random(_env_int("FAKE_SUPABASE_SEED", 42))
+    user_count = _env_int("FAKE_SUPABASE_USERS", 10000)
+    device_count = _env_int("FAKE_SUPABASE_DEVICES", 1000)
+    notification_count = _env_int("FAKE_SUPABASE_NOTIFICATIONS", 20000)
+    audio_device_count = _env_int("FAKE_SUPABASE_AUDIO_DEVICES", device_count)
+    epoch = datetime(2025, 1, 1)
+
+    statuses = ["guest", "member", "subscriber"]
+    users = db.rows("users")
+    for i in range(user_count):
+        status = rng.choice(statuses)
+        created_at = epoch + timedelta(minutes=i)
+        users.append({
+            "user_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": f"user{i:06d}",
+            "email": f"user{i:06d}@example.com" if status != "guest" else None,
+            "status": status,
+            "subscription_plan": rng.choice(["basic", "premium", "enterprise"]) if status == "subscriber" else None,
+            "created_at": created_at.isoformat(),
+            "updated_at": created_at.isoformat(),
+        })
+
+    devices = db.rows("devices")
+    for i in range(device_count):
+        owner = users[rng.randrange(len(users))]["user_id"] if users else None
+        last_sync = datetime.now() - timedelta(minutes=rng.randrange(0, 60 * 48))
+        devices.append({
+            "device_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "owner_user_id": owner,
+            "device_type": "virtual_mobile",
+            "platform_type": rng.choice(["iOS", "Android"]),
+            "platform_identifier": f"platform-{i:06d}",
+            "status": rng.choice(["active", "active", "active", "inactive", "error"]),
+            "registered_at": (epoch + timedelta(minutes=i)).isoformat(),
+            "last_sync": last_sync.isoformat(),
+            "total_audio_count": rng.randrange(0, 5000),
+            "qr_code": None,
+        })
+
+    notifications = db.rows("notifications")
+    types = ["announcement", "event", "system"]
+    for i in range(notification_count):
+        notifications.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": users[rng.randrange(len(users))]["user_id"] if users else str(uuid.uuid4()),
+            "type": rng.choice(types),
+            "title": f"お知らせ {i}",
+            "message": "ベンチマーク用の通知です",
+            "is_read": rng.random() < 0.6,
+            "created_at": (epoch + timedelta(seconds=30 * i)).isoformat(),
+            "triggered_by": "bench",
+            "metadata": None,
+        })
+
+    audio_files = db.rows("audio_files")
+    slots = _slot_times(_env_int("FAKE_SUPABASE_AUDIO_SLOTS", 50))
+    for device in devices[:audio_device_count]:
+        device_id = device["device_id"]
+        for slot_time in slots:
+            if rng.random() < 0.1:
+                continue  # 録音なしのスロット
+            file_path = f"files/{device_id}/{slot_time.strftime('%Y-%m-%d')}/{slot_time.strftime('%H-%M')}/audio.wav"
+            row = {"device_id": device_id, "file_path": file_path, "recorded_at": slot_time.isoformat()}
+            for field in STATUS_FIELDS:
+                row[field] = "pending" if rng.random() < 0.3 else "completed"
+            audio_files.append(row)
+
+
+db = FakeDatabase()
+seed_database(db)
+
+LATENCY = _env_int("FAKE_SUPABASE_LATENCY_MS", 0) / 1000.0
+
+app = FastAPI(title="Fake PostgREST")
+
+
+def _coerce(value: str) -> Any:
+    if value == "null":
+        return None
+    if value in ("true", "false"):
+        return value == "true"
+    return value
+
+
+def _is_timestamp(value: str) -> bool:
+    return len(value) >= 19 and value[4] == "-" and value[10] == "T"
+
+
+@lru_cache(maxsize=262144)
+def _as_utc(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+
+
+def _compare(op: str, expected: str) -> Callable[[Any], bool]:
+    if op == "not":
+        inner_op, _, inner_expected = expected.partition(".")
+        inner = _compare(inner_op, inner_expected)
+        # SQLと同様にNULLは否定条件にも一致しない
+        return lambda v: v is not None and not inner(v)
+    if op == "eq":
+        return lambda v: _key(v) == expected
+    if op == "neq":
+        return lambda v: _key(v) != expected
+    if op == "is":
+        target = _coerce(expected)
+        return lambda v: v is target if target is None else v == target
+    if op == "in":
+        inner = expected.strip("()")
+        members = set(next(csv.reader([inner], quotechar='"', escapechar="\\"))) if inner else set()
+        return lambda v: _key(v) in members
+    if op in ("lt", "lte", "gt", "gte"):
+        def check(v):
+            if v is None:
+                return False
+            left = v if isinstance(v, (int, float)) and not isinstance(v, bool) else str(v)
+            right: Any = expected
+            if isinstance(left, (int, float)):
+                right = float(expected)
+            elif _is_timestamp(left) and _is_timestamp(right):
+                # タイムゾーン付きの条件もtimestamptzと同様に時刻として比較する（タイムゾーンなしはUTC）
+                left, right = _as_utc(left), _as_utc(right)
+            return {"lt": left < right, "lte": left <= right, "gt": left > right, "gte": left >= right}[op]
+        return check
+    raise ValueError(f"unsupported operator: {op}")
+
+
+def _split_top_level(body: str) -> List[str]:
+    """括弧と二重引用符の外側にあるカンマで分割"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(body):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(body[start:i])
+            start = i + 1
+    parts.append(body[start:])
+    return [part for part in parts if part]
+
+
+def _logic(kind: str, body: str) -> Callable[[Dict[str, Any]], bool]:
+    """or=(...) / and=(...) の条件式（入れ子のor()・and()を含む）"""
+    conditions = []
+    for part in _split_top_level(body):
+        if part.startswith(("or(", "and(")):
+            inner_kind, _, rest = part.partition("(")
+            conditions.append(_logic(inner_kind, rest[:-1]))
+            continue
+        column, op, expected = part.split(".", 2)
+        if len(expected) >= 2 and expected[0] == expected[-1] == '"':
+            expected = expected[1:-1].replace('\\"', '"')
+        check = _compare(op, expected)
+        conditions.append(lambda row, column=column, check=check: check(row.get(column)))
+    if kind == "or":
+        return lambda row: any(condition(row) for condition in conditions)
+    return lambda row: all(condition(row) for condition in conditions)
+
+
+def _parse_filters(request: Request):
+    filters = []
+    for key, raw in request.query_params.multi_items():
+        if key in ("select", "order", "offset", "limit", "on_conflict", "columns"):
+            continue
+        if key in ("or", "and"):
+            filters.append((None, key, _logic(key, raw[1:-1])))
+            continue
+        op, _, expected = raw.partition(".")
+        filters.append((key, op, expected))
+    return filters
+
+
+def _query(table: str, request: Request) -> List[Dict[str, Any]]:
+    filters = _parse_filters(request)
+    candidates = db.rows(table)
+    remaining = []
+    for column, op, expected in filters:
+        if column is None:
+            remaining.append((None, expected))
+        elif op == "eq" and candidates is db.rows(table):
+            candidates = db.index(table, column).get(expected, [])
+        elif op == "in" and candidates is db.rows(table):
+            inner = expected.strip("()")
+            members = dict.fromkeys(next(csv.reader([inner], quotechar='"', escapechar="\\"))) if inner else {}
+            index = db.index(table, column)
+            candidates = [row for member in members for row in index.get(member, [])]
+        else:
+            remaining.append((column, _compare(op, expected)))
+    if remaining:
+        candidates = [row for row in candidates
+                      if all(check(row) if column is None else check(row.get(column)) for column, check in remaining)]
+    return list(candidates)
+
+
+def _apply_order(rows: List[Dict[str, Any]], order: Optional[str]) -> List[Dict[str, Any]]:
+    if not order:
+        return rows
+    for part in reversed(order.split(",")):
+        pieces = part.split(".")
+        column = pieces[0]
+        descending = "desc" in pieces[1:]
+        rows.sort(key=lambda row: (row.get(column) is None, str(row.get(column))), reverse=descending)
+    return rows
+
+
+def _project(rows: List[Dict[str, Any]], select: Optional[str]) -> List[Dict[str, Any]]:
+    if not select or select == "*":
+        return rows
+    columns = [column.strip() for column in select.split(",")]
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+
+def _prefer(request: Request) -> str:
+    return request.headers.get("prefer", "")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "rows": {name: len(rows) for name, rows in db.tables.items()}}
+
+
+@app.get("/rest/v1/{table}")
+async def select(table: str, request: Request):
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    try:
+        rows = _query(table, request)
+    except ValueError as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+    rows = _apply_order(rows, request.query_params.get("order"))
+    total = len(rows)
+    offset = int(request.query_params.get("offset", 0))
+    limit = request.query_params.get("limit")
+    end = offset + int(limit) if limit is not None else total
+    page = rows[offset:end]
+    headers = {}
+    if "count=exact" in _prefer(request):
+        last = offset + len(page) - 1
+        headers["Content-Range"] = f"{offset}-{last}/{total}" if page else f"*/{total}"
+    return JSONResponse(_project(page, request.query_params.get("select")), headers=headers)
+
+
+@app.post("/rest/v1/{table}")
+async def insert(table: str, request: Request):
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    body = await request.json()
+    items = body if isinstance(body, list) else [body]
+    prefer = _prefer(request)
+    pk = request.query_params.get("on_conflict") or PRIMARY_KEYS.get(table, "id")
+    merge = "resolution=merge-duplicates" in prefer
+    ignore = "resolution=ignore-duplicates" in prefer
+    result = []
+    existing = db.index(table, pk) if merge or ignore else {}
+    for item in items:
+        item = dict(item)
+        match = existing.get(_key(item.get(pk))) if merge or ignore else None
+        if match and ignore:
+            continue
+        # 列のデフォルト値（挿入時のみ）
+        if table == "notifications" and not match:
+            item.setdefault("id", str(uuid.uuid4()))
+            item.setdefault("created_at", datetime.now().isoformat())
+        if table == "devices" and not match:
+            item.setdefault("device_id", str(uuid.uuid4()))
+            item.setdefault("registered_at", datetime.now().isoformat())
+            item.setdefault("total_audio_count", 0)
+        if match:
+            match[0].update(item)
+            db.invalidate(table, [column for column in item if column != pk])
+            result.append(match[0])
+        else:
+            db.add(table, item)
+            result.append(item)
+    if "return=representation" in prefer:
+        return JSONResponse(_project(result, request.query_params.get("select")), status_code=201)
+    return Response(status_code=201)
+
+
+@app.patch("/rest/v1/{table}")
+async def update(table: str, request: Request):
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    body = await request.json()
+    matched = _query(table, request)
+    for row in matched:
+        row.update(body)
+    db.invalidate(table, list(body))
+    prefer = _prefer(request)
+    headers = {"Content-Range": f"0-{len(matched) - 1}/*" if matched else "*/*"}
+    if "return=representation" in prefer:
+        return JSONResponse(_project(matched, request.query_params.get("select")), headers=headers)
+    # 実際のPostgRESTはreturn=minimalで204を返すが、既存コードがjson()を読むため空配列を返す
+    return JSONResponse([], headers=headers)
+
+
+@app.delete("/rest/v1/{table}")
+async def delete(table: str, request: Request):
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    matched = _query(table, request)
+    ids = {id(row) for row in matched}
+    db.tables[table] = [row for row in db.rows(table) if id(row) not in ids]
+    db.invalidate(table)
+    headers = {"Content-Range": f"0-{len(matched) - 1}/*" if matched else "*/*"}
+    if "return=representation" in _prefer(request):
+        return JSONResponse(_project(matched, request.query_params.get("select")), headers=headers)
+    return Response(status_code=204, headers=headers)
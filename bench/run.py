@@ -0,0 +1,504 @@
+"""
+WatchMe管理画面のベンチマーク
+
+ローカルのPostgRESTモック（bench/fake_supabase.py）と解析APIモック（bench/fake_analysis.py）を起動し、
+管理画面を実際のuvicornプロセスとして立ち上げて代表的なワークロードを計測する。
+結果（スループット・p50/p95/p99）はJSONで保存し、コミット間で比較できる。
+
+使い方:
+    python3 -m bench.run
+    python3 -m bench.run --workloads dashboard,pagination --output bench/results/base.json
+    python3 -m bench.run --compare bench/results/base.json
+"""
+
+import os
+import sys
+import copy
+import json
+import math
+import time
+import socket
+import tempfile
+import asyncio
+import argparse
+import platform
+import subprocess
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+WORKLOADS = ("startup", "dashboard", "pagination", "search", "broadcast", "notification_stats", "inbox", "registration", "coverage", "scheduler")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# =============================================================================
+# 計測ユーティリティ
+# =============================================================================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """nearest-rank法によるパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    # pct * n を先に計算して浮動小数点の誤差で順位が1つずれないようにする
+    rank = max(1, math.ceil(pct * len(sorted_values) / 100.0))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LatencyRecorder:
+    """リクエストごとの処理時間とエラー数を記録"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.samples: List[float] = []
+        self.errors = 0
+        self.items = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.finished = time.perf_counter()
+        return False
+
+    async def measure(self, coro: Awaitable[Any], items: int = 1):
+        started = time.perf_counter()
+        try:
+            await coro
+            self.items += items
+        except Exception:
+            self.errors += 1
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+    def summary(self) -> Dict[str, Any]:
+        values = sorted(self.samples)
+        wall = max(self.finished - self.started, 1e-9)
+        return {
+            "requests": len(values),
+            "errors": self.errors,
+            "items": self.items,
+            "duration_s": round(wall, 4),
+            "throughput_rps": round(len(values) / wall, 2),
+            "items_per_s": round(self.items / wall, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        }
+
+
+async def run_concurrent(recorder: LatencyRecorder, jobs: List[Callable[[], Awaitable[Any]]],
+                         concurrency: int, items_per_job: int = 1):
+    """ジョブを指定並列数で実行"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    async def worker():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await recorder.measure(job(), items_per_job)
+
+    with recorder:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+
+async def _get_ok(client: httpx.AsyncClient, path: str, **kwargs):
+    response = await client.get(path, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+# =============================================================================
+# プロセス管理
+# =============================================================================
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_health(url: str, timeout: float = 60.0, interval: float = 0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"サーバーが起動しませんでした: {url}")
+
+
+@contextmanager
+def server_process(module: str, port: int, env: Dict[str, str], health_path: str = "/health", extra_args=()):
+    """uvicornでASGIアプリを起動し、終了時に停止する"""
+    command = [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--no-access-log", *extra_args]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env={**os.environ, **env},
+                               stdout=subprocess.DEVNULL)
+    try:
+        wait_for_health(f"http://127.0.0.1:{port}{health_path}")
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# =============================================================================
+# ワークロード
+# =============================================================================
+
+DASHBOARD_PATHS = (
+    "/api/stats",
+    "/api/users?page=1&per_page=20",
+    "/api/devices?page=1&per_page=20",
+    "/api/notifications?page=1&per_page=20",
+    "/api/notifications/stats",
+)
+
+
+def measure_startup(args) -> Dict[str, Any]:
+    """コールドスタート時間（mainのimport時間と、uvicorn起動から/healthが200を返すまで）を計測"""
+    import_recorder = LatencyRecorder("startup_import")
+    ready_recorder = LatencyRecorder("startup_ready")
+    import_code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+    with import_recorder:
+        for _ in range(args.startup_runs):
+            output = subprocess.check_output([sys.executable, "-c", import_code], cwd=REPO_ROOT)
+            import_recorder.samples.append(float(output.decode().strip().splitlines()[-1]))
+            import_recorder.items += 1
+
+    with ready_recorder:
+        for _ in range(args.startup_runs):
+            port = free_port()
+            command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                       "--log-level", "warning", "--no-access-log"]
+            started = time.perf_counter()
+            process = subprocess.Popen(command, cwd=REPO_ROOT, env=dict(os.environ), stdout=subprocess.DEVNULL)
+            try:
+                wait_for_health(f"http://127.0.0.1:{port}/health", interval=0.01)
+                ready_recorder.samples.append(time.perf_counter() - started)
+                ready_recorder.items += 1
+            except RuntimeError:
+                ready_recorder.errors += 1
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+
+    return {"import": import_recorder.summary(), "ready": ready_recorder.summary()}
+
+
+async def workload_startup(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """起動時間の計測（サブプロセスを順に起動するためスレッドで実行）"""
+    return await asyncio.to_thread(measure_startup, args)
+
+
+async def workload_dashboard(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """管理画面のダッシュボード更新（5エンドポイント同時取得）を繰り返す"""
+    recorder = LatencyRecorder("dashboard")
+
+    async def refresh():
+        await asyncio.gather(*(_get_ok(client, path) for path in DASHBOARD_PATHS))
+
+    await run_concurrent(recorder, [refresh] * args.iterations, args.concurrency)
+    return recorder.summary()
+
+
+async def workload_pagination(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """一覧APIを深いページまで順に取得"""
+    per_page = 100
+    results = {}
+    for resource, total in (("users", args.users), ("devices", args.devices), ("notifications", args.notifications)):
+        recorder = LatencyRecorder(f"pagination_{resource}")
+        last_page = max(1, (total + per_page - 1) // per_page)
+        pages = list(range(1, last_page + 1, max(1, last_page // args.pages)))[:args.pages]
+        jobs = [lambda page=page: _get_ok(client, f"/api/{resource}", params={"page": page, "per_page": per_page})
+                for page in pages]
+        await run_concurrent(recorder, jobs, args.concurrency, items_per_job=per_page)
+        results[resource] = recorder.summary()
+    return results
+
+
+async def workload_search(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """ユーザー検索のタイプアヘッド（1文字ずつ入力を伸ばしていく）"""
+    # 初回はインデックス構築を含むため別に計測する
+    started = time.perf_counter()
+    (await client.get("/api/users/search", params={"q": "user"})).raise_for_status()
+    build_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    queries = []
+    for i in range(0, args.users, max(1, args.users // 50)):
+        name = f"user{i:06d}"
+        queries.extend(name[:length] for length in range(1, len(name) + 1))
+    queries.extend(["example", "example.com", "xyz-no-match"])
+
+    recorder = LatencyRecorder("search")
+    jobs = [lambda q=q: _get_ok(client, "/api/users/search", params={"q": q, "per_page": 10}) for q in queries]
+    await run_concurrent(recorder, jobs, args.concurrency)
+    return {"first_request_ms": build_ms, "typeahead": recorder.summary()}
+
+
+async def workload_broadcast(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """大量ユーザーへの一括通知送信（user_ids指定と、サーバー側で対象を解決するsegment指定）"""
+    user_ids = [f"00000000-0000-4000-8000-{i:012d}" for i in range(args.broadcast_users)]
+    base = {"type": "announcement", "title": "bench", "message": "bench broadcast"}
+    results = {}
+    for name, payload in (("user_ids", {**base, "user_ids": user_ids}), ("segment", {**base, "segment": {}})):
+        recorder = LatencyRecorder(f"broadcast_{name}")
+        sent = []
+
+        async def send(payload=payload):
+            response = await client.post("/api/notifications/broadcast", json=payload, timeout=None)
+            response.raise_for_status()
+            sent.append(response.json()["sent_count"])
+
+        await run_concurrent(recorder, [send], 1, items_per_job=len(user_ids) if name == "user_ids" else args.users)
+        results[name] = {**recorder.summary(), "sent_count": sum(sent)}
+    return results
+
+
+async def workload_notification_stats(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """通知統計の取得（初回はカウンターの初期化を含むため別に計測する）"""
+    started = time.perf_counter()
+    (await client.get("/api/notifications/stats")).raise_for_status()
+    first_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    recorder = LatencyRecorder("notification_stats")
+    jobs = [lambda: _get_ok(client, "/api/notifications/stats")] * args.iterations
+    await run_concurrent(recorder, jobs, args.concurrency)
+    return {"notifications": args.notifications, "first_request_ms": first_ms, "steady": recorder.summary()}
+
+
+async def workload_inbox(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """ユーザーごとの受信箱（カーソルで3ページ）と未読件数の取得"""
+    response = await _get_ok(client, "/api/users", params={"page": 1, "per_page": 50})
+    user_ids = [user["user_id"] for user in response.json()["items"]]
+
+    async def read_inbox(user_id: str):
+        cursor = None
+        for _ in range(3):
+            params = {"limit": 20, **({"cursor": cursor} if cursor else {})}
+            page = (await _get_ok(client, f"/api/notifications/user/{user_id}/inbox", params=params)).json()
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+    inbox = LatencyRecorder("inbox")
+    await run_concurrent(inbox, [lambda user_id=user_id: read_inbox(user_id) for user_id in user_ids], args.concurrency)
+    unread = LatencyRecorder("unread_count")
+    jobs = [lambda user_id=user_id: _get_ok(client, f"/api/notifications/user/{user_id}/unread-count")
+            for user_id in user_ids * 10]
+    await run_concurrent(unread, jobs, args.concurrency)
+    return {"inbox": inbox.summary(), "unread_count": unread.summary()}
+
+
+async def workload_registration(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """アプリ更新直後を想定した仮想デバイス登録の集中（同じ端末が複数回登録する）"""
+    response = await _get_ok(client, "/api/users", params={"page": 1, "per_page": 50})
+    user_ids = [user["user_id"] for user in response.json()["items"]]
+    identifiers = [f"bench-vendor-{i:05d}" for i in range(args.iterations)]
+    registered: Dict[str, set] = {}
+
+    async def register(i: int):
+        identifier = identifiers[i % len(identifiers)]
+        payload = {"owner_user_id": user_ids[i % len(user_ids)], "platform_type": "iOS", "platform_identifier": identifier}
+        response = await client.post("/api/devices/virtual-mobile", json=payload)
+        response.raise_for_status()
+        registered.setdefault(identifier, set()).add(response.json()["device_id"])
+
+    recorder = LatencyRecorder("registration")
+    await run_concurrent(recorder, [lambda i=i: register(i) for i in range(len(identifiers) * 3)], args.concurrency)
+    duplicates = sum(len(device_ids) - 1 for device_ids in registered.values())
+    return {**recorder.summary(), "devices": len(registered), "duplicate_device_ids": duplicates}
+
+
+async def workload_coverage(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    """デバイス × 日の処理状況マトリクス（初回はaudio_filesから取得、2回目以降はキャッシュ）"""
+    response = await _get_ok(client, "/api/devices", params={"page": 1, "per_page": 100})
+    device_ids = [device["device_id"] for device in response.json()["items"]][:args.coverage_devices]
+    end = date.today()
+    body = {"device_ids": device_ids, "start_date": (end - timedelta(days=args.audio_days - 1)).isoformat(),
+            "end_date": end.isoformat()}
+
+    async def fetch():
+        response = await client.post("/api/audio-files/coverage", json=body)
+        response.raise_for_status()
+        return response
+
+    cold = LatencyRecorder("coverage_cold")
+    await run_concurrent(cold, [fetch], 1)
+    warm = LatencyRecorder("coverage_warm")
+    await run_concurrent(warm, [fetch] * 20, 1)
+    totals = (await fetch()).json()["totals"]
+    return {"devices": len(device_ids), "days": args.audio_days, "slots_with_audio": totals["present"],
+            "cold": cold.summary(), "warm": warm.summary()}
+
+
+async def workload_scheduler(supabase_url: str, args) -> Dict[str, Any]:
+    """48スロットのスケジューラー処理を複数デバイスに対してプロセス内で実行"""
+    import main  # 環境変数を設定した後で読み込む
+
+    async with httpx.AsyncClient(base_url=supabase_url) as client:
+        response = await client.get("/rest/v1/devices", params={"select": "device_id", "limit": args.scheduler_devices})
+        device_ids = [row["device_id"] for row in response.json()]
+
+    results = {}
+    for name in args.schedulers.split(","):
+        template = main.SCHEDULER_REGISTRY[name]
+        recorder = LatencyRecorder(f"scheduler_{name}")
+
+        def make_job(device_id: str):
+            scheduler = copy.copy(template)
+            scheduler.device_id = device_id
+            return scheduler._process_slots
+
+        jobs = [make_job(device_id) for device_id in device_ids]
+        await run_concurrent(recorder, jobs, args.scheduler_concurrency, items_per_job=48)
+        results[name] = recorder.summary()
+    return results
+
+
+# =============================================================================
+# 結果の保存と比較
+# =============================================================================
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]):
+    """2つの結果ファイルのp50/p95/p99とスループットを比較表示"""
+    def flatten(workloads: Dict[str, Any], prefix: str = "") -> Dict[str, Dict[str, Any]]:
+        flat = {}
+        for key, value in workloads.items():
+            if isinstance(value, dict) and "p50_ms" in value:
+                flat[prefix + key] = value
+            elif isinstance(value, dict):
+                flat.update(flatten(value, f"{prefix}{key}."))
+        return flat
+
+    old, new = flatten(previous.get("workloads", {})), flatten(current.get("workloads", {}))
+    print(f"\n{'workload':<32}{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    for name in sorted(set(old) & set(new)):
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            before, after = old[name][metric], new[name][metric]
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+            print(f"{name:<32}{metric:<16}{before:>12}{after:>12}{change:>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WatchMe管理画面ベンチマーク")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"実行するワークロード（{','.join(WORKLOADS)}）")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--notifications", type=int, default=20000)
+    parser.add_argument("--supabase-latency-ms", type=int, default=2, help="PostgRESTモックの応答遅延")
+    parser.add_argument("--analysis-base-ms", type=float, default=20)
+    parser.add_argument("--analysis-per-file-ms", type=float, default=5)
+    parser.add_argument("--startup-runs", type=int, default=5, help="起動時間を計測する回数")
+    parser.add_argument("--iterations", type=int, default=200, help="ダッシュボード更新回数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20, help="一覧ごとに取得するページ数")
+    parser.add_argument("--broadcast-users", type=int, default=10000)
+    parser.add_argument("--scheduler-devices", type=int, default=1000)
+    parser.add_argument("--coverage-devices", type=int, default=100, help="処理状況マトリクスの対象デバイス数（最大100）")
+    parser.add_argument("--audio-days", type=int, default=1, help="audio_filesを生成する日数")
+    parser.add_argument("--scheduler-concurrency", type=int, default=20)
+    parser.add_argument("--schedulers", default="whisper,sed,opensmile")
+    parser.add_argument("--output", help="結果JSONの保存先（既定: bench/results/<rev>-<時刻>.json）")
+    parser.add_argument("--compare", help="比較対象の結果JSON")
+    return parser.parse_args(argv)
+
+
+async def run_workloads(app_url: str, supabase_url: str, args) -> Dict[str, Any]:
+    selected = [name for name in args.workloads.split(",") if name]
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(base_url=app_url, timeout=120.0,
+                                 limits=httpx.Limits(max_connections=args.concurrency * 5)) as client:
+        for name in selected:
+            print(f"▶ {name} ...", flush=True)
+            if name == "scheduler":
+                results[name] = await workload_scheduler(supabase_url, args)
+            else:
+                results[name] = await globals()[f"workload_{name}"](client, args)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    supabase_port, analysis_port, app_port = free_port(), free_port(), free_port()
+
+    supabase_env = {
+        "FAKE_SUPABASE_USERS": str(args.users),
+        "FAKE_SUPABASE_DEVICES": str(args.devices),
+        "FAKE_SUPABASE_NOTIFICATIONS": str(args.notifications),
+        "FAKE_SUPABASE_AUDIO_DEVICES": str(args.scheduler_devices),
+        "FAKE_SUPABASE_AUDIO_SLOTS": str(args.audio_days * 48 + 2),
+        "FAKE_SUPABASE_LATENCY_MS": str(args.supabase_latency_ms),
+    }
+    analysis_env = {
+        "FAKE_ANALYSIS_BASE_MS": str(args.analysis_base_ms),
+        "FAKE_ANALYSIS_PER_FILE_MS": str(args.analysis_per_file_ms),
+    }
+    app_env = {
+        "SUPABASE_URL": f"http://127.0.0.1:{supabase_port}",
+        "SUPABASE_KEY": "bench",
+        "ANALYSIS_API_BASE_URL": f"http://127.0.0.1:{analysis_port}",
+        "LOG_LEVEL": "WARNING",
+        "SCHEDULER_STATE_DIR": tempfile.mkdtemp(prefix="watchme_bench_"),
+    }
+    # スケジューラーのワークロードはこのプロセス内でmainを読み込むため、同じ環境変数を設定する
+    os.environ.update(app_env)
+
+    with server_process("bench.fake_supabase:app", supabase_port, supabase_env) as supabase_url, \
+            server_process("bench.fake_analysis:app", analysis_port, analysis_env), \
+            server_process("main:app", app_port, app_env) as app_url:
+        workloads = asyncio.run(run_workloads(app_url, supabase_url, args))
+
+    revision = git_revision()
+    result = {
+        "meta": {
+            "revision": revision,
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+        },
+        "workloads": workloads,
+    }
+
+    output = args.output or os.path.join(
+        REPO_ROOT, "bench", "results", f"{revision or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(workloads, ensure_ascii=False, indent=2))
+    print(f"💾 結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
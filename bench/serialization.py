@@ -0,0 +1,107 @@
+"""
+一覧レスポンスのシリアライズ方式のマイクロベンチマーク
+
+10,000行（既定）の通知・デバイス・ユーザーを、次の方式でJSON bytesにするまでの時間を比較する:
+    baseline       Model(**row)で構築 → response_modelで再検証 → JSONResponse（従来の処理）
+    orjson         baseline と同じ検証 → ORJSONResponse
+    validate_once  TypeAdapterで1回だけ検証 → pydantic-coreでJSON化（api/fast_response.py の既定）
+    trust          検証せずにモデルのフィールドだけをorjsonでJSON化（FAST_RESPONSE_MODE=trust）
+
+使い方:
+    python3 -m bench.serialization
+    python3 -m bench.serialization --rows 50000 --repeat 3
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from api.fast_response import serialize_rows
+from models.schemas import Device, Notification, User
+
+
+def make_rows(kind: str, count: int) -> List[Dict[str, Any]]:
+    base = datetime(2025, 7, 20, 9, 0, 0)
+    rows = []
+    for i in range(count):
+        created_at = (base - timedelta(minutes=i)).isoformat() + "+00:00"
+        if kind == "notifications":
+            rows.append({
+                "id": str(uuid.UUID(int=i)), "user_id": str(uuid.UUID(int=i % 1000)), "type": "announcement",
+                "title": f"お知らせ {i}", "message": "メンテナンスのお知らせです。" * 3, "is_read": i % 3 == 0,
+                "created_at": created_at, "triggered_by": "admin", "metadata": {"campaign": i % 7},
+            })
+        elif kind == "devices":
+            rows.append({
+                "device_id": str(uuid.UUID(int=i)), "owner_user_id": str(uuid.UUID(int=i % 1000)),
+                "device_type": "iPhone", "status": "active", "platform_type": "iOS", "platform_identifier": f"id-{i}",
+                "registered_at": created_at, "last_sync": created_at, "total_audio_count": i, "qr_code": None,
+            })
+        else:
+            rows.append({
+                "user_id": str(uuid.UUID(int=i)), "name": f"ユーザー{i}", "email": f"user{i}@example.com",
+                "status": "member", "subscription_plan": None, "created_at": created_at, "updated_at": None,
+            })
+    return rows
+
+
+MODELS = {"notifications": Notification, "devices": Device, "users": User}
+
+
+def baseline(model, rows, response_class=JSONResponse) -> bytes:
+    """従来のハンドラー（Model(**row)のリストを返し、FastAPIがresponse_modelで処理する）と同じ処理"""
+    field = create_response_field(name="response", type_=List[model])
+    objects = [model(**row) for row in rows]
+    content = asyncio.run(serialize_response(field=field, response_content=objects, is_coroutine=True))
+    return response_class(content).body
+
+
+def measure(func: Callable[[], bytes], repeat: int) -> Dict[str, Any]:
+    body = func()  # ウォームアップ
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {"median_ms": round(samples[len(samples) // 2] * 1000, 2), "min_ms": round(samples[0] * 1000, 2), "bytes": len(body)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="一覧レスポンスのシリアライズ方式の比較")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果JSONの保存先")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"{'payload':<16}{'method':<16}{'median_ms':>12}{'min_ms':>10}{'bytes':>12}{'speedup':>10}")
+    for kind, model in MODELS.items():
+        rows = make_rows(kind, args.rows)
+        methods = {
+            "baseline": lambda: baseline(model, rows),
+            "orjson": lambda: baseline(model, rows, ORJSONResponse),
+            "validate_once": lambda: serialize_rows(model, rows, mode="validate"),
+            "trust": lambda: serialize_rows(model, rows, mode="trust"),
+        }
+        results[kind] = {name: measure(func, args.repeat) for name, func in methods.items()}
+        reference = results[kind]["baseline"]["median_ms"]
+        for name, result in results[kind].items():
+            speedup = f"{reference / result['median_ms']:.1f}x" if result["median_ms"] else "-"
+            print(f"{kind:<16}{name:<16}{result['median_ms']:>12}{result['min_ms']:>10}{result['bytes']:>12}{speedup:>10}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,13 @@ python コマンドではなく、明示的に python3 を使用する必要が
 """
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
+import os
 import uuid
 from datetime import datetime, timedelta
 import json
@@ -19,15 +20,45 @@ import base64
 from fastapi import Query
 import asyncio
 import httpx
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from contextlib import asynccontextmanager
 from apscheduler.triggers.interval import IntervalTrigger
 import logging
+import time
 
-from api.supabase_client import SupabaseClient
+from api.supabase_client import SupabaseClient, error_code as supabase_error_code
+from api.structured_logging import (
+    setup_logging, get_logger, new_correlation_id, correlation_id,
+    CorrelationIdMiddleware, CORRELATION_HEADER
+)
+from api.scheduler_coordinator import SchedulerCoordinator
+from api.scheduler_engine import SchedulerEngine
+from api.dispatch_queue import PriorityDispatcher, dispatch_lane
+from api.conditional import conditional_json
+from api.fast_response import model_list_response
+from api.compression import CompressionMiddleware
+from api.user_search import UserSearchIndex
+from api.broadcast import iter_segment_user_ids, iter_user_id_pages, send_broadcast
+from api.notification_stats import NotificationCounters
+from api.notification_bulk import bulk_mark_read, bulk_delete
+from api.notification_retention import NotificationRetention
+from api.notification_inbox import fetch_inbox, UnreadCountCache
+from api.heartbeat import HeartbeatBuffer, HeartbeatBufferFull
+from api.fleet_health import FleetHealthIndex, DEVICE_COLUMNS as FLEET_DEVICE_COLUMNS
+from api.audio_coverage import AudioCoverage
+from api.backfill import BackfillEngine, BackfillConflict
+from api.adaptive_batching import AdaptiveBatchSizer, ENDPOINTS as ADAPTIVE_ENDPOINTS
+from api.file_retry import FileRetryTracker
+from api.tracing import (
+    setup_tracing, traced, current_span, inject_headers, TracingMiddleware
+)
+from api.metrics import (
+    REGISTRY, CONTENT_TYPE_LATEST, MetricsMiddleware, InFlight,
+    UPSTREAM_REQUEST_SECONDS, SCHEDULER_RUNS_TOTAL, SCHEDULER_FILES_TOTAL
+)
 from models.schemas import (
     User, Device, 
     UserCreate, DeviceCreate, ResponseModel,
-    DeviceUpdate, DeviceStatus, 
+    DeviceUpdate, DeviceStatus, DeviceHeartbeat, DeviceHeartbeatResponse, AudioCoverageRequest, BackfillRequest,
     # 新しいユーザーステータス関連
     UserStatus, SubscriptionPlan, PlatformType,
     GuestUserCreate, UserUpgradeToMember, UserStatusUpdate,
@@ -35,13 +66,52 @@ from models.schemas import (
     # 通知管理関連
     NotificationType, Notification, NotificationCreate, NotificationUpdate,
     NotificationBroadcast, NotificationBroadcastResponse,
+    NotificationBulkTarget, NotificationBulkRead, NotificationBulkResponse,
+    NotificationInboxResponse, NotificationUnreadCountResponse,
     # ページネーション関連
     PaginationParams, PaginatedUsersResponse, PaginatedDevicesResponse, PaginatedNotificationsResponse,
     # スケジューラー関連
-    SchedulerAPIType, SchedulerConfig, SchedulerStatus, SchedulerLogEntry, SchedulerLogResponse
+    SchedulerAPIType, SchedulerConfig, SchedulerStatus, SchedulerLogEntry, SchedulerLogResponse,
+    DeadLetterRequeueRequest
 )
 
-app = FastAPI(title="WatchMe Admin (Fixed)", description="修正済みWatchMe管理画面API", version="2.0.0")
+# 構造化ログ（非同期出力）の初期化
+setup_logging()
+logger = get_logger("admin")
+
+# トレーシング（TRACE_EXPORTER=console/file で有効化）
+setup_tracing()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動・終了処理（重い初期化は行わず、スケジューラーは有効な場合のみ動かす）"""
+    if not (os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY")):
+        logger.warning("SUPABASE_URL / SUPABASE_KEY が未設定です。Supabaseを使うAPIはエラーになります")
+    
+    # SCHEDULER_MODE=neverでもログの書き込みと有効/無効の読み直しのために調停ループは動かす
+    coordination_task = asyncio.create_task(scheduler_coordination_loop())
+    
+    yield
+    
+    coordination_task.cancel()
+    shutdown_schedulers()
+    scheduler_coordinator.close()
+    try:
+        await heartbeat_buffer.close()
+    except Exception as e:
+        logger.error("heartbeat flush on shutdown failed", extra={"error": str(e)})
+    await backfill_engine.close()
+    await notification_retention.close()
+    file_retries.close()
+    try:
+        adaptive_batcher.save()
+    except OSError as e:
+        logger.error("adaptive batching state not saved on shutdown", extra={"error": str(e)})
+    if _supabase_client is not None:
+        await _supabase_client.aclose()
+
+app = FastAPI(title="WatchMe Admin (Fixed)", description="修正済みWatchMe管理画面API", version="2.0.0", lifespan=lifespan,
+              default_response_class=ORJSONResponse)
 
 # CORS設定
 app.add_middleware(
@@ -52,21 +122,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 大きなJSONレスポンスのgzip圧縮（ストリーミング対応、圧縮済みの静的ファイルは除外）
+app.add_middleware(CompressionMiddleware)
+
+# ルート単位のメトリクス計測
+app.add_middleware(MetricsMiddleware)
+
+# リクエスト単位のトレースspan
+app.add_middleware(TracingMiddleware)
+
+# リクエスト相関IDの付与（最外周で設定し、メトリクス・ログの両方から参照できるようにする）
+app.add_middleware(CorrelationIdMiddleware)
+
 # 静的ファイルとテンプレートの設定
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Supabaseクライアントの即時初期化
-try:
-    supabase_client = SupabaseClient()
-    print("✅ Supabase client initialized successfully")
-except Exception as e:
-    print(f"❌ Failed to initialize Supabase client: {e}")
-    raise RuntimeError(f"Supabase接続に失敗しました: {e}") from e
+# Supabaseクライアントは初回利用時に初期化（環境変数が未設定でもimport・起動は成功させる）
+_supabase_client: Optional[SupabaseClient] = None
+
+def get_supabase_client() -> SupabaseClient:
+    """Supabaseクライアントを取得（初回呼び出し時に初期化）"""
+    global _supabase_client
+    if _supabase_client is None:
+        try:
+            _supabase_client = SupabaseClient()
+            logger.info("Supabase client initialized")
+        except Exception as e:
+            logger.error("Failed to initialize Supabase client", extra={"error": str(e)})
+            raise RuntimeError(f"Supabase接続に失敗しました: {e}") from e
+    return _supabase_client
 
-def get_supabase_client():
-    """初期化済みのSupabaseクライアントを取得"""
-    return supabase_client
+# 複数ワーカー構成でのスケジューラー調停（リーダーのみがcronジョブを実行）
+scheduler_coordinator = SchedulerCoordinator()
+# 全スケジューラーのジョブを1つのAPSchedulerで実行する
+scheduler_engine = SchedulerEngine()
+# 解析APIで失敗したファイルの再試行とデッドレター（ワーカー間で共有）
+file_retries = FileRetryTracker()
+SCHEDULER_SYNC_INTERVAL_SECONDS = 5
 
 
 # =============================================================================
@@ -75,53 +168,72 @@ def get_supabase_client():
 
 from abc import ABC, abstractmethod
 
+# スケジューラーログのステータスとログレベルの対応
+SCHEDULER_LOG_LEVELS = {
+    "info": logging.INFO,
+    "success": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+# 処理状態の再確認で in.(...) に並べるファイルパスの数（URL長の上限に収まるように分割する）
+PENDING_LOOKUP_CHUNK = 50
+
 class UnifiedTrialScheduler(ABC):
     """統一スケジューラーベースクラス"""
     
-    def __init__(self, api_name: str, job_id: str, api_type: SchedulerAPIType):
-        self.scheduler = AsyncIOScheduler()
-        self.is_running = False
-        self.logs: List[SchedulerLogEntry] = []
+    def __init__(self, api_name: str, job_id: str, api_type: SchedulerAPIType, backend: str):
         self.job_id = job_id
         self.api_name = api_name
         self.api_type = api_type
+        self.backend = backend  # 同時実行数の上限と開始時刻のずらしはバックエンド単位
         self.device_id = "d067d407-cf73-4174-a9c1-d91fb60d64d0"  # デフォルトデバイスID
-        self.scheduler.start()
+    
+    @property
+    def is_running(self) -> bool:
+        """有効/無効はワーカー間の共有状態から判定"""
+        return scheduler_coordinator.is_enabled(self.job_id)
         
-    def start_trial_scheduler(self):
+    async def start_trial_scheduler(self):
         """3時間おきのスケジューラーを開始"""
+        # 有効/無効の初回読み込みと書き込みはSQLiteのロック待ちでイベントループを止めないようスレッドで行う
+        await asyncio.to_thread(scheduler_coordinator.enabled_states)
         if self.is_running:
             self._add_log("warning", f"{self.api_name}スケジューラーは既に実行中です")
             return False
-            
-        # 3時間おきのcron設定 (0, 3, 6, 9, 12, 15, 18, 21時)
-        self.scheduler.add_job(
-            self._process_slots,
-            'cron',
-            hour='0,3,6,9,12,15,18,21',
-            id=self.job_id,
-            replace_existing=True
-        )
         
-        self.is_running = True
+        await asyncio.to_thread(scheduler_coordinator.set_enabled, self.job_id, True)
+        self.sync_job()
+        
         self._add_log("success", f"{self.api_name}試験スケジューラーを開始しました")
         return True
         
-    def stop_trial_scheduler(self):
+    async def stop_trial_scheduler(self):
         """スケジューラーを停止"""
+        await asyncio.to_thread(scheduler_coordinator.enabled_states)
         if not self.is_running:
             self._add_log("warning", f"{self.api_name}スケジューラーは実行されていません")
             return False
             
         try:
-            self.scheduler.remove_job(self.job_id)
-            self.is_running = False
+            await asyncio.to_thread(scheduler_coordinator.set_enabled, self.job_id, False)
+            self.sync_job()
             self._add_log("success", f"{self.api_name}試験スケジューラーを停止しました")
             return True
         except Exception as e:
             self._add_log("error", f"{self.api_name}スケジューラー停止に失敗: {str(e)}")
             return False
             
+    def sync_job(self):
+        """共有状態とリーダー権限に合わせてこのプロセスのcronジョブを追加・削除"""
+        should_run = scheduler_coordinator.is_leader and self.is_running
+        has_job = scheduler_engine.has_job(self.job_id)
+        
+        if should_run and not has_job:
+            # 3時間おきのcron設定（バックエンドごとに開始分をずらす）
+            scheduler_engine.add_staggered_cron_job(self.job_id, self._process_slots, self.backend, name=self.api_name)
+        elif not should_run and has_job:
+            scheduler_engine.remove_job(self.job_id)
+            
     def _generate_file_paths_for_24hours(self, device_id: str) -> List[Dict[str, str]]:
         """過去24時間分（48スロット）のファイルパスを機械的に生成"""
         file_paths = []
@@ -159,10 +271,13 @@ class UnifiedTrialScheduler(ABC):
         
         return file_paths
     
+    @traced("scheduler.find_pending_files", lambda self, files: {"scheduler": self.api_name, "slots": len(files)})
     async def _find_pending_files(self, all_possible_files: List[Dict[str, str]]) -> List[str]:
         """データベースから未処理ファイルを特定"""
         supabase_client = get_supabase_client()
         pending_file_paths = []
+        skipped_count = 0
+        missing_count = 0
         
         self._add_log("info", "🔍 データベースとの突き合わせを開始...")
         
@@ -187,16 +302,23 @@ class UnifiedTrialScheduler(ABC):
                 status_field = self._get_status_field()
                 if record.get(status_field) == 'pending':
                     pending_file_paths.append(file_path)
-                    self._add_log("info", f"  ✅ {time_block} - pending状態、処理対象に追加")
+                    self._add_log("info", f"  ✅ {time_block} - pending状態、処理対象に追加", verbose=True)
                 else:
-                    self._add_log("info", f"  ⏭️ {time_block} - {record.get(status_field, 'unknown')}、スキップ")
+                    skipped_count += 1
+                    self._add_log("info", f"  ⏭️ {time_block} - {record.get(status_field, 'unknown')}、スキップ", verbose=True)
             else:
-                self._add_log("info", f"  ❌ {time_block} - レコードなし、スキップ")
+                missing_count += 1
+                self._add_log("info", f"  ❌ {time_block} - レコードなし、スキップ", verbose=True)
         
+        self._record_files("pending", len(pending_file_paths))
+        self._record_files("skipped", skipped_count)
+        self._record_files("missing", missing_count)
         return pending_file_paths
     
-    async def _process_slots(self):
+    @traced("scheduler.process_slots", lambda self, lane="scheduled": {"scheduler": self.api_name, "lane": lane})
+    async def _process_slots(self, lane: str = "scheduled"):
         """24時間前から現在までの未処理音声を処理（共通ロジック）"""
+        self._start_job_context(lane)
         start_time = datetime.now()
         self._add_log("info", f"🚀 {self.api_name}自動処理を開始")
         
@@ -212,19 +334,95 @@ class UnifiedTrialScheduler(ABC):
             
             if not pending_file_paths:
                 self._add_log("info", "ℹ️ 処理対象のファイルがありません（すべて処理済みまたはレコードなし）")
+                self._record_run("empty")
                 return
             
-            # API処理（サブクラスで実装）
-            await self._process_files_with_api(pending_file_paths)
+            # 失敗の記録がある・デッドレターのファイルを分ける
+            groups = await asyncio.to_thread(file_retries.partition, self.backend, pending_file_paths)
+            if groups["waiting"] or groups["dead"] or groups["retry"]:
+                self._add_log("info", f"🔁 再試行待ち{len(groups['waiting'])}件・デッドレター{len(groups['dead'])}件を除外、"
+                                      f"再試行{len(groups['retry'])}件は1件ずつ処理")
+                self._record_files("backoff", len(groups["waiting"]))
+                self._record_files("dead_letter", len(groups["dead"]))
+            
+            # API処理（サブクラスで実装）。学習したバッチサイズごとに分けて呼び出し、再試行のファイルは1件ずつ送る
+            batches = adaptive_batcher.split(self.backend, groups["fresh"]) if groups["fresh"] else []
+            batches += [[file_path] for file_path in groups["retry"]]
+            for batch in batches:
+                result = await self._process_files_with_api(batch)
+                if result["success"]:
+                    errors = ((result.get("data") or {}).get("summary") or {}).get("errors", 0)
+                    if not errors:
+                        await asyncio.to_thread(file_retries.record_success, self.backend, batch)
+                        continue
+                    # 200でもファイル単位のエラーがある場合は、処理されずにpendingのまま残ったファイルを失敗として記録する
+                    # （次回から1件ずつ送る）。処理済みになったファイルの記録だけを消す
+                    failed = await self._still_pending(batch)
+                    await asyncio.to_thread(file_retries.record_success, self.backend, [path for path in batch if path not in failed])
+                    await self._record_failure(failed, f"解析APIが{errors}件のエラーを返しました")
+                elif result.get("error_type") == "connection_error":
+                    # 上流に接続できない場合はファイルの問題ではないので回数に数えず、残りは次回に回す
+                    self._add_log("warning", "⚠️ 解析APIに接続できないため、残りのファイルは次回の実行で処理します")
+                    break
+                else:
+                    await self._record_failure(batch, result.get("message", ""))
             
             total_time = (datetime.now() - start_time).total_seconds()
             self._add_log("info", f"🏁 {self.api_name}自動処理完了（総実行時間: {total_time:.1f}秒）")
+            self._record_run("success")
             
         except Exception as e:
             self._add_log("error", f"❌ {self.api_name}自動処理エラー: {str(e)}")
+            self._record_run("error")
     
-    def _add_log(self, status: str, message: str):
-        """ログエントリを追加"""
+    async def _record_failure(self, file_paths: List[str], error: str):
+        """失敗したファイルを再試行の対象として記録する（上限に達したものはデッドレターに移る）"""
+        if not file_paths:
+            return
+        # SQLiteの書き込みは他のワーカーとの競合で待つことがあるため、イベントループの外で行う
+        dead_lettered = await asyncio.to_thread(file_retries.record_failure, self.backend, file_paths, error)
+        if dead_lettered:
+            self._add_log("error", f"🪦 {len(dead_lettered)}件のファイルが{file_retries.max_attempts}回失敗したため、"
+                                   f"デッドレターに移しました: {', '.join(dead_lettered[:5])}")
+    
+    async def _still_pending(self, file_paths: List[str]) -> List[str]:
+        """処理状態がpendingのまま残っているファイル（file_path=in.(...)の一括クエリ）"""
+        status_field = self._get_status_field()
+        pending = set()
+        for start in range(0, len(file_paths), PENDING_LOOKUP_CHUNK):
+            chunk = file_paths[start:start + PENDING_LOOKUP_CHUNK]
+            quoted = ",".join('"' + path.replace('"', '\\"') + '"' for path in chunk)
+            rows = await get_supabase_client().select("audio_files", columns="file_path", filters={"device_id": self.device_id},
+                                                      where={"file_path": f"in.({quoted})", status_field: "eq.pending"})
+            pending.update(row["file_path"] for row in rows)
+        return [path for path in file_paths if path in pending]
+    
+    def _start_job_context(self, lane: str = "scheduled"):
+        """ジョブ単位の相関IDを発行し、上流API呼び出しをレーンに載せる（cronはscheduled、手動実行はinteractive。手動実行の場合は元のリクエストIDをログに残す）
+
+        ContextVarを書き換えるため、ジョブ専用のタスク（cronまたはrun_nowが作るタスク）の中で呼ぶこと
+        """
+        parent_id = correlation_id.get()
+        job_correlation_id = new_correlation_id(self.job_id)
+        dispatch_lane.set(lane)
+        logger.info(f"{self.api_name} job started", extra={
+            "scheduler": self.api_name, "job_correlation_id": job_correlation_id, "parent_id": parent_id, "lane": lane
+        })
+    
+    def _record_run(self, outcome: str):
+        """実行回数メトリクスを記録"""
+        SCHEDULER_RUNS_TOTAL.labels(self.api_name, outcome).inc()
+    
+    def _record_files(self, result: str, count: int):
+        """ファイル数メトリクスを記録"""
+        if count:
+            SCHEDULER_FILES_TOTAL.labels(self.api_name, result).inc(count)
+    
+    def _add_log(self, status: str, message: str, verbose: bool = False):
+        """ログエントリを追加（スロット単位の詳細ログはDEBUGレベルで出力）"""
+        level = logging.DEBUG if verbose else SCHEDULER_LOG_LEVELS.get(status, logging.INFO)
+        logger.log(level, message, extra={"scheduler": self.api_name, "status": status})
+        
         log_entry = SchedulerLogEntry(
             timestamp=datetime.now(),
             api_type=self.api_type,
@@ -234,24 +432,29 @@ class UnifiedTrialScheduler(ABC):
             execution_type="scheduled"
         )
         
-        self.logs.append(log_entry)
-        
-        # ログは最新100件まで保持
-        if len(self.logs) > 100:
-            self.logs = self.logs[-100:]
+        # ログはワーカー間で共有し、最新100件まで保持
+        scheduler_coordinator.append_log(self.job_id, log_entry.model_dump(mode="json"))
             
-    def get_status(self) -> Dict[str, Any]:
-        """現在の状態を取得"""
+    def status_snapshot(self) -> Dict[str, Any]:
+        """共有状態から読み出した生の状態（ログはdictのまま）"""
         return {
             "is_running": self.is_running,
-            "logs": self.logs[-20:],  # 最新20件
-            "total_logs": len(self.logs)
+            "logs": scheduler_coordinator.recent_logs(self.job_id, 20),  # 最新20件
+            "total_logs": scheduler_coordinator.count_logs(self.job_id),
+            "leader_pid": scheduler_coordinator.leader_pid()
         }
     
+    def get_status(self, snapshot: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """現在の状態を取得"""
+        snapshot = snapshot or self.status_snapshot()
+        return {**snapshot, "logs": [SchedulerLogEntry(**entry) for entry in snapshot["logs"]]}
+    
     async def run_now(self):
         """手動実行（今すぐ実行）"""
         self._add_log("info", f"📌 {self.api_name}手動実行を開始")
-        await self._process_slots()
+        # cron実行と同じ同時実行数の上限に従う。別タスクで動かし、ジョブの相関ID・レーンをリクエストのコンテキストに持ち込まない。
+        # 手動実行は管理画面からの操作なので、上流API呼び出しはinteractiveレーンに載せる
+        await asyncio.create_task(scheduler_engine.run(self.backend, self._process_slots, "interactive"))
     
     @abstractmethod
     def _get_status_field(self) -> str:
@@ -259,8 +462,8 @@ class UnifiedTrialScheduler(ABC):
         pass
     
     @abstractmethod
-    async def _process_files_with_api(self, file_paths: List[str]):
-        """各APIでファイルを処理する"""
+    async def _process_files_with_api(self, file_paths: List[str]) -> Dict[str, Any]:
+        """各APIでファイルを処理し、call_apiの結果を返す"""
         pass
 
 class WhisperTrialScheduler(UnifiedTrialScheduler):
@@ -270,7 +473,8 @@ class WhisperTrialScheduler(UnifiedTrialScheduler):
         super().__init__(
             api_name="Whisper",
             job_id="whisper_trial_scheduler",
-            api_type=SchedulerAPIType.WHISPER
+            api_type=SchedulerAPIType.WHISPER,
+            backend="whisper"
         )
     
     def _get_status_field(self) -> str:
@@ -296,9 +500,13 @@ class WhisperTrialScheduler(UnifiedTrialScheduler):
                 execution_time = data.get("execution_time_seconds", 0)
                 
                 self._add_log("success", f"✅ Whisper処理完了: {processed_count}件処理、{skipped_count}件スキップ、実行時間{execution_time:.1f}秒")
+                self._record_files("processed", processed_count)
             else:
                 error_message = whisper_result.get("message", "不明なエラー")
                 self._add_log("error", f"❌ Whisper処理失敗: {error_message}")
+                self._record_files("failed", len(file_paths))
+            
+            return whisper_result
 
 class SEDTrialScheduler(UnifiedTrialScheduler):
     """SED試験版スケジューラークラス"""
@@ -307,7 +515,8 @@ class SEDTrialScheduler(UnifiedTrialScheduler):
         super().__init__(
             api_name="SED",
             job_id="sed_trial_scheduler",
-            api_type=SchedulerAPIType.WHISPER  # SEDもWHISPER扱いで統一
+            api_type=SchedulerAPIType.WHISPER,  # SEDもWHISPER扱いで統一
+            backend="sed"
         )
     
     def _get_status_field(self) -> str:
@@ -336,9 +545,14 @@ class SEDTrialScheduler(UnifiedTrialScheduler):
                 execution_time = data.get("execution_time_seconds", 0)
                 
                 self._add_log("success", f"✅ SED処理完了: {processed_count}件処理、エラー{errors}件、実行時間{execution_time:.1f}秒")
+                self._record_files("processed", processed_count)
+                self._record_files("failed", errors)
             else:
                 error_message = sed_result.get("message", "不明なエラー")
                 self._add_log("error", f"❌ SED処理失敗: {error_message}")
+                self._record_files("failed", len(file_paths))
+            
+            return sed_result
 
 class OpenSMILETrialScheduler(UnifiedTrialScheduler):
     """OpenSMILE試験版スケジューラークラス"""
@@ -347,7 +561,8 @@ class OpenSMILETrialScheduler(UnifiedTrialScheduler):
         super().__init__(
             api_name="OpenSMILE",
             job_id="opensmile_trial_scheduler",
-            api_type=SchedulerAPIType.WHISPER  # OpenSMILEもWHISPER扱いで統一
+            api_type=SchedulerAPIType.WHISPER,  # OpenSMILEもWHISPER扱いで統一
+            backend="opensmile"
         )
     
     def _get_status_field(self) -> str:
@@ -377,9 +592,14 @@ class OpenSMILETrialScheduler(UnifiedTrialScheduler):
                 execution_time = data.get("execution_time_seconds", 0)
                 
                 self._add_log("success", f"✅ OpenSMILE処理完了: {processed_count}件処理、エラー{errors}件、実行時間{execution_time:.1f}秒")
+                self._record_files("processed", processed_count)
+                self._record_files("failed", errors)
             else:
                 error_message = opensmile_result.get("message", "不明なエラー")
                 self._add_log("error", f"❌ OpenSMILE処理失敗: {error_message}")
+                self._record_files("failed", len(file_paths))
+            
+            return opensmile_result
 
 class PromptTrialScheduler(UnifiedTrialScheduler):
     """Whisperプロンプト生成試験版スケジューラークラス"""
@@ -388,20 +608,24 @@ class PromptTrialScheduler(UnifiedTrialScheduler):
         super().__init__(
             api_name="Prompt",
             job_id="prompt_trial_scheduler",
-            api_type=SchedulerAPIType.PROMPT
+            api_type=SchedulerAPIType.PROMPT,
+            backend="prompt"
         )
     
     def _get_status_field(self) -> str:
         """プロンプト生成にはステータスフィールドがない（全件処理）"""
         return None
     
+    @traced("scheduler.find_pending_files", lambda self, files: {"scheduler": self.api_name, "slots": len(files)})
     async def _find_pending_files(self, all_possible_files: List[Dict[str, str]]) -> List[str]:
         """プロンプト生成は全件処理するため、ステータスチェックをスキップ"""
         # 当日のすべてのスロットを処理対象とする
         return [file_info['file_path'] for file_info in all_possible_files]
     
-    async def _process_slots(self):
+    @traced("scheduler.process_slots", lambda self, lane="scheduled": {"scheduler": self.api_name, "lane": lane})
+    async def _process_slots(self, lane: str = "scheduled"):
         """当日の全スロットを処理して上書き"""
+        self._start_job_context(lane)
         start_time = datetime.now()
         self._add_log("info", f"🚀 {self.api_name}自動処理を開始（当日全件処理）")
         
@@ -414,9 +638,11 @@ class PromptTrialScheduler(UnifiedTrialScheduler):
             
             total_time = (datetime.now() - start_time).total_seconds()
             self._add_log("info", f"🏁 {self.api_name}自動処理完了（総実行時間: {total_time:.1f}秒）")
+            self._record_run("success")
             
         except Exception as e:
             self._add_log("error", f"❌ {self.api_name}自動処理エラー: {str(e)}")
+            self._record_run("error")
     
     async def _process_files_with_api(self, date: str):
         """プロンプト生成APIで当日データを処理"""
@@ -452,10 +678,8 @@ class APISchedulerManager:
     """各APIのスケジューラーを管理するクラス"""
     
     def __init__(self):
-        self.scheduler = AsyncIOScheduler()
         self.active_jobs: Dict[str, Dict[str, Any]] = {}
         self.scheduler_logs: Dict[str, List[SchedulerLogEntry]] = {}
-        self.scheduler.start()
         
     def _get_job_id(self, api_type: SchedulerAPIType, device_id: str) -> str:
         """ジョブIDを生成"""
@@ -562,14 +786,15 @@ class APISchedulerManager:
         
         # 既存のジョブがあれば停止
         if job_id in self.active_jobs:
-            self.scheduler.remove_job(job_id)
+            scheduler_engine.remove_job(job_id)
             
-        # 新しいジョブを追加
+        # 新しいジョブを追加（共通エンジンでAPI種別ごとの同時実行数を制限）
         next_run = datetime.now() + timedelta(hours=config.interval_hours)
-        self.scheduler.add_job(
+        scheduler_engine.add_job(
+            job_id,
             self._scheduled_task,
-            trigger=IntervalTrigger(hours=config.interval_hours),
-            id=job_id,
+            config.api_type.value,
+            IntervalTrigger(hours=config.interval_hours),
             args=[config.api_type, config.device_id],
             next_run_time=next_run
         )
@@ -606,7 +831,7 @@ class APISchedulerManager:
         
         if job_id in self.active_jobs:
             try:
-                self.scheduler.remove_job(job_id)
+                scheduler_engine.remove_job(job_id)
                 del self.active_jobs[job_id]
                 
                 self._add_log_entry(
@@ -680,8 +905,9 @@ scheduler_manager = APISchedulerManager()
 SCHEDULER_REGISTRY = {}
 
 def register_scheduler(name: str, scheduler_instance: UnifiedTrialScheduler):
-    """スケジューラーをレジストリに登録"""
+    """スケジューラーをレジストリに登録（登録順に開始時刻をずらす）"""
     SCHEDULER_REGISTRY[name] = scheduler_instance
+    scheduler_engine.stagger_minute(scheduler_instance.backend)
 
 def create_scheduler_endpoints(name: str):
     """指定されたスケジューラー名に対してAPIエンドポイントを動的生成"""
@@ -691,7 +917,7 @@ def create_scheduler_endpoints(name: str):
         f""">{name}試験版スケジューラーを開始"""
         try:
             scheduler = SCHEDULER_REGISTRY[name]
-            success = scheduler.start_trial_scheduler()
+            success = await scheduler.start_trial_scheduler()
             if success:
                 return {"success": True, "message": f"{scheduler.api_name}試験スケジューラーを開始しました"}
             else:
@@ -704,7 +930,7 @@ def create_scheduler_endpoints(name: str):
         f""">{name}試験版スケジューラーを停止"""
         try:
             scheduler = SCHEDULER_REGISTRY[name]
-            success = scheduler.stop_trial_scheduler()
+            success = await scheduler.stop_trial_scheduler()
             if success:
                 return {"success": True, "message": f"{scheduler.api_name}試験スケジューラーを停止しました"}
             else:
@@ -713,12 +939,12 @@ def create_scheduler_endpoints(name: str):
             raise HTTPException(status_code=500, detail=f"スケジューラー停止エラー: {str(e)}")
 
     @app.get(f"/api/{name}-trial-scheduler/status")
-    async def get_scheduler_status():
-        f""">{name}試験版スケジューラーの状態を取得"""
+    async def get_scheduler_status(request: Request):
+        f""">{name}試験版スケジューラーの状態を取得（ETag対応）"""
         try:
             scheduler = SCHEDULER_REGISTRY[name]
-            status = scheduler.get_status()
-            return status
+            snapshot = await asyncio.to_thread(scheduler.status_snapshot)
+            return conditional_json(request, snapshot, lambda: scheduler.get_status(snapshot))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"スケジューラー状態取得エラー: {str(e)}")
 
@@ -762,15 +988,43 @@ def initialize_schedulers():
     register_scheduler("prompt", prompt_scheduler)
     create_scheduler_endpoints("prompt")
     
-    print("✅ スケジューラー動的エンドポイント生成完了")
-    print(f"   - Whisper: /api/whisper-trial-scheduler/*")
-    print(f"   - SED: /api/sed-trial-scheduler/*")
-    print(f"   - OpenSMILE: /api/opensmile-trial-scheduler/*")
-    print(f"   - Prompt: /api/prompt-trial-scheduler/*")
+    logger.info("スケジューラー動的エンドポイント生成完了", extra={
+        "endpoints": [f"/api/{name}-trial-scheduler/*" for name in SCHEDULER_REGISTRY]
+    })
 
-# スケジューラー初期化実行
+# スケジューラー初期化実行（ルートはアプリ起動前に登録する必要があるためimport時に行う。
+# ここではオブジェクトの生成とルート登録だけで、DB・APScheduler・外部APIには触れない）
 initialize_schedulers()
 
+async def scheduler_coordination_loop():
+    """リーダー権限の取得を試み、各スケジューラーのジョブを共有状態に合わせる"""
+    while True:
+        try:
+            # ためたログの書き込みと有効/無効の読み直し（SQLiteのロック待ちでイベントループを止めない）
+            await asyncio.to_thread(scheduler_coordinator.sync)
+            scheduler_coordinator.try_acquire_leadership()
+            for scheduler in SCHEDULER_REGISTRY.values():
+                scheduler.sync_job()
+            sync_retention_job()
+        except Exception as e:
+            logger.error("scheduler coordination failed", extra={"error": str(e)})
+        await asyncio.sleep(SCHEDULER_SYNC_INTERVAL_SECONDS)
+
+def sync_retention_job():
+    """通知の保持期間ポリシーの定期実行を、リーダー権限と設定に合わせて追加・削除"""
+    should_run = scheduler_coordinator.is_leader and notification_retention.enabled
+    has_job = scheduler_engine.has_job(RETENTION_JOB_ID)
+    
+    if should_run and not has_job:
+        scheduler_engine.add_staggered_cron_job(RETENTION_JOB_ID, notification_retention.run_scheduled, "retention",
+                                                hour=str(notification_retention.hour), name="通知の保持期間ポリシー")
+    elif not should_run and has_job:
+        scheduler_engine.remove_job(RETENTION_JOB_ID)
+
+def shutdown_schedulers():
+    """共通スケジューラーエンジンを停止"""
+    scheduler_engine.shutdown()
+
 # 後方互換性のためのグローバル変数（既存コードとの互換性）
 whisper_trial_scheduler = SCHEDULER_REGISTRY["whisper"]
 sed_trial_scheduler = SCHEDULER_REGISTRY["sed"]
@@ -782,6 +1036,11 @@ async def health_check():
     """ヘルスチェック - 高速レスポンス"""
     return {"status": "ok", "timestamp": datetime.now().isoformat()}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus形式のメトリクス"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """管理画面のメインページ"""
@@ -808,13 +1067,14 @@ async def simple_page(request: Request):
 # =============================================================================
 
 @app.get("/api/users", response_model=PaginatedUsersResponse)
-async def get_users(page: int = Query(1, ge=1, description="ページ番号"),
+async def get_users(request: Request,
+                   page: int = Query(1, ge=1, description="ページ番号"),
                    per_page: int = Query(20, ge=1, le=100, description="1ページあたりのアイテム数")):
-    """ページネーション付きでユーザーを取得"""
+    """ページネーション付きでユーザーを取得（ETag対応）"""
     try:
         client = get_supabase_client()
         result = await client.select_paginated("users", page=page, per_page=per_page, order="created_at.desc")
-        return PaginatedUsersResponse(**result)
+        return conditional_json(request, result, lambda: PaginatedUsersResponse(**result))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ユーザーの取得に失敗しました: {str(e)}")
 
@@ -825,15 +1085,36 @@ async def get_all_users():
     try:
         client = get_supabase_client()
         users_data = await client.select("users")
-        return users_data
+        return model_list_response(User, users_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ユーザーの取得に失敗しました: {str(e)}")
 
 
+async def _load_users_for_search(where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: int = 0):
+    """検索インデックス用にusersを作成日時順で取得"""
+    return await get_supabase_client().select("users", where=where, order="created_at.asc,user_id.asc", limit=limit, offset=offset)
+
+# ユーザー検索用のインメモリインデックス（初回検索時に構築）
+user_search_index = UserSearchIndex(_load_users_for_search)
+
+
+@app.get("/api/users/search")
+async def search_users(q: str = Query(..., min_length=1, max_length=100, description="検索文字列（name・email・user_id）"),
+                       page: int = Query(1, ge=1, description="ページ番号"),
+                       per_page: int = Query(20, ge=1, le=100, description="1ページあたりのアイテム数")):
+    """ユーザーのタイプアヘッド検索（前方一致を優先し、3文字以上は部分一致も含む）"""
+    try:
+        await user_search_index.ensure_fresh()
+        return user_search_index.search(q, page=page, per_page=per_page)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ユーザー検索に失敗しました: {str(e)}")
+
+
 @app.post("/api/users", response_model=User)
 async def create_user(user: UserCreate):
     """新しいユーザーを作成"""
     try:
+        client = get_supabase_client()
         user_data = {
             "user_id": str(uuid.uuid4()),
             "name": user.name,
@@ -841,6 +1122,7 @@ async def create_user(user: UserCreate):
             "created_at": datetime.now().isoformat()
         }
         created_user = await client.insert("users", user_data)
+        user_search_index.upsert(created_user)
         return created_user
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ユーザーの作成に失敗しました: {str(e)}")
@@ -850,14 +1132,24 @@ async def create_user(user: UserCreate):
 # Devices API - user_idフィールドなしの正しい構造
 # =============================================================================
 
+async def _load_devices_for_fleet_health(where: Optional[Dict[str, Any]] = None, limit: Optional[int] = None, offset: int = 0):
+    """稼働状況の索引用にdevicesを登録日時順で取得"""
+    return await get_supabase_client().select("devices", columns=",".join(FLEET_DEVICE_COLUMNS), where=where,
+                                              order="registered_at.asc,device_id.asc", limit=limit, offset=offset)
+
+# デバイスの稼働状況（最終同期からの経過時間）のインメモリ索引（初回問い合わせ時に構築）
+fleet_health_index = FleetHealthIndex(_load_devices_for_fleet_health)
+
+
 @app.get("/api/devices", response_model=PaginatedDevicesResponse)
-async def get_devices(page: int = Query(1, ge=1, description="ページ番号"),
+async def get_devices(request: Request,
+                     page: int = Query(1, ge=1, description="ページ番号"),
                      per_page: int = Query(20, ge=1, le=100, description="1ページあたりのアイテム数")):
-    """ページネーション付きでデバイスを取得"""
+    """ページネーション付きでデバイスを取得（ETag対応）"""
     try:
         client = get_supabase_client()
         result = await client.select_paginated("devices", page=page, per_page=per_page, order="registered_at.desc")
-        return PaginatedDevicesResponse(**result)
+        return conditional_json(request, result, lambda: PaginatedDevicesResponse(**result))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"デバイスの取得に失敗しました: {str(e)}")
 
@@ -868,7 +1160,7 @@ async def get_all_devices():
     try:
         client = get_supabase_client()
         devices_data = await client.select("devices")
-        return devices_data
+        return model_list_response(Device, devices_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"デバイスの取得に失敗しました: {str(e)}")
 
@@ -877,6 +1169,7 @@ async def get_all_devices():
 async def create_device(device: DeviceCreate):
     """新しいデバイスを作成"""
     try:
+        client = get_supabase_client()
         device_data = {
             "device_id": str(uuid.uuid4()),
             "device_type": device.device_type,
@@ -886,7 +1179,8 @@ async def create_device(device: DeviceCreate):
             "total_audio_count": 0,
             "qr_code": None
         }
-        created_device = await supabase_client.insert("devices", device_data)
+        created_device = await client.insert("devices", device_data)
+        fleet_health_index.apply([created_device])
         return created_device
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"デバイスの作成に失敗しました: {str(e)}")
@@ -906,7 +1200,8 @@ async def create_device(device: DeviceCreate):
 async def get_device_status(device_id: str):
     """デバイスの状態を取得"""
     try:
-        device = await supabase_client.select("devices", filters={"device_id": device_id})
+        client = get_supabase_client()
+        device = await client.select("devices", filters={"device_id": device_id})
         if not device:
             raise HTTPException(status_code=404, detail="デバイスが見つかりません")
         return device[0]
@@ -920,15 +1215,12 @@ async def get_device_status(device_id: str):
 async def update_device(device_id: str, device_update: DeviceUpdate):
     """デバイス情報を更新"""
     try:
-        # デバイスの存在確認
-        existing_device = await supabase_client.select("devices", filters={"device_id": device_id})
-        if not existing_device:
-            raise HTTPException(status_code=404, detail="デバイスが見つかりません")
+        client = get_supabase_client()
         
         # 更新データの準備
         update_data = {}
         if device_update.status is not None:
-            update_data["status"] = device_update.status
+            update_data["status"] = device_update.status.value
         if device_update.last_sync is not None:
             update_data["last_sync"] = device_update.last_sync.isoformat()
         if device_update.total_audio_count is not None:
@@ -937,8 +1229,12 @@ async def update_device(device_id: str, device_update: DeviceUpdate):
         if not update_data:
             raise HTTPException(status_code=400, detail="更新するデータがありません")
         
-        updated_device = await supabase_client.update("devices", {"device_id": device_id}, update_data)
-        return updated_device[0] if updated_device else existing_device[0]
+        # 更新した行が返らなければ存在しない（存在確認と更新を1回で行う）
+        updated_device = await client.update("devices", update_data, {"device_id": device_id})
+        if not updated_device:
+            raise HTTPException(status_code=404, detail="デバイスが見つかりません")
+        fleet_health_index.apply([updated_device])
+        return Device(**updated_device)
     except HTTPException:
         raise
     except Exception as e:
@@ -949,18 +1245,18 @@ async def update_device(device_id: str, device_update: DeviceUpdate):
 async def sync_device(device_id: str):
     """デバイスの同期完了を通知"""
     try:
-        # デバイスの存在確認
-        existing_device = await supabase_client.select("devices", filters={"device_id": device_id})
-        if not existing_device:
-            raise HTTPException(status_code=404, detail="デバイスが見つかりません")
+        client = get_supabase_client()
         
-        # 同期時刻を更新
+        # 同期時刻を更新（更新した行が返らなければ存在しない）
         update_data = {
             "last_sync": datetime.now().isoformat(),
-            "status": DeviceStatus.ACTIVE
+            "status": DeviceStatus.ACTIVE.value
         }
         
-        await supabase_client.update("devices", {"device_id": device_id}, update_data)
+        updated_device = await client.update("devices", update_data, {"device_id": device_id})
+        if not updated_device:
+            raise HTTPException(status_code=404, detail="デバイスが見つかりません")
+        fleet_health_index.apply([updated_device])
         return ResponseModel(success=True, message="デバイス同期が完了しました")
     except HTTPException:
         raise
@@ -968,6 +1264,69 @@ async def sync_device(device_id: str):
         raise HTTPException(status_code=500, detail=f"デバイス同期に失敗しました: {str(e)}")
 
 
+# デバイスのハートビートのまとめ書き込み（最初のハートビートでフラッシュ用のタスクを起動）
+heartbeat_buffer = HeartbeatBuffer(get_supabase_client, on_written=fleet_health_index.apply)
+
+
+@app.post("/api/devices/heartbeats", response_model=DeviceHeartbeatResponse, status_code=202)
+async def ingest_device_heartbeats(heartbeats: Union[DeviceHeartbeat, List[DeviceHeartbeat]],
+                                   wait: bool = Query(False, description="書き込まれるまで待つ")):
+    """デバイスのハートビートを受け付ける（1件または配列。statusごとにまとめたPATCHで書き込む）"""
+    if isinstance(heartbeats, DeviceHeartbeat):
+        heartbeats = [heartbeats]
+    try:
+        futures = [heartbeat_buffer.submit(heartbeat.device_id, heartbeat.status.value, heartbeat.last_sync, wait=wait)
+                   for heartbeat in heartbeats]
+    except HeartbeatBufferFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    if not wait:
+        return DeviceHeartbeatResponse(accepted=len(heartbeats), waited=False)
+    try:
+        results = await asyncio.gather(*futures)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ハートビートの書き込みに失敗しました: {str(e)}")
+    unknown = sorted({heartbeat.device_id for heartbeat, ok in zip(heartbeats, results) if not ok})
+    written = len({heartbeat.device_id for heartbeat, ok in zip(heartbeats, results) if ok})
+    return DeviceHeartbeatResponse(accepted=len(heartbeats), waited=True, written=written, unknown_devices=unknown)
+
+
+@app.get("/api/devices/heartbeats/stats", response_model=Dict[str, Any])
+async def get_device_heartbeat_stats():
+    """ハートビートの受け付け・まとめ書き込みの統計"""
+    return heartbeat_buffer.stats()
+
+
+@app.get("/api/devices/fleet-health", response_model=Dict[str, Any])
+async def get_fleet_health(status: Optional[DeviceStatus] = Query(None, description="デバイスの状態で絞り込み")):
+    """最終同期からの経過時間の区切りごとのデバイス数（status別の内訳つき）"""
+    try:
+        await fleet_health_index.ensure_fresh()
+        summary = fleet_health_index.summary(status.value if status else None)
+        summary["index"] = fleet_health_index.stats()
+        return summary
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"デバイス稼働状況の取得に失敗しました: {str(e)}")
+
+
+@app.get("/api/devices/fleet-health/silent", response_model=Dict[str, Any])
+async def get_silent_devices(min_hours: float = Query(6, ge=0, description="この時間以上同期していない"),
+                             max_hours: Optional[float] = Query(None, gt=0, description="この時間未満（省略時は上限なし）"),
+                             status: Optional[DeviceStatus] = Query(None, description="デバイスの状態で絞り込み"),
+                             include_never: bool = Query(True, description="一度も同期していないデバイスを含める（max_hours省略時）"),
+                             page: int = Query(1, ge=1, description="ページ番号"),
+                             per_page: int = Query(50, ge=1, le=500, description="1ページあたりのアイテム数")):
+    """指定時間以上同期していないデバイスを最終同期の古い順に取得"""
+    if max_hours is not None and max_hours <= min_hours:
+        raise HTTPException(status_code=400, detail="max_hoursはmin_hoursより大きくしてください")
+    try:
+        await fleet_health_index.ensure_fresh()
+        return fleet_health_index.silent(min_hours, max_hours, status.value if status else None,
+                                         include_never=include_never, page=page, per_page=per_page)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"デバイス稼働状況の取得に失敗しました: {str(e)}")
+
+
 
 
 
@@ -977,8 +1336,8 @@ async def sync_device(device_id: str):
 # =============================================================================
 
 @app.get("/api/stats", response_model=StatsResponse)
-async def get_stats():
-    """システム統計情報を取得"""
+async def get_stats(request: Request):
+    """システム統計情報を取得（ETag対応、timestampは比較対象外）"""
     try:
         client = get_supabase_client()
         users = await client.select("users")
@@ -991,16 +1350,16 @@ async def get_stats():
         total_audio_count = sum(d.get("total_audio_count", 0) for d in devices)
         total_graph_count = 0  # graph_dataテーブル実装時に更新
         
-        return StatsResponse(
-            users_count=len(users),
-            devices_count=len(devices),
-            active_devices_count=active_devices_count,
-            viewer_links_count=0,  # 機能削除済み
-            active_links_count=0,  # 機能削除済み
-            total_audio_count=total_audio_count,
-            total_graph_count=0,  # 機能削除済み
-            timestamp=datetime.now()
-        )
+        stats = {
+            "users_count": len(users),
+            "devices_count": len(devices),
+            "active_devices_count": active_devices_count,
+            "viewer_links_count": 0,  # 機能削除済み
+            "active_links_count": 0,  # 機能削除済み
+            "total_audio_count": total_audio_count,
+            "total_graph_count": 0,  # 機能削除済み
+        }
+        return conditional_json(request, stats, lambda: StatsResponse(**stats, timestamp=datetime.now()))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"統計情報の取得に失敗しました: {str(e)}")
 
@@ -1013,6 +1372,7 @@ async def get_stats():
 async def create_guest_user(guest_data: GuestUserCreate):
     """ゲストユーザーを作成（Auth不要）"""
     try:
+        client = get_supabase_client()
         # ゲストユーザーの作成
         user_data = {
             "user_id": guest_data.user_id,
@@ -1021,11 +1381,14 @@ async def create_guest_user(guest_data: GuestUserCreate):
             "created_at": datetime.now().isoformat()
         }
         
-        result = await supabase_client.insert("users", user_data)
+        result = await client.insert("users", user_data)
         if not result:
             raise HTTPException(status_code=500, detail="ゲストユーザーの作成に失敗しました")
+        user_search_index.upsert(result)
         
-        return User(**result[0])
+        return User(**result)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ゲストユーザー作成に失敗しました: {str(e)}")
 
@@ -1034,15 +1397,9 @@ async def create_guest_user(guest_data: GuestUserCreate):
 async def upgrade_guest_to_member(user_id: str, upgrade_data: UserUpgradeToMember):
     """ゲストユーザーを会員にアップグレード"""
     try:
-        # 既存ユーザーの確認
-        existing_user = await supabase_client.select("users", filters={"user_id": user_id})
-        if not existing_user:
-            raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
-        
-        if existing_user[0].get("status") != UserStatus.GUEST:
-            raise HTTPException(status_code=400, detail="ゲストユーザーのみアップグレード可能です")
+        client = get_supabase_client()
         
-        # ユーザー情報を更新
+        # ユーザー情報を更新（ゲストであることを更新条件に含め、確認と更新を1回で行う）
         update_data = {
             "name": upgrade_data.name,
             "email": upgrade_data.email,
@@ -1050,11 +1407,16 @@ async def upgrade_guest_to_member(user_id: str, upgrade_data: UserUpgradeToMembe
             "updated_at": datetime.now().isoformat()
         }
         
-        result = await supabase_client.update("users", update_data, {"user_id": user_id})
+        result = await client.update("users", update_data, {"user_id": user_id, "status": UserStatus.GUEST.value})
         if not result:
-            raise HTTPException(status_code=500, detail="ユーザーアップグレードに失敗しました")
+            # 更新できなかった場合だけ、存在しないのかゲストでないのかを確認する
+            existing_user = await client.select("users", columns="user_id", filters={"user_id": user_id})
+            if not existing_user:
+                raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+            raise HTTPException(status_code=400, detail="ゲストユーザーのみアップグレード可能です")
+        user_search_index.upsert(result)
         
-        return User(**result[0])
+        return User(**result)
     except HTTPException:
         raise
     except Exception as e:
@@ -1065,12 +1427,9 @@ async def upgrade_guest_to_member(user_id: str, upgrade_data: UserUpgradeToMembe
 async def update_user_status(user_id: str, status_data: UserStatusUpdate):
     """ユーザーステータスを更新（サブスク加入など）"""
     try:
-        # 既存ユーザーの確認
-        existing_user = await supabase_client.select("users", filters={"user_id": user_id})
-        if not existing_user:
-            raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+        client = get_supabase_client()
         
-        # ステータス更新
+        # ステータス更新（更新した行が返らなければ存在しない）
         update_data = {
             "status": status_data.status.value,
             "updated_at": datetime.now().isoformat()
@@ -1079,55 +1438,75 @@ async def update_user_status(user_id: str, status_data: UserStatusUpdate):
         if status_data.subscription_plan:
             update_data["subscription_plan"] = status_data.subscription_plan.value
         
-        result = await supabase_client.update("users", update_data, {"user_id": user_id})
+        result = await client.update("users", update_data, {"user_id": user_id})
         if not result:
-            raise HTTPException(status_code=500, detail="ステータス更新に失敗しました")
+            raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+        user_search_index.upsert(result)
         
-        return User(**result[0])
+        return User(**result)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ステータス更新に失敗しました: {str(e)}")
 
 
+# devices.platform_identifierに一意制約があるか（42P10で一度でも失敗したらこのプロセスではFalseのまま）
+_platform_identifier_unique = True
+
+
+async def _insert_virtual_device(client, device: Dict[str, Any]) -> Dict[str, Any]:
+    """未登録の端末を挿入し、挿入した行を返す（一意制約があれば同時登録で先を越された場合は空のdict）"""
+    global _platform_identifier_unique
+    if _platform_identifier_unique:
+        try:
+            created = await client.upsert("devices", device, on_conflict="platform_identifier", ignore_duplicates=True)
+            return created[0] if created else {}
+        except httpx.HTTPStatusError as e:
+            if supabase_error_code(e) != "42P10":
+                raise
+            # 一意制約がない（READMEのマイグレーションが未適用）場合は、以降は通常の挿入だけを使う
+            logger.warning("devices.platform_identifier has no unique index; registering without upsert")
+            _platform_identifier_unique = False
+    return await client.insert("devices", device)
+
+
 @app.post("/api/devices/virtual-mobile", response_model=Device)
 async def create_virtual_mobile_device(device_data: VirtualMobileDeviceCreate):
-    """スマホ仮想デバイスを作成"""
+    """スマホ仮想デバイスを作成（platform_identifierが登録済みならオーナーと状態を更新）"""
     try:
-        # 既存デバイスの重複チェック（platform_identifierで）
-        existing_devices = await supabase_client.select("devices", filters={
-            "platform_identifier": device_data.platform_identifier
-        })
-        
-        if existing_devices:
-            # 既存デバイスが見つかった場合、オーナーを更新
-            device_id = existing_devices[0]["device_id"]
-            update_data = {
-                "owner_user_id": device_data.owner_user_id,
-                "status": device_data.status.value,
-                "updated_at": datetime.now().isoformat()
-            }
-            result = await supabase_client.update("devices", update_data, {"device_id": device_id})
-            return Device(**result[0])
-        
-        # 新規デバイス作成
-        device_uuid = str(uuid.uuid4())
+        client = get_supabase_client()
+        now = datetime.now().isoformat()
         new_device = {
-            "device_id": device_uuid,
+            "device_id": str(uuid.uuid4()),
             "owner_user_id": device_data.owner_user_id,
             "device_type": device_data.device_type,
             "platform_type": device_data.platform_type.value,
             "platform_identifier": device_data.platform_identifier,
             "status": device_data.status.value,
-            "registered_at": datetime.now().isoformat(),
+            "registered_at": now,
+            "updated_at": now,
             "total_audio_count": 0
         }
+        # 登録済みの端末で変えるのはオーナー・状態・updated_atだけ（種別やdevice_idはそのまま）
+        update_data = {
+            "owner_user_id": device_data.owner_user_id,
+            "status": device_data.status.value,
+            "updated_at": now
+        }
         
-        result = await supabase_client.insert("devices", new_device)
+        # 登録済みの端末（よくあるケース）は1回のPATCHで済ませる
+        # （merge-duplicatesのupsertでは、新規作成に必要なdevice_typeなどを登録済みの行にも上書きしてしまう）
+        result = await client.update("devices", update_data, {"platform_identifier": device_data.platform_identifier})
+        if not result:
+            result = await _insert_virtual_device(client, new_device)
+            if not result:
+                # 同じ端末の同時登録に負けた場合は、先に登録された行を更新する
+                result = await client.update("devices", update_data, {"platform_identifier": device_data.platform_identifier})
         if not result:
             raise HTTPException(status_code=500, detail="仮想デバイス作成に失敗しました")
         
-        return Device(**result[0])
+        fleet_health_index.apply([result])
+        return Device(**result)
     except HTTPException:
         raise
     except Exception as e:
@@ -1138,9 +1517,10 @@ async def create_virtual_mobile_device(device_data: VirtualMobileDeviceCreate):
 async def get_user_devices(user_id: str):
     """ユーザーのデバイス一覧を取得（新仕様）"""
     try:
+        client = get_supabase_client()
         # owner_user_idでデバイスを検索
-        devices = await supabase_client.select("devices", filters={"owner_user_id": user_id})
-        return [Device(**device) for device in devices]
+        devices = await client.select("devices", filters={"owner_user_id": user_id})
+        return model_list_response(Device, devices)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"デバイス一覧取得に失敗しました: {str(e)}")
 
@@ -1149,8 +1529,9 @@ async def get_user_devices(user_id: str):
 async def get_users_by_status(status: UserStatus):
     """ステータス別ユーザー一覧を取得"""
     try:
-        users = await supabase_client.select("users", filters={"status": status.value})
-        return [User(**user) for user in users]
+        client = get_supabase_client()
+        users = await client.select("users", filters={"status": status.value})
+        return model_list_response(User, users)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ユーザー一覧取得に失敗しました: {str(e)}")
 
@@ -1159,14 +1540,42 @@ async def get_users_by_status(status: UserStatus):
 # 通知管理API - Supabase notifications テーブル
 # =============================================================================
 
+# 通知統計のカウンター（初回の統計取得時に件数を取得し、以降は書き込みのたびに増減）
+notification_counters = NotificationCounters(get_supabase_client, [t.value for t in NotificationType])
+
+# ユーザーごとの未読件数（通知の書き込みのたびに増減）
+unread_counts = UnreadCountCache(get_supabase_client)
+
+
+def _notifications_read_changed(rows: List[Dict[str, Any]], is_read: bool):
+    """既読状態が変わった通知（user_id・type）を通知統計と未読件数に反映"""
+    for row in rows:
+        notification_counters.read_changed(row.get("type"), not is_read, is_read)
+        unread_counts.adjust(row.get("user_id"), -1 if is_read else 1)
+
+
+def _notifications_deleted(rows: List[Dict[str, Any]]):
+    """削除した通知（user_id・type・is_read）を通知統計と未読件数に反映"""
+    for row in rows:
+        is_read = row.get("is_read", False)
+        notification_counters.deleted(row.get("type"), is_read)
+        if not is_read:
+            unread_counts.adjust(row.get("user_id"), -1)
+
+
+# 通知の保持期間ポリシー（NOTIFICATION_RETENTION_DAYSを設定した場合のみ定期実行）
+notification_retention = NotificationRetention(get_supabase_client, _notifications_deleted)
+RETENTION_JOB_ID = "notification_retention"
+
 @app.get("/api/notifications", response_model=PaginatedNotificationsResponse)
-async def get_all_notifications(page: int = Query(1, ge=1, description="ページ番号"),
+async def get_all_notifications(request: Request,
+                               page: int = Query(1, ge=1, description="ページ番号"),
                                per_page: int = Query(20, ge=1, le=100, description="1ページあたりのアイテム数")):
-    """ページネーション付きで通知を取得（管理画面用）"""
+    """ページネーション付きで通知を取得（管理画面用、ETag対応）"""
     try:
         client = get_supabase_client()
         result = await client.select_paginated("notifications", page=page, per_page=per_page, order="created_at.desc")
-        return PaginatedNotificationsResponse(**result)
+        return conditional_json(request, result, lambda: PaginatedNotificationsResponse(**result))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"通知一覧の取得に失敗しました: {str(e)}")
 
@@ -1177,7 +1586,7 @@ async def get_all_notifications_legacy():
     try:
         client = get_supabase_client()
         notifications_data = await client.select("notifications", order="created_at.desc")
-        return [Notification(**notification) for notification in notifications_data]
+        return model_list_response(Notification, notifications_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"通知一覧の取得に失敗しました: {str(e)}")
 
@@ -1190,11 +1599,37 @@ async def get_user_notifications(user_id: str):
         notifications_data = await client.select("notifications", 
                                                 filters={"user_id": user_id},
                                                 order="created_at.desc")
-        return [Notification(**notification) for notification in notifications_data]
+        return model_list_response(Notification, notifications_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ユーザー通知の取得に失敗しました: {str(e)}")
 
 
+@app.get("/api/notifications/user/{user_id}/inbox", response_model=NotificationInboxResponse)
+async def get_user_inbox(user_id: str,
+                         limit: int = Query(20, ge=1, le=100, description="1ページの件数"),
+                         cursor: Optional[str] = Query(None, description="前のページのnext_cursor"),
+                         unread_only: bool = Query(False, description="未読の通知のみ")):
+    """ユーザーの通知を新しい順にカーソルページングで取得"""
+    try:
+        client = get_supabase_client()
+        page = await fetch_inbox(client, user_id, limit, cursor=cursor, unread_only=unread_only)
+        return NotificationInboxResponse(**page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"受信箱の取得に失敗しました: {str(e)}")
+
+
+@app.get("/api/notifications/user/{user_id}/unread-count", response_model=NotificationUnreadCountResponse)
+async def get_user_unread_count(user_id: str):
+    """ユーザーの未読通知数を取得（キャッシュ済みならデータベースにアクセスしない）"""
+    try:
+        unread_count, cached = await unread_counts.get(user_id)
+        return NotificationUnreadCountResponse(user_id=user_id, unread_count=unread_count, cached=cached)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"未読件数の取得に失敗しました: {str(e)}")
+
+
 @app.post("/api/notifications", response_model=Notification)
 async def create_notification(notification: NotificationCreate):
     """新しい通知を作成"""
@@ -1216,6 +1651,8 @@ async def create_notification(notification: NotificationCreate):
         if not created_notification:
             raise HTTPException(status_code=500, detail="通知の作成に失敗しました")
         
+        notification_counters.created(notification_data["type"])
+        unread_counts.adjust(notification.user_id, 1)
         return Notification(**created_notification)
     except HTTPException:
         raise
@@ -1225,38 +1662,41 @@ async def create_notification(notification: NotificationCreate):
 
 @app.post("/api/notifications/broadcast", response_model=NotificationBroadcastResponse)
 async def broadcast_notification(broadcast: NotificationBroadcast):
-    """一括通知送信"""
+    """一括通知送信（user_ids指定、またはsegment条件をサーバー側で解決してページ単位でバルク挿入）"""
     try:
         client = get_supabase_client()
         
-        # 各ユーザーに個別の通知を作成
-        notifications_data = []
-        for user_id in broadcast.user_ids:
-            notification_data = {
-                "user_id": user_id,
-                "type": broadcast.type.value,
-                "title": broadcast.title,
-                "message": broadcast.message,
-                "triggered_by": broadcast.triggered_by or "admin",
-                "metadata": broadcast.metadata,
-                "is_read": False
-            }
-            notifications_data.append(notification_data)
-        
-        # 一つずつ挿入（バッチ挿入の代替）
-        created_notifications = []
-        for notification_data in notifications_data:
-            created_notification = await client.insert("notifications", notification_data)
-            created_notifications.append(created_notification)
-        sent_count = len(created_notifications) if created_notifications else 0
-        failed_count = len(broadcast.user_ids) - sent_count
+        notification_template = {
+            "type": broadcast.type.value,
+            "title": broadcast.title,
+            "message": broadcast.message,
+            "triggered_by": broadcast.triggered_by or "admin",
+            "metadata": broadcast.metadata,
+            "is_read": False
+        }
+        
+        resume_after = broadcast.resume_after_user_id
+        if broadcast.segment is not None:
+            pages = iter_segment_user_ids(client, broadcast.segment, resume_after=resume_after)
+        else:
+            pages = iter_user_id_pages(broadcast.user_ids, resume_after=resume_after)
+        
+        # 途中で失敗しても500にはせず、送信済みの件数と再開位置を返す（再開位置から再実行すれば重複しない）
+        result = await send_broadcast(client, pages, notification_template,
+                                      on_sent=lambda user_ids: unread_counts.adjust_many(user_ids, 1))
+        notification_counters.created(notification_template["type"], result["sent"])
         
+        message = f"{result['sent']}件の通知を送信しました"
+        if result["error"]:
+            message += f"。途中で停止しました（{result['error']}）。resume_after_user_idを指定して再実行すると続きから送信します"
         return NotificationBroadcastResponse(
-            success=True,
-            sent_count=sent_count,
-            failed_count=failed_count,
-            message=f"{sent_count}件の通知を送信しました",
-            timestamp=datetime.now()
+            success=result["error"] is None,
+            sent_count=result["sent"],
+            failed_count=result["failed"],
+            message=message,
+            timestamp=datetime.now(),
+            resume_after_user_id=result["resume_after"] or resume_after,
+            error=result["error"]
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"一括通知送信に失敗しました: {str(e)}")
@@ -1280,13 +1720,22 @@ async def update_notification(notification_id: str, update_data: NotificationUpd
         if not update_fields:
             raise HTTPException(status_code=400, detail="更新するデータがありません")
         
-        updated_notification = await client.update("notifications", 
-                                                  {"id": notification_id}, 
-                                                  update_fields)
+        # 既読状態を変更する場合は、bulk_mark_readと同様に「既読状態が変わる行だけ」を条件にしたPATCHを発行する
+        # （行が返れば状態が変わったのでカウンターを更新。同時に同じ変更が来ても片方しか一致しないため二重に数えない）
+        updated_notification = {}
+        if "is_read" in update_fields:
+            current = f"eq.{str(not update_fields['is_read']).lower()}"
+            updated_notification = await client.update("notifications", update_fields, {"id": notification_id},
+                                                       where={"is_read": current})
+            if updated_notification:
+                _notifications_read_changed([updated_notification], update_fields["is_read"])
+        
+        # 既読状態が変わらない（または変更しない）場合は通常のPATCH。行が返らなければ存在しない
         if not updated_notification:
-            raise HTTPException(status_code=404, detail="通知が見つかりません")
-        
-        return Notification(**updated_notification[0])
+            updated_notification = await client.update("notifications", update_fields, {"id": notification_id})
+            if not updated_notification:
+                raise HTTPException(status_code=404, detail="通知が見つかりません")
+        return Notification(**updated_notification)
     except HTTPException:
         raise
     except Exception as e:
@@ -1299,13 +1748,12 @@ async def delete_notification(notification_id: str):
     try:
         client = get_supabase_client()
         
-        # 通知の存在確認
-        existing_notification = await client.select("notifications", filters={"id": notification_id})
-        if not existing_notification:
+        # 削除した行が返らなければ存在しない（存在確認と削除を1回で行う）
+        deleted = await client.delete_many("notifications", filters={"id": notification_id}, columns="user_id,type,is_read")
+        if not deleted:
             raise HTTPException(status_code=404, detail="通知が見つかりません")
         
-        # 削除実行
-        await client.delete("notifications", {"id": notification_id})
+        _notifications_deleted(deleted)
         
         return ResponseModel(success=True, message="通知を削除しました")
     except HTTPException:
@@ -1314,32 +1762,80 @@ async def delete_notification(notification_id: str):
         raise HTTPException(status_code=500, detail=f"通知削除に失敗しました: {str(e)}")
 
 
-@app.get("/api/notifications/stats", response_model=Dict[str, Any])
-async def get_notification_stats():
-    """通知統計情報を取得"""
+@app.post("/api/notifications/bulk/read", response_model=NotificationBulkResponse)
+async def bulk_update_notifications_read(bulk: NotificationBulkRead):
+    """通知を一括で既読・未読にする（ids指定・filter指定ともにチャンクごとのPATCH）"""
     try:
         client = get_supabase_client()
+        rows, failed_chunks = await bulk_mark_read(client, bulk, bulk.is_read)
+        _notifications_read_changed(rows, bulk.is_read)
+        
+        label = "既読" if bulk.is_read else "未読"
+        return NotificationBulkResponse(
+            success=failed_chunks == 0,
+            affected_count=len(rows),
+            message=f"{len(rows)}件の通知を{label}にしました" + (f"（{failed_chunks}チャンク失敗）" if failed_chunks else ""),
+            timestamp=datetime.now()
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"通知の一括更新に失敗しました: {str(e)}")
+
+
+@app.post("/api/notifications/bulk/delete", response_model=NotificationBulkResponse)
+async def bulk_delete_notifications(bulk: NotificationBulkTarget):
+    """通知を一括削除（ids指定・filter指定ともにチャンクごとのDELETE）"""
+    try:
+        client = get_supabase_client()
+        rows, failed_chunks = await bulk_delete(client, bulk)
+        _notifications_deleted(rows)
         
-        # 全通知数
-        all_notifications = await client.select("notifications")
-        total_count = len(all_notifications)
-        
-        # 未読通知数
-        unread_count = len([n for n in all_notifications if not n.get("is_read", False)])
-        
-        # タイプ別集計
-        type_counts = {}
-        for notification in all_notifications:
-            notification_type = notification.get("type", "unknown")
-            type_counts[notification_type] = type_counts.get(notification_type, 0) + 1
-        
-        return {
-            "total_notifications": total_count,
-            "unread_notifications": unread_count,
-            "read_notifications": total_count - unread_count,
-            "type_breakdown": type_counts,
-            "timestamp": datetime.now().isoformat()
-        }
+        return NotificationBulkResponse(
+            success=failed_chunks == 0,
+            affected_count=len(rows),
+            message=f"{len(rows)}件の通知を削除しました" + (f"（{failed_chunks}チャンク失敗）" if failed_chunks else ""),
+            timestamp=datetime.now()
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"通知の一括削除に失敗しました: {str(e)}")
+
+
+@app.get("/api/notifications/retention", response_model=Dict[str, Any])
+async def get_notification_retention():
+    """通知の保持期間ポリシーと最後（または実行中）の実行の状態を取得（どのワーカーで実行したものでも返す）"""
+    return {
+        "policy": notification_retention.policy(),
+        "running": notification_retention.running,
+        "scheduled": scheduler_engine.has_job(RETENTION_JOB_ID),
+        "last_report": notification_retention.last_report,
+    }
+
+
+@app.post("/api/notifications/retention/run", response_model=Dict[str, Any], status_code=202)
+async def run_notification_retention(response: Response, dry_run: bool = Query(False, description="対象件数だけを数える")):
+    """通知の保持期間ポリシーを手動実行（期限切れの通知をバックグラウンドでアーカイブして削除）
+
+    実行はすぐに始めてrun_idを返す。進捗と結果は GET /api/notifications/retention の last_report で確認する。
+    dry_runでは対象件数をその場で数えて返す。
+    """
+    try:
+        if dry_run:
+            response.status_code = 200
+            return await notification_retention.dry_run()
+        return notification_retention.start()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"保持期間ポリシーの実行に失敗しました: {str(e)}")
+
+
+@app.get("/api/notifications/stats", response_model=Dict[str, Any])
+async def get_notification_stats():
+    """通知統計情報を取得（インクリメンタルに更新しているカウンターを返す）"""
+    try:
+        stats = await notification_counters.snapshot()
+        return {**stats, "timestamp": datetime.now().isoformat()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"通知統計の取得に失敗しました: {str(e)}")
 
@@ -1350,17 +1846,32 @@ async def get_notification_stats():
 import httpx
 import asyncio
 
+# 解析APIのベースURL（通常は常に本番。ベンチマーク時のみローカルのモックに向ける）
+ANALYSIS_API_BASE_URL = os.getenv("ANALYSIS_API_BASE_URL", "https://api.hey-watch.me").rstrip("/")
+
 # APIエンドポイントの定義
 API_ENDPOINTS = {
-    "whisper": "https://api.hey-watch.me/vibe-transcriber/fetch-and-transcribe",
-    "prompt_gen": "https://api.hey-watch.me/vibe-aggregator/generate-mood-prompt-supabase",
-    "chatgpt": "https://api.hey-watch.me/vibe-scorer/analyze-vibegraph-supabase",
-    "sed": "https://api.hey-watch.me/behavior-features/fetch-and-process-paths",
-    "sed_aggregator": "https://api.hey-watch.me/behavior-aggregator/analysis/sed",
-    "opensmile": "https://api.hey-watch.me/emotion-features/process/emotion-features",
-    "opensmile_aggregator": "https://api.hey-watch.me/emotion-aggregator/analyze/opensmile-aggregator"
+    "whisper": f"{ANALYSIS_API_BASE_URL}/vibe-transcriber/fetch-and-transcribe",
+    "prompt_gen": f"{ANALYSIS_API_BASE_URL}/vibe-aggregator/generate-mood-prompt-supabase",
+    "chatgpt": f"{ANALYSIS_API_BASE_URL}/vibe-scorer/analyze-vibegraph-supabase",
+    "sed": f"{ANALYSIS_API_BASE_URL}/behavior-features/fetch-and-process-paths",
+    "sed_aggregator": f"{ANALYSIS_API_BASE_URL}/behavior-aggregator/analysis/sed",
+    "opensmile": f"{ANALYSIS_API_BASE_URL}/emotion-features/process/emotion-features",
+    "opensmile_aggregator": f"{ANALYSIS_API_BASE_URL}/emotion-aggregator/analyze/opensmile-aggregator"
 }
 
+# URLからメトリクス用のエンドポイント名を引く逆引きテーブル
+API_ENDPOINT_NAMES = {url: name for name, url in API_ENDPOINTS.items()}
+# 上流に届いていない（ゲートウェイ・上流の停止）ことを示すステータス。接続エラーと同じく、ファイルの失敗には数えない
+UPSTREAM_UNAVAILABLE_STATUSES = (502, 503, 504)
+
+# 解析API呼び出しは優先度付きキューで実行枠を割り当てる（手動操作がバッチ処理の後ろで待たないように）
+upstream_dispatcher = PriorityDispatcher()
+_upstream_in_flight = InFlight("upstream", upstream_dispatcher.capacity)
+# Whisper・SED・OpenSMILEのバッチサイズとタイムアウトは観測した処理速度から決める
+adaptive_batcher = AdaptiveBatchSizer()
+
+@traced("check_api_health", lambda session, step_name, base_url: {"step": step_name})
 async def check_api_health(session, step_name, base_url):
     """APIサーバーのヘルスチェックを実行"""
     # URLからベースURLを抽出してヘルスチェックURLを構築
@@ -1369,18 +1880,34 @@ async def check_api_health(session, step_name, base_url):
     health_url = f"{parsed.scheme}://{parsed.netloc}/health"
     
     try:
-        response = await session.get(health_url, timeout=5.0)
+        response = await session.get(health_url, headers=inject_headers(), timeout=5.0)
         if response.status_code == 200:
             return {"step": step_name, "success": True, "message": f"✅ {step_name}サーバー起動確認済み (ポート{parsed.port})"}
         else:
+            current_span().set_status("error", f"HTTP {response.status_code}")
             return {"step": step_name, "success": False, "message": f"❌ {step_name}サーバー異常 (Status: {response.status_code})"}
     except Exception as e:
+        current_span().set_status("error", str(e))
         return {"step": step_name, "success": False, "message": f"❌ {step_name}サーバーに接続できません (ポート{parsed.port}): {str(e)}"}
 
+@traced("call_api", lambda session, step_name, url, *args, **kwargs: {"step": step_name, "http.url": url})
 async def call_api(session, step_name, url, method='post', json_data=None, params=None):
-    """指定されたAPIを呼び出し、結果を返す"""
+    """指定されたAPIを呼び出し、結果を返す
+
+    watchme_upstream_request_duration_seconds はこの関数全体の時間（ヘルスチェック・実行枠の待ちを含む）を記録する。
+    実行枠の待ちだけは watchme_dispatch_wait_seconds、バッチサイズの学習には送信から応答までの時間を使う。
+    """
+    endpoint_name = API_ENDPOINT_NAMES.get(url, "other")
+    started = time.perf_counter()
+    sent_at = None
+    log_fields = {"step": step_name, "endpoint": endpoint_name, "url": url, "lane": dispatch_lane.get()}
+    # ファイルパスを送る解析APIは、ファイル数から学習したタイムアウトを使い、所要時間を学習に反映する
+    file_count = 0
+    if endpoint_name in ADAPTIVE_ENDPOINTS and isinstance(json_data, dict) and isinstance(json_data.get("file_paths"), list):
+        file_count = len(json_data["file_paths"])
+    request_timeout = adaptive_batcher.timeout(endpoint_name, file_count) if file_count else 300.0
     try:
-        print(f"🔗 APIコール開始: {step_name} -> {url}")
+        logger.debug("upstream call started", extra=log_fields)
         
         # 相対パスの場合、フルURLに変換
         if url.startswith('/'):
@@ -1395,23 +1922,56 @@ async def call_api(session, step_name, url, method='post', json_data=None, param
             base_url = url
             health_check = await check_api_health(session, step_name, base_url)
         
-        print(f"🚀 {step_name}API処理開始...")
-        if method == 'post':
-            response = await session.post(full_url, json=json_data, timeout=300.0)
-        else:
-            response = await session.get(full_url, params=params, timeout=300.0)
+        # 相関IDとトレースコンテキストを上流APIへ引き継ぐ
+        request_id = correlation_id.get()
+        headers = inject_headers({CORRELATION_HEADER: request_id} if request_id else None)
+        
+        async with upstream_dispatcher.slot():
+            sent_at = time.perf_counter()
+            with _upstream_in_flight:
+                if method == 'post':
+                    response = await session.post(full_url, json=json_data, headers=headers, timeout=request_timeout)
+                else:
+                    response = await session.get(full_url, params=params, headers=headers, timeout=request_timeout)
         
         response.raise_for_status() # HTTPエラーがあれば例外を発生
-        print(f"✅ {step_name}API処理完了")
-        return {"step": step_name, "success": True, "message": "✅ 処理完了", "data": response.json(), "health_check": health_check}
+        data = response.json()
+        duration = time.perf_counter() - started
+        UPSTREAM_REQUEST_SECONDS.labels(endpoint_name, "success").observe(duration)
+        if file_count:
+            adaptive_batcher.observe(endpoint_name, file_count, time.perf_counter() - sent_at)
+        logger.info("upstream call completed", extra={
+            **log_fields, "status_code": response.status_code, "duration_ms": round(duration * 1000, 1)
+        })
+        return {"step": step_name, "success": True, "message": "✅ 処理完了", "data": data, "health_check": health_check}
     except httpx.HTTPStatusError as e:
+        UPSTREAM_REQUEST_SECONDS.labels(endpoint_name, "http_error").observe(time.perf_counter() - started)
         error_msg = f"❌ APIエラー: {e.response.status_code} - {e.response.text}"
-        print(f"❌ {step_name}API処理失敗: {error_msg}")
-        return {"step": step_name, "success": False, "message": error_msg}
+        current_span().set_status("error", f"HTTP {e.response.status_code}")
+        logger.error("upstream call failed", extra={
+            **log_fields, "status_code": e.response.status_code, "error": e.response.text[:500]
+        })
+        # ゲートウェイ・上流の停止（502/503/504）はファイルの問題ではないため、接続エラーとして扱う
+        error_type = "connection_error" if e.response.status_code in UPSTREAM_UNAVAILABLE_STATUSES else "http_error"
+        return {"step": step_name, "success": False, "message": error_msg, "error_type": error_type}
     except httpx.RequestError as e:
+        UPSTREAM_REQUEST_SECONDS.labels(endpoint_name, "connection_error").observe(time.perf_counter() - started)
+        # 応答待ちのタイムアウトだけが処理時間によるもの。接続・コネクションプールのタイムアウトは接続エラーとして扱う
+        read_timeout = isinstance(e, httpx.ReadTimeout)
+        if file_count and sent_at is not None and read_timeout:
+            # タイムアウトは「少なくともこれだけかかった」として学習に含め、次回のバッチを小さくする
+            adaptive_batcher.observe(endpoint_name, file_count, time.perf_counter() - sent_at)
         error_msg = f"❌ 接続エラー: {str(e)}"
-        print(f"❌ {step_name}API接続失敗: {error_msg}")
-        return {"step": step_name, "success": False, "message": error_msg}
+        current_span().set_status("error", str(e))
+        logger.error("upstream connection failed", extra={**log_fields, "error": str(e)})
+        error_type = "timeout" if read_timeout else "connection_error"
+        return {"step": step_name, "success": False, "message": error_msg, "error_type": error_type}
+    except Exception as e:
+        # 200で返ったのにJSONとして読めない応答など、httpx以外の例外も記録する
+        UPSTREAM_REQUEST_SECONDS.labels(endpoint_name, "error").observe(time.perf_counter() - started)
+        current_span().set_status("error", str(e))
+        logger.error("upstream call raised", extra={**log_fields, "error": str(e), "error_class": type(e).__name__})
+        return {"step": step_name, "success": False, "message": f"❌ 予期しないエラー: {str(e)}", "error_type": "error"}
 
 # バッチ処理関連のエンドポイントは削除されました
 
@@ -1448,7 +2008,7 @@ async def whisper_status_proxy():
     """Whisper APIのステータス確認エンドポイント"""
     async with httpx.AsyncClient(timeout=10.0) as session:
         try:
-            response = await session.get("https://api.hey-watch.me/vibe-transcriber/")
+            response = await session.get(f"{ANALYSIS_API_BASE_URL}/vibe-transcriber/")
             if response.status_code == 200:
                 return {"status": "online", "data": response.json()}
             else:
@@ -1528,7 +2088,7 @@ async def sed_status():
     try:
         async with httpx.AsyncClient(timeout=10.0) as session:
             # SED APIのヘルスチェック
-            health_url = "https://api.hey-watch.me/behavior-features/"
+            health_url = f"{ANALYSIS_API_BASE_URL}/behavior-features/"
             response = await session.get(health_url)
             
             if response.status_code == 200:
@@ -1607,7 +2167,7 @@ async def opensmile_status():
     try:
         async with httpx.AsyncClient(timeout=10.0) as session:
             # OpenSMILE APIのヘルスチェック
-            health_url = "https://api.hey-watch.me/emotion-features/health"
+            health_url = f"{ANALYSIS_API_BASE_URL}/emotion-features/health"
             response = await session.get(health_url)
             
             if response.status_code == 200:
@@ -1721,6 +2281,120 @@ async def opensmile_aggregator_proxy(request: Request):
         raise HTTPException(status_code=500, detail="OpenSMILE Aggregator処理がタイムアウトしました")
 
 
+# =============================================================================
+# 音声ファイルの処理状況API
+# =============================================================================
+
+# デバイス × 日ごとの処理状況のビット列キャッシュ
+audio_coverage = AudioCoverage(get_supabase_client)
+
+
+@app.post("/api/audio-files/coverage", response_model=Dict[str, Any])
+async def get_audio_coverage(query: AudioCoverageRequest,
+                             refresh: bool = Query(False, description="キャッシュを使わずに取得し直す")):
+    """デバイス × 30分スロットごとの録音の有無と処理状態（文字起こし・行動特徴・感情特徴）を取得"""
+    try:
+        return await audio_coverage.matrix(query.device_ids, query.start_date, query.end_date, refresh=refresh)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"音声ファイルの処理状況の取得に失敗しました: {str(e)}")
+
+
+@app.get("/api/audio-files/coverage/stats", response_model=Dict[str, Any])
+async def get_audio_coverage_stats():
+    """処理状況キャッシュの統計"""
+    return audio_coverage.stats()
+
+
+# =============================================================================
+# バックフィルAPI（過去データの一括再処理）
+# =============================================================================
+
+# 処理ごとの解析APIと送信内容（スケジューラーと同じ）
+BACKFILL_API_CALLS = {
+    "whisper": ("Whisper音声文字起こし（バックフィル）", "whisper", {}),
+    "sed": ("SED音響イベント検出（バックフィル）", "sed", {"threshold": 0.2}),
+    "opensmile": ("OpenSMILE音声特徴量抽出（バックフィル）", "opensmile",
+                  {"feature_set": "eGeMAPSv02", "include_raw_features": False}),
+}
+
+
+async def _dispatch_backfill(session: httpx.AsyncClient, step: str, file_paths: List[str]):
+    """バックフィルの1バッチを解析APIに送り、(処理件数, 失敗件数)を返す（sessionはジョブの実行中に使い回す）"""
+    step_name, endpoint, extra = BACKFILL_API_CALLS[step]
+    result = await call_api(session, step_name, API_ENDPOINTS[endpoint], json_data={"file_paths": file_paths, **extra})
+    if not result["success"]:
+        raise RuntimeError(result.get("message", "不明なエラー"))
+    data = result.get("data") or {}
+    if step == "whisper":
+        return data.get("total_processed", 0), 0
+    summary = data.get("summary") or {}
+    return summary.get("total_files", len(file_paths)), summary.get("errors", 0)
+
+# バックフィルのジョブ（チェックポイントはファイルに保存し、再起動後に再開できる）
+backfill_engine = BackfillEngine(get_supabase_client, _dispatch_backfill, upstream_dispatcher,
+                                 open_session=lambda: httpx.AsyncClient(timeout=600.0),
+                                 batch_sizer=adaptive_batcher.batch_size)
+
+
+@app.post("/api/backfill/jobs", response_model=Dict[str, Any], status_code=202)
+async def create_backfill_job(request: BackfillRequest):
+    """デバイス × 日付範囲の未処理ファイルを一括で再処理するジョブを開始"""
+    try:
+        return await backfill_engine.create(request.device_ids, request.start_date, request.end_date,
+                                            [step.value for step in request.steps],
+                                            concurrency=request.concurrency, batch_size=request.batch_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BackfillConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"バックフィルの開始に失敗しました: {str(e)}")
+
+
+@app.get("/api/backfill/jobs", response_model=List[Dict[str, Any]])
+async def list_backfill_jobs():
+    """バックフィルのジョブ一覧（新しい順）"""
+    try:
+        return await backfill_engine.list_jobs()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"バックフィルのジョブ一覧の取得に失敗しました: {str(e)}")
+
+
+@app.get("/api/backfill/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_backfill_job(job_id: str):
+    """バックフィルの進捗（処理速度・残り時間の見込みを含む）"""
+    try:
+        return await backfill_engine.progress(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"バックフィルの進捗の取得に失敗しました: {str(e)}")
+
+
+@app.post("/api/backfill/jobs/{job_id}/pause", response_model=Dict[str, Any])
+async def pause_backfill_job(job_id: str):
+    """処理中の単位を終えたところでジョブを止める"""
+    try:
+        return await backfill_engine.pause(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    except BackfillConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/api/backfill/jobs/{job_id}/resume", response_model=Dict[str, Any], status_code=202)
+async def resume_backfill_job(job_id: str):
+    """チェックポイントから再開（停止・再起動・失敗した単位の再処理）"""
+    try:
+        return await backfill_engine.start(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    except BackfillConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"バックフィルの再開に失敗しました: {str(e)}")
+
+
 # =============================================================================
 # ヘルスチェック
 # =============================================================================
@@ -1735,6 +2409,54 @@ async def health_check():
 # スケジューラーAPI エンドポイント
 # =============================================================================
 
+@app.get("/api/scheduler/jobs")
+async def get_scheduler_jobs_endpoint():
+    """全スケジューラーの登録済みジョブ一覧と同時実行数の上限"""
+    try:
+        return {
+            "jobs": scheduler_engine.list_jobs(),
+            "limits": scheduler_engine.limits(),
+            "is_leader": scheduler_coordinator.is_leader,
+            "leader_pid": scheduler_coordinator.leader_pid()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ジョブ一覧取得エラー: {str(e)}")
+
+@app.get("/api/upstream/queue")
+async def get_upstream_queue_endpoint():
+    """解析API呼び出しの実行枠と、レーンごとの待ち数・重み"""
+    return upstream_dispatcher.snapshot()
+
+@app.get("/api/upstream/adaptive")
+async def get_upstream_adaptive_endpoint():
+    """解析APIごとに学習した所要時間モデルと、それから決めたバッチサイズ・タイムアウト"""
+    return adaptive_batcher.snapshot()
+
+@app.get("/api/scheduler/dead-letters")
+async def get_dead_letters_endpoint(
+    backend: Optional[str] = Query(None, description="whisper / sed / opensmile"),
+    state: str = Query("dead_letter", pattern="^(dead_letter|retrying)$", description="dead_letter: デッドレター / retrying: 再試行待ち"),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(50, ge=1, le=500)
+):
+    """解析APIで失敗し続けたファイル（デッドレター）または再試行待ちのファイル"""
+    try:
+        result = await asyncio.to_thread(file_retries.list_files, dead=state == "dead_letter", backend=backend,
+                                         page=page, per_page=per_page)
+        counts = await asyncio.to_thread(file_retries.counts)
+        return {**result, "counts": counts, "max_attempts": file_retries.max_attempts}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"デッドレターの取得に失敗しました: {str(e)}")
+
+@app.post("/api/scheduler/dead-letters/requeue")
+async def requeue_dead_letters_endpoint(request: DeadLetterRequeueRequest):
+    """デッドレターのファイルを次回のスケジューラー実行で再試行させる"""
+    try:
+        requeued = await asyncio.to_thread(file_retries.requeue, backend=request.backend, file_paths=request.file_paths)
+        return {"requeued": requeued, "counts": await asyncio.to_thread(file_retries.counts)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"デッドレターの再投入に失敗しました: {str(e)}")
+
 @app.post("/api/scheduler/start", response_model=SchedulerStatus)
 async def start_scheduler_endpoint(config: SchedulerConfig):
     """スケジューラーを開始"""
@@ -1757,11 +2479,11 @@ async def stop_scheduler_endpoint(api_type: SchedulerAPIType, device_id: str):
         raise HTTPException(status_code=500, detail=f"スケジューラー停止エラー: {str(e)}")
 
 @app.get("/api/scheduler/status", response_model=Optional[SchedulerStatus])
-async def get_scheduler_status_endpoint(api_type: SchedulerAPIType, device_id: str):
-    """スケジューラーの状態を取得"""
+async def get_scheduler_status_endpoint(request: Request, api_type: SchedulerAPIType, device_id: str):
+    """スケジューラーの状態を取得（ETag対応）"""
     try:
-        status = scheduler_manager.get_scheduler_status(api_type, device_id)
-        return status
+        job_info = scheduler_manager.active_jobs.get(scheduler_manager._get_job_id(api_type, device_id))
+        return conditional_json(request, job_info, lambda: scheduler_manager.get_scheduler_status(api_type, device_id))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"スケジューラー状態取得エラー: {str(e)}")
 
@@ -1775,11 +2497,10 @@ async def get_scheduler_logs_endpoint(api_type: SchedulerAPIType, device_id: str
         raise HTTPException(status_code=500, detail=f"スケジューラーログ取得エラー: {str(e)}")
 
 @app.get("/api/scheduler/all-status", response_model=List[SchedulerStatus])
-async def get_all_scheduler_status_endpoint():
-    """すべてのスケジューラーの状態を取得"""
+async def get_all_scheduler_status_endpoint(request: Request):
+    """すべてのスケジューラーの状態を取得（ETag対応）"""
     try:
-        statuses = scheduler_manager.get_all_scheduler_status()
-        return statuses
+        return conditional_json(request, scheduler_manager.active_jobs, scheduler_manager.get_all_scheduler_status)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"全スケジューラー状態取得エラー: {str(e)}")
 
@@ -4,8 +4,8 @@ WatchMe用途に基づく拡張されたPydanticモデル
 """
 
 from typing import Optional, List, Dict, Any
-from datetime import datetime
-from pydantic import BaseModel, Field
+from datetime import date, datetime
+from pydantic import BaseModel, Field, model_validator
 from enum import Enum
 
 
@@ -117,6 +117,21 @@ class DeviceUpdate(BaseModel):
     total_audio_count: Optional[int] = None
 
 
+class DeviceHeartbeat(BaseModel):
+    """デバイスのハートビート（同期通知）"""
+    device_id: str
+    status: DeviceStatus = DeviceStatus.ACTIVE
+    last_sync: Optional[datetime] = Field(None, description="同期時刻（省略時は受信時刻）")
+
+
+class DeviceHeartbeatResponse(BaseModel):
+    """ハートビートの受け付け結果"""
+    accepted: int = Field(..., description="受け付けた件数")
+    waited: bool = Field(..., description="書き込みまで待ったか")
+    written: Optional[int] = Field(None, description="書き込まれたデバイス数（waitの場合のみ）")
+    unknown_devices: List[str] = Field(default_factory=list, description="存在しないデバイス（waitの場合のみ）")
+
+
 class Device(DeviceBase):
     device_id: str
     owner_user_id: Optional[str] = None  # オプショナルに変更
@@ -191,14 +206,33 @@ class Notification(NotificationBase):
         from_attributes = True
 
 
+class BroadcastSegment(BaseModel):
+    """一括通知の送信対象条件（指定した条件はすべて満たすユーザーが対象、空なら全ユーザー）"""
+    status: Optional[List[UserStatus]] = Field(None, description="ユーザーステータス（いずれか）")
+    subscription_plan: Optional[List[SubscriptionPlan]] = Field(None, description="サブスクリプションプラン（いずれか）")
+    has_active_device: Optional[bool] = Field(None, description="アクティブなデバイスを所有しているか")
+    created_from: Optional[datetime] = Field(None, description="登録日時の開始（以上）")
+    created_to: Optional[datetime] = Field(None, description="登録日時の終了（未満）")
+
+
 class NotificationBroadcast(BaseModel):
-    """一括通知送信用モデル"""
-    user_ids: List[str] = Field(..., description="送信対象のユーザーID一覧")
+    """一括通知送信用モデル（user_idsかsegmentのどちらかを指定）"""
+    user_ids: Optional[List[str]] = Field(None, description="送信対象のユーザーID一覧")
+    segment: Optional[BroadcastSegment] = Field(None, description="送信対象の条件（サーバー側で解決）")
     type: NotificationType = Field(..., description="通知タイプ")
     title: str = Field(..., description="通知のタイトル")
     message: str = Field(..., description="通知メッセージ")
     triggered_by: Optional[str] = Field(None, description="通知の送信者・システム名")
     metadata: Optional[Dict[str, Any]] = Field(None, description="追加のメタデータ")
+    resume_after_user_id: Optional[str] = Field(None, description="途中で失敗した送信の再開位置（前回の応答のresume_after_user_id）")
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.user_ids is None) == (self.segment is None):
+            raise ValueError("user_idsとsegmentのどちらか一方を指定してください")
+        if self.resume_after_user_id is not None and self.user_ids is not None and self.resume_after_user_id not in self.user_ids:
+            raise ValueError("resume_after_user_idはuser_idsに含まれるIDを指定してください")
+        return self
 
 
 class NotificationBroadcastResponse(BaseModel):
@@ -208,6 +242,56 @@ class NotificationBroadcastResponse(BaseModel):
     failed_count: int
     message: str
     timestamp: datetime
+    resume_after_user_id: Optional[str] = Field(None, description="送信済みの最後のユーザーID（失敗時はこれを指定して再実行すると続きから送る）")
+    error: Optional[str] = Field(None, description="途中で止まった場合の原因")
+
+
+class NotificationInboxResponse(BaseModel):
+    """ユーザーの受信箱（カーソルページング）"""
+    items: List[Notification] = Field(..., description="通知（新しい順）")
+    next_cursor: Optional[str] = Field(None, description="次のページを取得するためのカーソル")
+    has_more: bool = Field(..., description="次のページがあるか")
+
+
+class NotificationUnreadCountResponse(BaseModel):
+    """ユーザーの未読通知数"""
+    user_id: str
+    unread_count: int
+    cached: bool = Field(..., description="キャッシュから返したか")
+
+
+class NotificationBulkFilter(BaseModel):
+    """通知の一括操作の対象条件（指定した条件はすべて満たす通知が対象）"""
+    user_id: Optional[str] = Field(None, description="通知対象のユーザーID")
+    type: Optional[NotificationType] = Field(None, description="通知タイプ")
+    created_before: Optional[datetime] = Field(None, description="この日時より前に作成された通知")
+
+
+class NotificationBulkTarget(BaseModel):
+    """通知の一括操作の対象（idsかfilterのどちらかを指定）"""
+    ids: Optional[List[str]] = Field(None, description="通知IDの一覧")
+    filter: Optional[NotificationBulkFilter] = Field(None, description="対象の条件")
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.ids is None) == (self.filter is None):
+            raise ValueError("idsとfilterのどちらか一方を指定してください")
+        if self.filter is not None and not self.filter.model_dump(exclude_none=True):
+            raise ValueError("filterには少なくとも1つの条件を指定してください")
+        return self
+
+
+class NotificationBulkRead(NotificationBulkTarget):
+    """通知の一括既読・未読用モデル"""
+    is_read: bool = Field(True, description="設定する既読フラグ")
+
+
+class NotificationBulkResponse(BaseModel):
+    """通知の一括操作結果"""
+    success: bool
+    affected_count: int
+    message: str
+    timestamp: datetime
 
 
 # =============================================================================
@@ -289,4 +373,50 @@ class SchedulerLogResponse(BaseModel):
     api_type: SchedulerAPIType = Field(..., description="API種別")
     device_id: str = Field(..., description="デバイスID")
     logs: List[SchedulerLogEntry] = Field(..., description="ログエントリ一覧")
-    total_count: int = Field(..., description="総ログ数")
\ No newline at end of file
+    total_count: int = Field(..., description="総ログ数")
+
+
+class AudioCoverageRequest(BaseModel):
+    """音声ファイルの処理状況（デバイス × 30分スロット）の取得条件"""
+    device_ids: List[str] = Field(..., min_length=1, max_length=1000, description="対象のデバイスID")
+    start_date: date = Field(..., description="開始日")
+    end_date: date = Field(..., description="終了日（この日を含む）")
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.end_date < self.start_date:
+            raise ValueError("end_dateはstart_date以降にしてください")
+        if (self.end_date - self.start_date).days >= 62:
+            raise ValueError("期間は62日以内にしてください")
+        return self
+
+
+class DeadLetterRequeueRequest(BaseModel):
+    """デッドレターの再投入条件（どちらも省略時はすべて）"""
+    backend: Optional[str] = Field(None, description="whisper / sed / opensmile")
+    file_paths: Optional[List[str]] = Field(None, min_length=1, max_length=10000, description="再投入するファイルパス")
+
+
+class BackfillStep(str, Enum):
+    """バックフィルで実行する処理"""
+    WHISPER = "whisper"
+    SED = "sed"
+    OPENSMILE = "opensmile"
+
+
+class BackfillRequest(BaseModel):
+    """過去データの一括再処理（バックフィル）の条件"""
+    device_ids: List[str] = Field(..., min_length=1, max_length=1000, description="対象のデバイスID")
+    start_date: date = Field(..., description="開始日")
+    end_date: date = Field(..., description="終了日（この日を含む）")
+    steps: List[BackfillStep] = Field(default_factory=lambda: list(BackfillStep), min_length=1, description="実行する処理")
+    concurrency: Optional[int] = Field(None, ge=1, description="同時に処理する単位の数（上流の同時実行数の一部に制限される）")
+    batch_size: Optional[int] = Field(None, ge=1, le=500, description="1回の解析API呼び出しで送るファイル数（省略時は学習したバッチサイズ）")
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.end_date < self.start_date:
+            raise ValueError("end_dateはstart_date以降にしてください")
+        if (self.end_date - self.start_date).days >= 366:
+            raise ValueError("期間は366日以内にしてください")
+        return self
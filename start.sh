@@ -30,7 +30,8 @@ echo "================================="
 echo ""
 
 # uvicornをバックグラウンドで起動し、ログをファイルに出力、PIDを保存
-nohup python3 -m uvicorn main:app --host 0.0.0.0 --port 9000 > admin_server.log 2>&1 & echo $! > .server.pid
+# ワーカー数は WEB_CONCURRENCY で指定（スケジューラーはロックを取得した1ワーカーのみが実行）
+nohup python3 -m uvicorn main:app --host 0.0.0.0 --port 9000 --workers ${WEB_CONCURRENCY:-1} > admin_server.log 2>&1 & echo $! > .server.pid
 
 # 起動確認
 sleep 2
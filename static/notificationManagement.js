@@ -227,14 +227,36 @@ function showBroadcastNotificationModal() {
                         <input type="radio" name="broadcast-target" value="all" checked class="form-radio">
                         <span class="ml-2">全ユーザー</span>
                     </label>
+                    <label class="inline-flex items-center">
+                        <input type="radio" name="broadcast-target" value="segment" class="form-radio">
+                        <span class="ml-2">条件指定</span>
+                    </label>
                     <label class="inline-flex items-center">
                         <input type="radio" name="broadcast-target" value="custom" class="form-radio">
                         <span class="ml-2">指定ユーザー</span>
                     </label>
                 </div>
             </div>
+            <div id="segment-section" class="hidden space-y-2">
+                <label class="block text-sm font-medium text-gray-700">ステータス</label>
+                <div class="space-x-3">
+                    <label class="inline-flex items-center"><input type="checkbox" name="segment-status" value="guest" class="form-checkbox"><span class="ml-1">ゲスト</span></label>
+                    <label class="inline-flex items-center"><input type="checkbox" name="segment-status" value="member" class="form-checkbox"><span class="ml-1">会員</span></label>
+                    <label class="inline-flex items-center"><input type="checkbox" name="segment-status" value="subscriber" class="form-checkbox"><span class="ml-1">サブスク会員</span></label>
+                </div>
+                <label class="block text-sm font-medium text-gray-700">アクティブなデバイス</label>
+                <select id="segment-active-device" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm">
+                    <option value="">指定しない</option>
+                    <option value="true">あり</option>
+                    <option value="false">なし</option>
+                </select>
+            </div>
             <div id="custom-users-section" class="hidden">
-                <label class="block text-sm font-medium text-gray-700">ユーザーID（カンマ区切り）</label>
+                <label class="block text-sm font-medium text-gray-700">ユーザー検索（名前・メール・ID）</label>
+                <input type="text" id="broadcast-user-search" placeholder="名前・メールアドレス・ユーザーIDで検索" autocomplete="off"
+                       class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm">
+                <div id="broadcast-user-search-results" class="mt-1 max-h-40 overflow-y-auto"></div>
+                <label class="block text-sm font-medium text-gray-700 mt-2">ユーザーID（カンマ区切り）</label>
                 <textarea id="broadcast-user-ids" rows="3" placeholder="164cba5a-dba6-4cbc-9b39-4eea28d98fa5,..." 
                           class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm"></textarea>
             </div>
@@ -283,45 +305,112 @@ function showBroadcastNotificationModal() {
                     customSection.classList.add('hidden');
                 }
             }
+            const segmentSection = document.getElementById('segment-section');
+            if (segmentSection) {
+                if (this.value === 'segment') {
+                    segmentSection.classList.remove('hidden');
+                } else {
+                    segmentSection.classList.add('hidden');
+                }
+            }
         });
     });
+    
+    // ユーザー検索（入力が止まってから検索する）
+    const searchInput = document.getElementById('broadcast-user-search');
+    if (searchInput) {
+        let searchTimer = null;
+        searchInput.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => searchBroadcastUsers(this.value), 200);
+        });
+    }
 }
 
-async function sendBroadcastNotification() {
-    const target = document.querySelector('input[name="broadcast-target"]:checked').value;
-    let userIds = [];
+async function searchBroadcastUsers(query) {
+    const resultsContainer = document.getElementById('broadcast-user-search-results');
+    if (!resultsContainer) return;
     
-    if (target === 'all') {
-        // 全ユーザーのIDを取得
-        try {
-            const response = await axios.get('/api/users/all');
-            userIds = response.data.map(user => user.user_id);
-        } catch (error) {
-            showNotification('ユーザーリストの取得に失敗しました', 'error');
+    if (!query.trim()) {
+        resultsContainer.innerHTML = '';
+        return;
+    }
+    
+    try {
+        const response = await axios.get('/api/users/search', { params: { q: query, per_page: 10 } });
+        const { items, total, truncated } = response.data;
+        
+        if (items.length === 0) {
+            resultsContainer.innerHTML = '<p class="text-sm text-gray-500 py-1">該当するユーザーがいません</p>';
             return;
         }
-    } else {
-        // 指定されたユーザーIDを解析
-        const userIdsText = document.getElementById('broadcast-user-ids').value;
-        userIds = userIdsText.split(',').map(id => id.trim()).filter(id => id);
+        
+        let html = items.map(user => `
+            <button type="button" data-action="add-broadcast-user" data-user-id="${user.user_id}"
+                    class="block w-full text-left px-2 py-1 text-sm hover:bg-blue-50 rounded">
+                ${user.name || '(名前なし)'} <span class="text-gray-500">${user.email || ''}</span>
+                <span class="text-xs text-gray-400">${user.user_id}</span>
+            </button>
+        `).join('');
+        if (total > items.length) {
+            html += `<p class="text-xs text-gray-500 px-2 py-1">${total}${truncated ? '+' : ''}件中${items.length}件を表示</p>`;
+        }
+        resultsContainer.innerHTML = html;
+    } catch (error) {
+        console.error('ユーザー検索エラー:', error);
+        resultsContainer.innerHTML = '<p class="text-sm text-red-500 py-1">ユーザー検索に失敗しました</p>';
     }
+}
+
+function addBroadcastUser(userId) {
+    const textarea = document.getElementById('broadcast-user-ids');
+    if (!textarea) return;
     
-    if (userIds.length === 0) {
-        showNotification('送信対象のユーザーが見つかりません', 'error');
-        return;
+    const userIds = textarea.value.split(',').map(id => id.trim()).filter(id => id);
+    if (!userIds.includes(userId)) {
+        userIds.push(userId);
+        textarea.value = userIds.join(',');
     }
-    
+}
+
+async function sendBroadcastNotification() {
+    const target = document.querySelector('input[name="broadcast-target"]:checked').value;
     const broadcastData = {
-        user_ids: userIds,
         type: document.getElementById('broadcast-type').value,
         title: document.getElementById('broadcast-title').value,
         message: document.getElementById('broadcast-message').value,
         triggered_by: 'admin'
     };
     
+    if (target === 'all') {
+        // 全ユーザー（対象の解決はサーバー側で行う）
+        broadcastData.segment = {};
+    } else if (target === 'segment') {
+        // 条件指定（対象の解決はサーバー側で行う）
+        const segment = {};
+        const statuses = Array.from(document.querySelectorAll('input[name="segment-status"]:checked')).map(input => input.value);
+        if (statuses.length > 0) {
+            segment.status = statuses;
+        }
+        const activeDevice = document.getElementById('segment-active-device').value;
+        if (activeDevice !== '') {
+            segment.has_active_device = activeDevice === 'true';
+        }
+        broadcastData.segment = segment;
+    } else {
+        // 指定されたユーザーIDを解析
+        const userIdsText = document.getElementById('broadcast-user-ids').value;
+        const userIds = userIdsText.split(',').map(id => id.trim()).filter(id => id);
+        if (userIds.length === 0) {
+            showNotification('送信対象のユーザーが見つかりません', 'error');
+            return;
+        }
+        broadcastData.user_ids = userIds;
+    }
+    
     try {
         const response = await axios.post('/api/notifications/broadcast', broadcastData);
-        showNotification(`${response.data.sent_count}件の通知を送信しました`, 'success');
+        showNotification(response.data.message, response.data.success ? 'success' : 'warning');
         closeModal();
         loadNotifications(); // 通知一覧を再読み込み
         updateNotificationStats(); // 統計を更新
@@ -493,6 +582,9 @@ function setupNotificationEventDelegation() {
             case 'send-broadcast-notification':
                 sendBroadcastNotification();
                 break;
+            case 'add-broadcast-user':
+                addBroadcastUser(button.dataset.userId);
+                break;
         }
     });
 }